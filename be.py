@@ -1,22 +1,25 @@
 import sys
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from threading import Thread
 import argparse
 import logging
 import os
-import redis
 
 import eventlet
 from src import app
-from src.bs_logic import run_business_logic
-from src.substrate_monitor import run_substrate_monitor
-from src.chain_utils import get_substrate_connection, parse_logger_config, generate_key_pair, parse_redis_config, init_redis
+from src.bs_logic import run_business_logic, run_business_logic_async
+from src.substrate_monitor import run_substrate_monitor, run_substrate_monitor_async
+from src.chain_utils import get_substrate_pool, parse_logger_config, generate_key_pair, parse_redis_config, init_redis
 from flask_socketio import SocketIO
 from src.logger import init_logger
 from src import thread_utils
 from src import charging_status_monitor
 from src import config_utils as ConfigUtils
-
-eventlet.monkey_patch()
+from src import wire_utils as WireUtils
+from src import redis_transport as RedisTransport
+from src.event_filter import EventFilter
+from src.constants import SETTLEMENT_PIPELINE, SETTLEMENT_BATCH, VERBOSITY_TIERS, VERBOSITY_DEBUG
 
 
 __author__ = 'peaq'
@@ -24,14 +27,21 @@ __author__ = 'peaq'
 RUNTIME_ENV = 'RUNTIME_ENV'
 RUNTIME_DEFAULT = 'dev'
 
+RUNTIME_THREAD = 'thread'
+RUNTIME_ASYNCIO = 'asyncio'
+# Executor threads the asyncio runtime never gets back: the substrate monitor subscription,
+# and the Redis reads of the business logic, the socketio gateway and the charging monitor
+EXECUTOR_RESERVED = 4
+
 
-def create_main_logic(socketio: SocketIO, r: redis.Redis, logger: logging.Logger, config: dict):
+def create_main_logic(socketio: SocketIO, r: RedisTransport.RedisTransport, logger: logging.Logger, config: dict):
     thread_utils.install(logger)
 
-    monitor_thread = Thread(target=run_substrate_monitor, args=(config['node_ws'], r))
+    monitor_thread = Thread(target=run_substrate_monitor, args=(config['node_ws'], r, config['event_filter']))
     business_logic_thread = Thread(target=run_business_logic,
                                    args=(r, logger, config))
-    read_redis_thread = Thread(target=app.redis_reader, args=(socketio, r))
+    read_redis_thread = Thread(target=app.redis_reader,
+                               args=(socketio, r, config['emit_window'] / 1000, config['emit_batch']))
     charging_monitor_thread = Thread(target=charging_status_monitor.run,
                                      args=(r, logger))
 
@@ -46,13 +56,39 @@ def create_main_logic(socketio: SocketIO, r: redis.Redis, logger: logging.Logger
     charging_monitor_thread.join()
 
 
+def create_main_logic_async(socketio: SocketIO, r: RedisTransport.RedisTransport, logger: logging.Logger, config: dict):
+    thread_utils.install(logger)
+    asyncio.run(run_main_logic_async(socketio, r, logger, config))
+
+
+async def run_main_logic_async(socketio: SocketIO, r: RedisTransport.RedisTransport, logger: logging.Logger, config: dict):
+    # Blocking calls (Redis reads, Substrate RPCs) share a fixed pool, however many sessions are open.
+    # The long running ones get their threads on top of the workers, so they cannot starve the handlers
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=EXECUTOR_RESERVED + config['workers'], thread_name_prefix='runtime'))
+
+    await asyncio.gather(
+        run_substrate_monitor_async(config['node_ws'], r, config['event_filter']),
+        run_business_logic_async(r, logger, config),
+        app.redis_reader_async(socketio, r, config['emit_window'] / 1000, config['emit_batch']),
+        charging_status_monitor.run_async(r, logger),
+    )
+
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'{value} is not at least 1')
+    return number
+
+
 def parse_arguement():
     parser = argparse.ArgumentParser()
     parser.add_argument('--url', help='backend service url',
                         type=str, default='127.0.0.1')
     parser.add_argument('--port', help='backend service port',
                         type=str, default='25566')
-    parser.add_argument('--node_ws', help="peaq node's url",
+    parser.add_argument('--node_ws', help="peaq node's url, local://<name>?block_time=<seconds> runs a stand-in node in the process",
                         type=str, default='ws://127.0.0.1:9944')
     parser.add_argument('--charging_time', help='stop the charging process after this seconds',
                         type=int, default=300)
@@ -62,21 +98,39 @@ def parse_arguement():
                         type=str, default='etc/redis.yaml')
     parser.add_argument('--did_path', help='did document path',
                         type=str, default='etc/did_doc.json')
+    parser.add_argument('--settlement', help='submit the spent and refund as back-to-back extrinsics or as one batch_all',
+                        type=str, choices=[SETTLEMENT_PIPELINE, SETTLEMENT_BATCH], default=SETTLEMENT_PIPELINE)
+    parser.add_argument('--runtime', help='run the loops as eventlet threads or as coroutines on one asyncio loop',
+                        type=str, choices=[RUNTIME_THREAD, RUNTIME_ASYNCIO], default=RUNTIME_THREAD)
+    parser.add_argument('--workers', help=f'executor threads of the asyncio runtime for the event handling and the chain calls, '
+                                          f'on top of the {EXECUTOR_RESERVED} that are always busy reading',
+                        type=positive_int, default=4)
+    parser.add_argument('--emit_window', help='milliseconds the socketio gateway gathers messages for the batch clients',
+                        type=int, default=20)
+    parser.add_argument('--emit_batch', help='most messages in one socketio batch',
+                        type=int, default=64)
+    parser.add_argument('--verbosity', help='what the business logic emits to the UI, every tier adds to the one before it',
+                        type=str, choices=VERBOSITY_TIERS, default=VERBOSITY_DEBUG)
     return parser.parse_args()
 
 
 if __name__ == '__main__':
     args = parse_arguement()
+    if args.runtime == RUNTIME_THREAD:
+        eventlet.monkey_patch()
 
     params = parse_logger_config(args.lconfig)
-    logger = init_logger(params[0], params[1], params[2], params[3], params[4])
+    logger = init_logger(params[0], params[1], params[2], params[3], params[4], params[5], params[6])
 
     params = parse_redis_config(args.rconfig)
     redis = init_redis(params[0], params[1], params[2])
+    WireUtils.set_wire_mode(params[3])
+    transport = RedisTransport.init_transport(redis, params[4], params[5], params[6])
 
-    # Test whether the node ws is available
+    # Test whether the node ws is available, the connection stays in the pool for the business logic
     try:
-        get_substrate_connection(args.node_ws).close()
+        with get_substrate_pool(args.node_ws).connection():
+            pass
     except ConnectionRefusedError:
         logger.error("⚠️  No target node running")
         sys.exit()
@@ -88,12 +142,24 @@ if __name__ == '__main__':
     else:
         kp_provider = generate_key_pair(logger)
 
-    be, socketio = app.create_app('secret', True, args.node_ws, kp_provider, redis, logger)
+    if args.runtime == RUNTIME_ASYNCIO:
+        async_mode, main_logic = 'threading', create_main_logic_async
+    else:
+        async_mode, main_logic = None, create_main_logic
+
+    be, socketio = app.create_app('secret', True, args.node_ws, kp_provider, transport, logger, async_mode)
     socketio.start_background_task(
-        create_main_logic, socketio, redis, logger, {
+        main_logic, socketio, transport, logger, {
             'node_ws': args.node_ws,
             'charging_time': args.charging_time,
             'kp_provider': kp_provider,
             'did_path': args.did_path,
+            'workers': args.workers,
+            'settlement': args.settlement,
+            'emit_window': args.emit_window,
+            'emit_batch': args.emit_batch,
+            'verbosity': args.verbosity,
+            # Filled by the business logic, read by the substrate monitor
+            'event_filter': EventFilter(),
         })
     socketio.run(be, debug=False, host=args.url, port=args.port)
@@ -1,57 +1,187 @@
 import json
+import time
+import asyncio
 import logging
-import redis
 
-from flask_socketio import SocketIO
-from flask import Flask, render_template
+from flask_socketio import SocketIO, join_room, leave_room
+from flask import Flask, Response, render_template
 from flask_cors import CORS
 
 from substrateinterface import Keypair
 import src.user_utils as UserUtils
-from google.protobuf.json_format import MessageToJson
+import src.wire_utils as WireUtils
+import src.redis_transport as RedisTransport
+import src.metrics as Metrics
+from google.protobuf.json_format import MessageToJson, MessageToDict
 from src.constants import REDIS_IN, REDIS_OUT
 
+# Every message of this provider goes to the provider room, a session message to its session room too
+ROOM_PROVIDER = 'provider'
+ROOM_SESSION_PREFIX = 'session:'
+# The same rooms for the clients opting in to batches
+ROOM_BATCH_PREFIX = 'batch:'
 
-def create_app(secret: str, debugging: bool, node_addr: str, kp: Keypair, r: redis.Redis, logger: logging.Logger) -> (Flask, SocketIO):
+# A batch is sent once its first message is this old, or once it is this long
+EMIT_WINDOW = 0.02
+EMIT_BATCH = 64
+BATCH_EVENT = 'batch'
+
+
+def create_app(secret: str, debugging: bool, node_addr: str, kp: Keypair, r: RedisTransport.RedisTransport, logger: logging.Logger,
+               async_mode: str = None) -> (Flask, SocketIO):
     app = Flask(__name__)
     # For now, we allow CORS for all domains on all routes
     CORS(app)
     app.config['SECRET_KEY'] = secret
     app.config['DEBUG'] = debugging
 
-    socketio = SocketIO(app, async_mode=None, logger=True, engineio_logger=True, cors_allowed_origins='*')
+    socketio = SocketIO(app, async_mode=async_mode, logger=True, engineio_logger=True, cors_allowed_origins='*')
 
     @app.route('/')
     def index():
         return render_template('index.html')
 
+    @app.route('/metrics')
+    def metrics():
+        return Response(Metrics.REGISTRY.expose(), content_type=Metrics.CONTENT_TYPE)
+
+    # Every connected client is in the room None of the namespace
+    Metrics.WEBSOCKET_CLIENTS.set_function(
+        lambda: len(socketio.server.manager.rooms.get('/', {}).get(None, {})) if socketio.server else 0)
+
     @socketio.on('connect')
     def connect():
         logger.info('Client connected')
+        # Until it picks its rooms, a client sees everything as before
+        join_room(ROOM_PROVIDER)
 
     @socketio.on('disconnect')
     def disonnect():
         logger.info('Client disconnect')
 
+    def get_rooms(data) -> ([str], bool):
+        m = json.loads(data) if isinstance(data, str) else data
+        rooms = []
+        if m.get('session'):
+            rooms.append(f'{ROOM_SESSION_PREFIX}{m["session"]}')
+        if m.get('provider'):
+            if m['provider'] != kp.ss58_address:
+                logger.error(f'there is no room for the provider {m["provider"]}')
+            else:
+                rooms.append(ROOM_PROVIDER)
+        return rooms, bool(m.get('batch'))
+
+    @socketio.on('subscribe')
+    def subscribe(data):
+        # With batch, the messages of these rooms come as arrays in 'batch' events
+        rooms, batch = get_rooms(data)
+        for room in rooms:
+            leave_room(room if batch else f'{ROOM_BATCH_PREFIX}{room}')
+            join_room(f'{ROOM_BATCH_PREFIX}{room}' if batch else room)
+
+    @socketio.on('unsubscribe')
+    def unsubscribe(data):
+        rooms, _ = get_rooms(data)
+        for room in rooms:
+            leave_room(room)
+            leave_room(f'{ROOM_BATCH_PREFIX}{room}')
+
     @socketio.on('json')
     def handle_requests(data):
         m = json.loads(data)
         data_to_send = UserUtils.create_user_request(m)
-        r.publish(REDIS_IN, data_to_send.encode('ascii'))
+        # The consumer address routes the request to its charging session
+        r.publish(REDIS_IN, data_to_send, m.get('consumer', ''))
 
     return app, socketio
 
 
-def redis_reader(sock: SocketIO, r: redis.Redis):
-    subcriber = r.pubsub()
-    subcriber.subscribe(REDIS_OUT)
+def redis_reader(sock: SocketIO, r: RedisTransport.RedisTransport,
+                 window: float = EMIT_WINDOW, size: int = EMIT_BATCH):
+    # The session messages come with their session key, so they can go to their room
+    subcriber = r.subscribe(REDIS_OUT, RedisTransport.SCOPE_ALL, 'gateway')
+    batcher = EmitBatcher(sock, window, size)
+
+    while True:
+        for message in subcriber.read(batcher.wait_time()):
+            emit_message(sock, message, batcher)
+            subcriber.ack(message)
+            batcher.flush_due()
+        batcher.flush_due()
+
+
+async def redis_reader_async(sock: SocketIO, r: RedisTransport.RedisTransport,
+                             window: float = EMIT_WINDOW, size: int = EMIT_BATCH):
+    loop = asyncio.get_running_loop()
+    subcriber = r.subscribe(REDIS_OUT, RedisTransport.SCOPE_ALL, 'gateway')
+    batcher = EmitBatcher(sock, window, size)
 
     while True:
-        event_data = subcriber.get_message(True, timeout=30000.0)
+        messages = await loop.run_in_executor(None, subcriber.read, batcher.wait_time())
+        for message in messages:
+            emit_message(sock, message, batcher)
+            subcriber.ack(message)
+            batcher.flush_due()
+        batcher.flush_due()
+
+
+class EmitBatcher():
+    '''
+    Gathers the messages for the clients in batch rooms and sends every such client
+    one array frame per window, in the order the messages came
+    '''
+    def __init__(self, sock: SocketIO, window: float, size: int):
+        self._sock = sock
+        self._window = window
+        self._size = size
+        # (rooms, item) in arrival order
+        self._pending = []
+        self._deadline = None
+
+    def add(self, rooms: [str], item: dict):
+        if not self._pending:
+            self._deadline = time.monotonic() + self._window
+        self._pending.append((rooms, item))
+
+    def wait_time(self) -> float:
+        if not self._pending:
+            return RedisTransport.READ_TIMEOUT
+        return max(self._deadline - time.monotonic(), 0)
+
+    def flush_due(self):
+        if self._pending and (len(self._pending) >= self._size or time.monotonic() >= self._deadline):
+            self.flush()
+
+    def flush(self):
+        manager = self._sock.server.manager
+        frames = {}
+        for rooms, item in self._pending:
+            for sid, _ in manager.get_participants('/', rooms):
+                frames.setdefault(sid, []).append(item)
+        self._pending = []
+
+        for sid, items in frames.items():
+            self._sock.emit(BATCH_EVENT, items, to=sid)
+
+
+def get_message_rooms(message: RedisTransport.Message) -> [str]:
+    if message.session_key:
+        return [ROOM_PROVIDER, f'{ROOM_SESSION_PREFIX}{message.session_key}']
+    return [ROOM_PROVIDER]
+
 
-        if not event_data:
-            continue
+def emit_message(sock: SocketIO, message: RedisTransport.Message, batcher: EmitBatcher):
+    message_rooms = get_message_rooms(message)
+    occupied = sock.server.manager.rooms.get('/', {})
+    rooms = [_ for _ in message_rooms if _ in occupied]
+    batch_rooms = [f'{ROOM_BATCH_PREFIX}{_}' for _ in message_rooms if f'{ROOM_BATCH_PREFIX}{_}' in occupied]
+    # Nobody watches, so the message is not even decoded
+    if not rooms and not batch_rooms:
+        return
 
-        event = UserUtils.decode_hex_event(event_data['data'].decode('ascii'))
-        socket_type = UserUtils.convert_socket_type(event)
-        sock.emit(socket_type, MessageToJson(event))
+    event = WireUtils.decode_event(message.data)
+    socket_type = UserUtils.convert_socket_type(event)
+    if rooms:
+        sock.emit(socket_type, MessageToJson(event), to=rooms)
+    if batch_rooms:
+        batcher.add(batch_rooms, {'type': socket_type, 'data': MessageToDict(event)})
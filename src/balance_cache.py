@@ -0,0 +1,84 @@
+import time
+import logging
+import threading
+from concurrent.futures import Future
+
+from src import chain_utils as ChainUtils
+from src.substrate_pool import SubstratePool
+
+
+class BalanceCache():
+    '''
+    Free balances at the best block. Every new head drops them, and concurrent
+    lookups of one address at one block wait for the same query.
+    '''
+    def __init__(self, ws_url: str, pool: SubstratePool, logger: logging.Logger):
+        self._ws_url = ws_url
+        self._pool = pool
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._head_number = None
+        # (address, block hash) -> Future of the balance, ('head', block number) -> Future of the hash
+        self._entries = {}
+        self._thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def run(self):
+        while True:
+            substrate = None
+            try:
+                substrate = ChainUtils.get_substrate_connection(self._ws_url)
+                substrate.subscribe_block_headers(self.on_new_head)
+            except Exception as err:
+                self._logger.error(f'lost the new heads, balances are not cached: {err}')
+            finally:
+                # Every retry opens a new websocket, the old one must not linger
+                if substrate is not None:
+                    substrate.close()
+            self.on_new_head(None, 0, None)
+            time.sleep(ChainUtils.RETRY_PERIOD)
+
+    def on_new_head(self, obj, update_nr, subscription_id):
+        with self._lock:
+            self._head_number = obj['header']['number'] if obj else None
+            self._entries = {}
+
+    def get(self, ss58_addr: str) -> int:
+        with self._lock:
+            head_number = self._head_number
+        if head_number is None:
+            # Nothing tells us when a balance gets stale, so nothing is cached
+            return self._query(ss58_addr, None)
+
+        # The new heads come without their hash
+        block_hash = self._coalesce(('head', head_number), lambda: self._block_hash(head_number))
+        return self._coalesce((ss58_addr, block_hash), lambda: self._query(ss58_addr, block_hash))
+
+    def _block_hash(self, block_number: int) -> str:
+        with self._pool.connection() as substrate:
+            return substrate.get_block_hash(block_number)
+
+    def _query(self, ss58_addr: str, block_hash: str) -> int:
+        with self._pool.connection() as substrate:
+            return ChainUtils.get_station_balance(substrate, self._logger, ss58_addr, block_hash)
+
+    def _coalesce(self, key: tuple, fetch):
+        with self._lock:
+            future = self._entries.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = self._entries[key] = Future()
+        if not is_owner:
+            return future.result()
+
+        try:
+            future.set_result(fetch())
+        except Exception as err:
+            # Failures are not cached, the next lookup tries again
+            with self._lock:
+                if self._entries.get(key) is future:
+                    del self._entries[key]
+            future.set_exception(err)
+        return future.result()
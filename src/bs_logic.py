@@ -1,30 +1,49 @@
 import json
+import time
+import asyncio
+import threading
 import datetime
 import logging
-import redis
+from concurrent.futures import Future
 
 from substrateinterface.utils.ss58 import ss58_encode
-import transitions
-from src.chain_utils import calculate_multi_sig, send_token_multisig_wallet
-from src.chain_utils import compose_delivery_info, publish_did, read_did, republish_did, get_station_balance
+from src.chain_utils import calculate_multi_sig
+from src.chain_utils import compose_delivery_info, publish_did, read_did, republish_did
 from src import chain_utils as ChainUtils
 from src import p2p_utils as P2PUtils
 from src import user_utils as UserUtils
 from src import did_utils as DIDUtils
+from src import wire_utils as WireUtils
+from src import redis_transport as RedisTransport
 from src import charging_utils as CharginUtils
+from src.charging_session import ChargingSession, SessionRegistry, APPROVAL_SPENT, APPROVAL_REFUND
+from src.receipt_tracker import ReceiptTracker, when_all
+from src.balance_cache import BalanceCache
+from src.event_dispatcher import EventDispatcher
+from src.scheduler import Scheduler
+from src import metrics as Metrics
 from peaq_network_ev_charging_message_format.python import p2p_message_format_pb2 as P2PMessage
-from src.constants import REDIS_OUT, REDIS_IN
+from src.constants import REDIS_OUT, REDIS_IN, SETTLEMENT_BATCH, CHARGING_STATUS_POLLING_TIME
+from src.constants import VERBOSITY_TIERS, VERBOSITY_EVENTS, VERBOSITY_SUMMARY, VERBOSITY_DEBUG
 
+DISPATCH_STATS_PERIOD = 60
+# An unknown event id is counted by its number
+EVENT_NAMES = {value: name for name, value in P2PMessage.EventType.items()}
 
-def run_business_logic(r: redis.Redis, logger: logging.Logger, config: dict):
+
+def run_business_logic(r: RedisTransport.RedisTransport, logger: logging.Logger, config: dict):
     business_logic = BusinessLogic(r, logger, config)
     business_logic.start()
 
 
-class BusinessLogic():
-    states = ['idle', 'verified', 'charging', 'charged', 'approving']
+async def run_business_logic_async(r: RedisTransport.RedisTransport, logger: logging.Logger, config: dict):
+    loop = asyncio.get_running_loop()
+    business_logic = await loop.run_in_executor(None, BusinessLogic, r, logger, config)
+    await business_logic.start_async()
 
-    def __init__(self, r: redis.Redis, logger: logging.Logger, config: dict):
+
+class BusinessLogic():
+    def __init__(self, r: RedisTransport.RedisTransport, logger: logging.Logger, config: dict):
         self._logger = logger
         self._redis = r
         self._ws_url = config['node_ws']
@@ -32,448 +51,520 @@ class BusinessLogic():
         self._kp = config['kp_provider']
         self._did_path = config['did_path']
 
-        self._substrate = ChainUtils.get_substrate_connection(self._ws_url)
-        self._machine = transitions.Machine(
-            model=self,
-            states=BusinessLogic.states,
-            initial='idle'
-        )
+        self._pool = ChainUtils.get_substrate_pool(self._ws_url)
         self._multi_threshold = 2
-
-        self._machine.add_transition(trigger='check', source='idle', dest='verified',
-                                     conditions=['is_allow_charging'])
-        self._machine.add_transition(trigger='start_charging', source='verified', dest='charging')
-        self._machine.add_transition(trigger='end_charging', source='charging', dest='charged')
-        self._machine.add_transition(trigger='wait_approval', source='charged', dest='approving')
-        self._machine.add_transition(trigger='receive_approvals', source='approving', dest='idle')
-        self._machine.on_enter_idle('reset')
-
-        self.reset()
-
-    def __del__(self):
-        if self._substrate:
-            self._substrate.close()
-
-    def reset(self):
-        self._charging_info = {
-            'consumer': '',
-            'multisig_pk': '',
-            'deposit_token': 0,
-            'provider_got': False,
-            'provider_got_call_hash': '',
-            'consumer_got': False,
-            'consumer_got_call_hash': '',
-            'spent_token': 0,
-            'refund_token': 0,
-            'charging_start_time': None,
-            'charing_wait_time': 0,
-            'charging_end_time': None,
-        }
-
-    def update_charging_start(self, start_time: datetime.datetime, wait_time: int):
-        self._charging_info['charging_start_time'] = start_time
-        self._charging_info['charing_wait_time'] = wait_time
-
-    def calculate_charging_status_data(self, now_time: datetime.datetime) -> dict:
-        charging_result = CharginUtils.calculate_charging_result(
-            self._charging_info['charging_start_time'],
-            now_time,
-            self._charging_info['charing_wait_time'],
-            self._charging_info['deposit_token']
-        )
-        progress = CharginUtils.calculate_charging_status(
-            self._charging_info['charging_start_time'],
-            now_time,
-            self._charging_info['charing_wait_time']
-        )
-        return {
-            'charging_period': str(charging_result['charging_period']),
-            'energy_consumption': charging_result['energy_consumption'],
-            'spent_token': charging_result['spent_token'],
-            'progress': progress,
-        }
-
-    def is_all_approvals(self) -> bool:
-        return self._charging_info['consumer_got'] and self._charging_info['provider_got']
+        self._settlement = config['settlement']
+        self._verbosity = VERBOSITY_TIERS.index(config['verbosity'])
+        self._sessions = SessionRegistry()
+        self._filter = config['event_filter']
+        # Receipt callbacks run on the tracker thread, so they take turns with the events
+        self._lock = threading.RLock()
+        self._tracker = ReceiptTracker(self._ws_url, self._logger)
+        self._tracker.start()
+        self._balances = BalanceCache(self._ws_url, self._pool, self._logger)
+        self._balances.start()
+        self._dispatcher = self.create_dispatcher()
+        # One thread ticks the charging status of every session, a session costs a timer
+        self._scheduler = Scheduler(self._logger)
+        self._scheduler.start()
+        self._status_timers = {}
+        self._dispatch_reported = time.monotonic()
+        Metrics.SESSIONS.set_function(self.count_sessions)
+
+    def count_sessions(self) -> dict:
+        counts = dict.fromkeys(ChargingSession.states, 0)
+        for session in self._sessions.sessions():
+            counts[session.state] = counts.get(session.state, 0) + 1
+        return counts
+
+    def stop_status_ticks(self, session: ChargingSession):
+        timer = self._status_timers.pop(session.key, None)
+        if timer:
+            timer.cancel()
+
+    def close_session(self, session: ChargingSession):
+        self.stop_status_ticks(session)
+        self._sessions.remove(session.key)
+        self._filter.unwatch(session.key)
+        self._logger.info(f'session {session.key} closed, {len(self._sessions)} sessions open')
 
     def is_allow_charging(self, data: dict) -> bool:
-        token = get_station_balance(self._substrate, self._logger, data['multisig_pk'])
+        token = self._balances.get(data['multisig_pk'])
         return token >= data['deposit_token']
 
     def is_service_requested_event(self, p2p_event: P2PMessage.Event, interested_addr: str) -> bool:
         return P2PUtils.is_service_requested_event(p2p_event) and \
             p2p_event.service_requested_data.provider == interested_addr
 
-    def is_consumer_refund_approve_event(self, event: P2PMessage.Event, charging_info: str) -> bool:
-        if event.event_id != P2PMessage.RECEIVE_CHAIN_EVENT or \
-           event.chain_event_data.event_id != 'MultisigExecuted':
-            return False
-        attributes = json.loads(event.chain_event_data.attributes)
-        event_sign_pk = ss58_encode(attributes[0])
-        event_call_hash = attributes[-2]
-        return charging_info['consumer'] == event_sign_pk and \
-            charging_info['consumer_got_call_hash'] == event_call_hash
-
-    def is_consumer_spent_approve_event(self, event: P2PMessage.Event, charging_info: dict) -> bool:
-        if event.event_id != P2PMessage.RECEIVE_CHAIN_EVENT or \
-           event.chain_event_data.event_id != 'MultisigExecuted':
-            return False
-        attributes = json.loads(event.chain_event_data.attributes)
-        event_sign_pk = ss58_encode(attributes[0])
-        event_call_hash = attributes[-2]
-        return charging_info['consumer'] == event_sign_pk and \
-            charging_info['provider_got_call_hash'] == event_call_hash
-
     def emit_out(self, data: dict):
         self._redis.publish(REDIS_OUT, data)
         self._logger.info(f'{data}')
 
-    def emit_log(self, log_data: dict):
+    def is_verbose(self, tier: str) -> bool:
+        return VERBOSITY_TIERS.index(tier) <= self._verbosity
+
+    def emit_log(self, log_data: dict, session_key: str = '', tier: str = VERBOSITY_SUMMARY):
+        if not self.is_verbose(tier):
+            return
         data_to_send = UserUtils.create_log_data(log_data)
-        self._redis.publish(REDIS_OUT, data_to_send)
+        self._redis.publish(REDIS_OUT, data_to_send, session_key)
         self._logger.info(f'log: {log_data}')
 
-    def emit_event(self, event_data: dict):
+    def emit_event(self, event_data: dict, session_key: str = ''):
+        if not self.is_verbose(VERBOSITY_EVENTS):
+            return
         data_to_send = UserUtils.create_event_data(event_data)
-        self._redis.publish(REDIS_OUT, data_to_send)
+        self._redis.publish(REDIS_OUT, data_to_send, session_key)
         self._logger.info(f'event: {event_data}')
 
-    def emit_deposit_verified(self, data: dict):
-        named_data = {'event': 'DepositVerified', 'state': self.state}
+    def emit_deposit_verified(self, session: ChargingSession, data: dict):
+        named_data = {'event': 'DepositVerified', 'state': session.state}
         named_data.update(data)
-        self.emit_event(named_data)
+        self.emit_event(named_data, session.key)
 
-    def emit_service_requested(self, data: dict):
-        named_data = {'event': 'ServiceRequested', 'state': self.state}
+    def emit_service_requested(self, session: ChargingSession, data: dict):
+        named_data = {'event': 'ServiceRequested', 'state': session.state}
         named_data.update(data)
-        self.emit_event(named_data)
+        self.emit_event(named_data, session.key)
 
-    def emit_service_delivered(self, data: dict):
-        named_data = {'event': 'ServiceDelivered', 'state': self.state}
+    def emit_service_delivered(self, session: ChargingSession, data: dict):
+        named_data = {'event': 'ServiceDelivered', 'state': session.state}
         named_data.update(data)
-        self.emit_event(named_data)
+        self.emit_event(named_data, session.key)
 
-    def emit_client_charging_status(self, data: dict):
-        named_data = {'event': 'ChargingStatus', 'state': self.state}
+    def emit_client_charging_status(self, session: ChargingSession, data: dict):
+        named_data = {'event': 'ChargingStatus', 'state': session.state}
         named_data.update(data)
-        self.emit_event(named_data)
+        self.emit_event(named_data, session.key)
 
-    def emit_balances_transferd(self, data: dict):
-        named_data = {'event': 'BalancesTransfered', 'state': self.state}
+    def emit_balances_transferd(self, session: ChargingSession, data: dict):
+        named_data = {'event': 'BalancesTransfered', 'state': session.state}
         named_data.update(data)
-        self.emit_event(named_data)
+        self.emit_event(named_data, session.key)
 
     def republish_did(self):
-        did_exist = False
-        try:
-            self._logger.info('reading did...')
-            r = read_did(self._substrate, self._logger, self._kp)
-            if r.is_success and \
-               len([_ for _ in r.triggered_events if _.value['event_id'] == 'AttributeRead']):
-                did_exist = True
-        except Exception as err:
-            self._logger.error(f'failed to read did: {err}')
+        with self._pool.connection() as substrate:
+            did_exist = False
+            try:
+                self._logger.info('reading did...')
+                r = read_did(substrate, self._logger, self._kp)
+                if r.is_success and \
+                   len([_ for _ in r.triggered_events if _.value['event_id'] == 'AttributeRead']):
+                    did_exist = True
+            except Exception as err:
+                self._logger.error(f'failed to read did: {err}')
 
-        try:
-            if did_exist:
-                receipt = republish_did(self._substrate, self._logger, self._kp, self._did_path)
-            else:
-                receipt = publish_did(self._substrate, self._logger, self._kp, self._did_path)
+            try:
+                if did_exist:
+                    receipt = republish_did(substrate, self._logger, self._kp, self._did_path)
+                else:
+                    receipt = publish_did(substrate, self._logger, self._kp, self._did_path)
 
-            if receipt.is_success:
-                data = UserUtils.create_republish_did_ack(
-                    self._kp.ss58_address,
-                    True,
-                    '')
-                self.emit_out(data)
-            else:
-                if r.error_message is not None:
+                if receipt.is_success:
                     data = UserUtils.create_republish_did_ack(
                         self._kp.ss58_address,
-                        False,
-                        receipt.error_message)
+                        True,
+                        '')
                     self.emit_out(data)
                 else:
-                    data = UserUtils.create_republish_did_ack(
-                        self._kp.ss58_address,
-                        False,
-                        'failed to publish did for unknown reason')
-                    self.emit_out(data)
-        except Exception as err:
-            self._logger.error(f'error during publishing occurred: {err}')
-            data = UserUtils.create_republish_did_ack(
-                self._kp.ss58_address,
-                False,
-                'something unexpected happen')
-            self.emit_out(data)
+                    if r.error_message is not None:
+                        data = UserUtils.create_republish_did_ack(
+                            self._kp.ss58_address,
+                            False,
+                            receipt.error_message)
+                        self.emit_out(data)
+                    else:
+                        data = UserUtils.create_republish_did_ack(
+                            self._kp.ss58_address,
+                            False,
+                            'failed to publish did for unknown reason')
+                        self.emit_out(data)
+            except Exception as err:
+                self._logger.error(f'error during publishing occurred: {err}')
+                data = UserUtils.create_republish_did_ack(
+                    self._kp.ss58_address,
+                    False,
+                    'something unexpected happen')
+                self.emit_out(data)
 
-    def process_event(self, event):
-        if event.event_id == P2PMessage.RECEIVE_CHAIN_EVENT:
-            event_id = event.chain_event_data.event_id
-            attributes = json.loads(event.chain_event_data.attributes)
-            if self.is_consumer_refund_approve_event(event, self._charging_info):
-                if not self.is_approving():
-                    self._logger.error(f'received "approve refund event" event while not in state "approving" '
-                                       f' event: {event_id}: {attributes}')
-                    return
-
-                if 'Ok' not in attributes[-1]:
-                    self.emit_log({
-                        'desc': 'the consumer refund approval has an error, please check',
-                        'time_point': attributes[1],
-                        'error': attributes[-1]
-                    })
-                    return
-                self._charging_info['consumer_got'] = True
-                self.emit_balances_transferd({
-                    'from': self._charging_info['multisig_pk'],
-                    'to': self._charging_info['consumer'],
-                    'value': self._charging_info['refund_token'],
-                })
-                self.emit_log({'state': self.state, 'data': 'receive multisig -> conumser, approval'})
-
-                if self.is_all_approvals():
-                    self.receive_approvals()
-                    self.emit_log({'state': self.state, 'data': 'charging process finish!'})
-
-            if self.is_consumer_spent_approve_event(event, self._charging_info):
-                if not self.is_approving():
-                    self._logger.error(f'received "consumer spent event" event while not in state "approving" '
-                                       f'event: {event_id}: {attributes}')
-                    return
-
-                if 'Ok' not in attributes[-1]:
-                    self.emit_log({
-                        'desc': 'the consumer spent approval has an error, please check',
-                        'time_point': attributes[1],
-                        'error': attributes[-1]
-                    })
-                    return
-                self._charging_info['provider_got'] = True
-                self.emit_balances_transferd({
-                    'from': self._charging_info['multisig_pk'],
-                    'to': self._kp.ss58_address,
-                    'value': self._charging_info['spent_token'],
-                })
-                self.emit_log({'state': self.state, 'data': 'receive multisig -> provider, approval'})
-
-                if self.is_all_approvals():
-                    self.receive_approvals()
-                    self.emit_log({'state': self.state, 'data': 'charging process finish!'})
-            self.emit_log({'state': self.state, 'data': f'{event_id}'})
-            self._logger.info(f'Event: {event_id}: {attributes}')
+    def create_dispatcher(self) -> EventDispatcher:
+        dispatcher = EventDispatcher()
+        dispatcher.register_sub_type(P2PMessage.RECEIVE_CHAIN_EVENT, lambda event: event.chain_event_data.event_id)
+        dispatcher.register(P2PMessage.RECEIVE_CHAIN_EVENT, self.on_chain_event)
+        dispatcher.register(P2PMessage.RECEIVE_CHAIN_EVENT, self.on_multisig_executed, 'MultisigExecuted')
+        dispatcher.register(P2PMessage.GET_BALANCE, self.on_get_balance)
+        dispatcher.register(P2PMessage.GET_PK, self.on_get_pk)
+        dispatcher.register(P2PMessage.REPUBLISH_DID, self.on_republish_did)
+        dispatcher.register(P2PMessage.RECONNECT, self.on_reconnect)
+        dispatcher.register(P2PMessage.STOP_CHARGE, self.on_stop_charge)
+        dispatcher.register(P2PMessage.EventType.SERVICE_REQUESTED, self.on_service_requested)
+        dispatcher.register(P2PMessage.EventType.CHARGING_STATUS, self.on_charging_status)
+        return dispatcher
+
+    def process_event(self, event, session_key: str = ''):
+        if event.event_id != P2PMessage.RECEIVE_CHAIN_EVENT:
+            self._logger.info(f'Event: {event}')
+        Metrics.EVENTS_PROCESSED.inc(EVENT_NAMES.get(event.event_id, str(event.event_id)))
+        self._dispatcher.dispatch(event, session_key)
+
+    def log_dispatch_stats(self):
+        now = time.monotonic()
+        if now - self._dispatch_reported < DISPATCH_STATS_PERIOD:
             return
+        self._dispatch_reported = now
+        for name, stats in self._dispatcher.stats().items():
+            if stats['count']:
+                self._logger.info(f'handler {name}: {stats["count"]} calls, {stats["total"]:.3f}s total, '
+                                  f'{stats["mean"] * 1000:.2f}ms mean, {stats["max"] * 1000:.2f}ms max')
+
+    def log_chain_event(self, session: ChargingSession, event_id: str, attributes: list):
+        # The chain events of no session are noise unless debugging
+        self.emit_log({'state': session.state if session else 'idle', 'data': f'{event_id}'},
+                      session.key if session else '', VERBOSITY_SUMMARY if session else VERBOSITY_DEBUG)
+        self._logger.info(f'Event: {event_id}: {attributes}')
+
+    def on_chain_event(self, event: P2PMessage.Event, session_key: str):
+        self.log_chain_event(None, event.chain_event_data.event_id, json.loads(event.chain_event_data.attributes))
+
+    def on_multisig_executed(self, event: P2PMessage.Event, session_key: str):
+        event_id = event.chain_event_data.event_id
+        attributes = json.loads(event.chain_event_data.attributes)
+        # Only the consumer's own approval counts, the signer is the session key
+        session, leg = self._sessions.find_approval(ss58_encode(attributes[0]), attributes[-2])
 
-        if event.event_id == P2PMessage.GET_BALANCE:
-            try:
-                balance = get_station_balance(self._substrate, self._logger, self._kp.ss58_address)
-                data = UserUtils.create_get_balance_ack(str(balance), True, '')
-                self.emit_out(data)
-            except Exception as e:
-                self._logger.error(f'exception happen when acquiring balance: {e}')
-                data = UserUtils.create_get_balance_ack(str(0), False, f'error: {e}')
-                self.emit_out(data)
-        if event.event_id == P2PMessage.GET_PK:
-            data = UserUtils.create_get_pk_ack(self._kp.ss58_address, True, '')
+        if session and not self.receive_approval(session, leg, event_id, attributes):
+            return
+        self.log_chain_event(session, event_id, attributes)
+
+    def on_get_balance(self, event: P2PMessage.Event, session_key: str):
+        try:
+            balance = self._balances.get(self._kp.ss58_address)
+            data = UserUtils.create_get_balance_ack(str(balance), True, '')
+            self.emit_out(data)
+        except Exception as e:
+            self._logger.error(f'exception happen when acquiring balance: {e}')
+            data = UserUtils.create_get_balance_ack(str(0), False, f'error: {e}')
             self.emit_out(data)
-        if event.event_id == P2PMessage.REPUBLISH_DID:
-            self.republish_did()
-        if event.event_id == P2PMessage.RECONNECT:
-            self.reconnect()
-        if event.event_id == P2PMessage.STOP_CHARGE:
-            if not self.is_charging():
-                self._logger.error('received "finished charging" event while not in state "charging"'
-                                   f'event: {event.stop_charge_data.success}')
-                return
 
-            self.end_charging()
-            P2PUtils.send_stop_charing_ack(self._redis, 'Stop charing received')
-            self._logger.info('ended charging')
-            self.emit_log({
-                'state': self.state,
-                'data': 'Charging end',
-                'info': event.stop_charge_data.success
-            })
+    def on_republish_did(self, event: P2PMessage.Event, session_key: str):
+        self.republish_did()
 
-            self._charging_info['charging_end_time'] = datetime.datetime.now()
-            charging_result = CharginUtils.calculate_charging_result(
-                self._charging_info['charging_start_time'],
-                self._charging_info['charging_end_time'],
-                self._charging_info['charing_wait_time'],
-                self._charging_info['deposit_token']
-            )
-            spent_token = charging_result['spent_token']
-            refund_token = charging_result['refund_token']
-            charging_period = charging_result['charging_period']
-            energy_consumption = charging_result['energy_consumption']
-
-            self._charging_info.update({
-                'spent_token': spent_token,
-                'refund_token': refund_token
-            })
-            self.emit_log({
-                'state': self.state,
-                'data': '{}, {}'.format(
-                    f'spent: {spent_token}, refund: {refund_token}',
-                    f'charging period: {charging_period}, energy consumption: {energy_consumption}')
-            })
+    def on_reconnect(self, event: P2PMessage.Event, session_key: str):
+        self.reconnect()
 
-            # Send the spent + delivier
-            spent_info = send_token_multisig_wallet(
-                self._substrate, self._logger,
-                self._kp, spent_token, self._kp.ss58_address,
-                [self._charging_info['consumer']], self._multi_threshold)
-            self.emit_log({'state': self.state, 'data': 'Charging sends spent for multisig'})
-
-            # Send the refund + delivier
-            refund_info = send_token_multisig_wallet(
-                self._substrate, self._logger,
-                self._kp, refund_token, self._charging_info['consumer'],
-                [self._charging_info['consumer']], self._multi_threshold)
-            self.emit_log({'state': self.state, 'data': 'Charging sends refund for multisig'})
-
-            self._charging_info.update({
-                'provider_got_call_hash': spent_info['call_hash'],
-                'consumer_got_call_hash': refund_info['call_hash']
-            })
+    def on_get_pk(self, event: P2PMessage.Event, session_key: str):
+        data = UserUtils.create_get_pk_ack(self._kp.ss58_address, True, '')
+        self.emit_out(data)
 
-            ChainUtils.send_service_deliver(
-                self._substrate, self._logger, self._kp, self._charging_info['consumer'],
-                compose_delivery_info(refund_token, refund_info),
-                compose_delivery_info(spent_token, spent_info))
+    def on_stop_charge(self, event: P2PMessage.Event, session_key: str):
+        session = self._sessions.resolve(session_key)
+        if session is None:
+            self._logger.error(f'received "finished charging" event for unknown session "{session_key}", '
+                               f'{len(self._sessions)} sessions open')
+            return
+        if not session.is_charging():
+            self._logger.error('received "finished charging" event while not in state "charging"'
+                               f'event: {event.stop_charge_data.success}')
+            return
 
-            P2PUtils.send_service_deliver(
-                self._redis, self._kp, self._charging_info['consumer'],
-                compose_delivery_info(refund_token, refund_info),
-                compose_delivery_info(spent_token, spent_info))
+        self.end_charging(session, event)
 
-            self.emit_service_delivered({
-                'provider': self._kp.ss58_address,
-                'consumer': self._charging_info['consumer'],
-                'refund_info': compose_delivery_info(refund_token, refund_info),
-                'spent_info': compose_delivery_info(spent_token, spent_info),
-            })
+    def on_service_requested(self, event: P2PMessage.Event, session_key: str):
+        if self.is_service_requested_event(event, self._kp.ss58_address):
+            self.request_service(event)
 
-            self.wait_approval()
-            self.emit_log({'state': self.state, 'data': 'User\'s approval wait'})
+    def on_charging_status(self, event: P2PMessage.Event, session_key: str):
+        session = self._sessions.resolve(session_key)
+        if session is None:
+            self._logger.error(f'received "charging status" event for unknown session "{session_key}"')
+            return
+        self.emit_charging_status(session)
+
+    def tick_charging_status(self, session: ChargingSession):
+        with self._lock:
+            if session.is_charging():
+                self.emit_charging_status(session)
+
+    def emit_charging_status(self, session: ChargingSession):
+        now_time = datetime.datetime.now()
+        charging_status_data = session.calculate_charging_status_data(now_time)
+        self.emit_client_charging_status(session, charging_status_data)
+        # The ChargingStatus event carries the same data, do not even build the log otherwise
+        if self.is_verbose(VERBOSITY_DEBUG):
+            self.emit_log({
+                'state': session.state,
+                'data': f'Charging status: {charging_status_data}'
+            }, session.key, VERBOSITY_DEBUG)
+        P2PUtils.send_client_charging_status(
+            self._redis,
+            charging_status_data['progress'],
+            charging_status_data['charging_period'],
+            charging_status_data['energy_consumption'],
+            charging_status_data['spent_token'],
+            session.key)
+
+    def receive_approval(self, session: ChargingSession, leg: str, event_id: str, attributes: list) -> bool:
+        name, to_addr, token_key, desc = {
+            APPROVAL_REFUND: ('refund', session.charging_info['consumer'], 'refund_token',
+                              'receive multisig -> conumser, approval'),
+            APPROVAL_SPENT: ('spent', self._kp.ss58_address, 'spent_token',
+                             'receive multisig -> provider, approval'),
+        }[leg]
+        if not session.is_approving():
+            self._logger.error(f'received "consumer {name} event" event while not in state "approving" '
+                               f'event: {event_id}: {attributes}')
+            return False
 
-        if self.is_service_requested_event(event,
-                                           self._kp.ss58_address):
-            if not self.is_idle():
-                self._logger.error('received "service requested" event while not in state "idle"'
-                                   f'event: {event}')
+        if 'Ok' not in attributes[-1]:
+            self.emit_log({
+                'desc': f'the consumer {name} approval has an error, please check',
+                'time_point': attributes[1],
+                'error': attributes[-1]
+            }, session.key)
+            return False
+        session.charging_info[leg] = True
+        self.emit_balances_transferd(session, {
+            'from': session.charging_info['multisig_pk'],
+            'to': to_addr,
+            'value': session.charging_info[token_key],
+        })
+        self.emit_log({'state': session.state, 'data': desc}, session.key)
+
+        if session.is_all_approvals():
+            session.receive_approvals()
+            self.close_session(session)
+            self.emit_log({'state': session.state, 'data': 'charging process finish!'}, session.key)
+        return True
+
+    def end_charging(self, session: ChargingSession, event: P2PMessage.Event):
+        charging_info = session.charging_info
+        session.end_charging()
+        self.stop_status_ticks(session)
+        P2PUtils.send_stop_charing_ack(self._redis, 'Stop charing received', session.key)
+        self._logger.info(f'ended charging for {session.key}')
+        self.emit_log({
+            'state': session.state,
+            'data': 'Charging end',
+            'info': event.stop_charge_data.success
+        }, session.key)
+
+        charging_info['charging_end_time'] = datetime.datetime.now()
+        charging_result = CharginUtils.calculate_charging_result(
+            charging_info['charging_start_time'],
+            charging_info['charging_end_time'],
+            charging_info['charing_wait_time'],
+            charging_info['deposit_token']
+        )
+        spent_token = charging_result['spent_token']
+        refund_token = charging_result['refund_token']
+        charging_period = charging_result['charging_period']
+        energy_consumption = charging_result['energy_consumption']
+
+        charging_info.update({
+            'spent_token': spent_token,
+            'refund_token': refund_token
+        })
+        self.emit_log({
+            'state': session.state,
+            'data': '{}, {}'.format(
+                f'spent: {spent_token}, refund: {refund_token}',
+                f'charging period: {charging_period}, energy consumption: {energy_consumption}')
+        }, session.key)
+
+        # Send the spent and the refund without waiting, the session moves on from the receipt callbacks
+        consumer = charging_info['consumer']
+        with self._pool.connection() as substrate:
+            spent_payload, spent_call = ChainUtils.compose_as_multi_call(
+                substrate, spent_token, self._kp.ss58_address, [consumer], self._multi_threshold)
+            refund_payload, refund_call = ChainUtils.compose_as_multi_call(
+                substrate, refund_token, consumer, [consumer], self._multi_threshold)
+            if self._settlement == SETTLEMENT_BATCH:
+                calls = [ChainUtils.compose_batch_all_call(substrate, [spent_call, refund_call])]
+            else:
+                calls = [spent_call, refund_call]
+        futures = [self._tracker.submit(self._kp, call) for call in calls]
+        self.emit_log({'state': session.state, 'data': 'Charging sends spent for multisig'}, session.key)
+        self.emit_log({'state': session.state, 'data': 'Charging sends refund for multisig'}, session.key)
+
+        when_all(futures, lambda futures: self.on_transfers_included(
+            session, [spent_payload, refund_payload], futures))
+
+    def fail_settlement(self, session: ChargingSession, err: Exception):
+        self._logger.error(f'settlement of {session.key} failed: {err}')
+        self.emit_log({'state': session.state, 'data': f'Charging settlement failed: {err}'}, session.key)
+        self.close_session(session)
+
+    def on_transfers_included(self, session: ChargingSession, payloads: list, futures: [Future]):
+        with self._lock:
+            errors = [_.exception() for _ in futures if _.exception() is not None]
+            if errors:
+                self.fail_settlement(session, errors[0])
                 return
 
-            p2p_event = event
-            consumer = p2p_event.service_requested_data.consumer
-            deposit_token = int(p2p_event.service_requested_data.token_deposited)
-
-            self._charging_info.update({
-                'consumer': consumer,
-                'deposit_token': deposit_token,
-                'multisig_pk': calculate_multi_sig(
-                    [consumer, self._kp.ss58_address],
-                    self._multi_threshold),
-            })
+            receipts = [_.result() for _ in futures]
+            for receipt in receipts:
+                ChainUtils.show_extrinsic(receipt, 'as_multi', self._logger)
+            # Included but failed, no MultisigExecuted will ever come for it
+            failed = [_ for _ in receipts if not _.is_success]
+            if failed:
+                self.fail_settlement(session, IOError(f'as_multi failed: {failed[0].error_message}'))
+                return
+            if len(receipts) == 1:
+                # In a batch, both as_multi share the time point of the batch
+                receipts = receipts * len(payloads)
+            spent_info, refund_info = [ChainUtils.compose_multisig_info(receipt, payload)
+                                       for receipt, payload in zip(receipts, payloads)]
+
+            charging_info = session.charging_info
+            self._sessions.add_approval(session.key, APPROVAL_SPENT, spent_info['call_hash'])
+            self._sessions.add_approval(session.key, APPROVAL_REFUND, refund_info['call_hash'])
+            self._filter.watch(session.key, call_hashes=[spent_info['call_hash'], refund_info['call_hash']])
+            refund_delivery = compose_delivery_info(charging_info['refund_token'], refund_info)
+            spent_delivery = compose_delivery_info(charging_info['spent_token'], spent_info)
+
+            # Composed on the tracker thread, where its connection lives
+            future = self._tracker.submit(self._kp, lambda substrate: ChainUtils.compose_service_deliver_call(
+                substrate, charging_info['consumer'], refund_delivery, spent_delivery))
+            future.add_done_callback(lambda future: self.on_service_delivered(
+                session, refund_delivery, spent_delivery, future))
+
+    def on_service_delivered(self, session: ChargingSession, refund_delivery: dict,
+                             spent_delivery: dict, future: Future):
+        with self._lock:
+            if future.exception() is not None:
+                self.fail_settlement(session, future.exception())
+                return
+            ChainUtils.show_extrinsic(future.result(), 'service_delivered', self._logger)
 
-            wait_time = self._wait_time
-            self._logger.info(f'⚠️  wait for {wait_time} to finish the charging')
+            P2PUtils.send_service_deliver(
+                self._redis, self._kp, session.key, refund_delivery, spent_delivery)
 
-            # [TODO] We should change the API type and the naming...
-            self.emit_service_requested({
+            self.emit_service_delivered(session, {
                 'provider': self._kp.ss58_address,
-                'consumer': self._charging_info['consumer'],
-                'token_deposited': self._charging_info['deposit_token'],
-                'wait_time': wait_time,
+                'consumer': session.key,
+                'refund_info': refund_delivery,
+                'spent_info': spent_delivery,
             })
-            self.emit_log({'state': self.state, 'data': 'ServiceRequested received'})
-
-            self.check(self._charging_info)
-            if self.is_idle():
-                self.emit_log({'state': self.state, 'data': 'Check refuse'})
-                # [TODO] We should change the API type and the naming...
-                self.emit_deposit_verified({
-                    'consumer': self._charging_info['consumer'],
-                    'token_deposited': self._charging_info['deposit_token'],
-                    'success': False,
-                })
-                P2PUtils.send_request_ack(self._redis, wait_time, 'Deposit check fail', False)
-                return
 
-            P2PUtils.send_request_ack(self._redis, wait_time, 'ServiceRequested received', True)
-            # [TODO] We should change the API type and the naming...
-            self.emit_deposit_verified({
-                'consumer': self._charging_info['consumer'],
-                'token_deposited': self._charging_info['deposit_token'],
-                'success': True,
-            })
-            self.emit_log({'state': self.state, 'data': 'Check verified'})
+            session.wait_approval()
+            self.emit_log({'state': session.state, 'data': 'User\'s approval wait'}, session.key)
 
-            self.update_charging_start(datetime.datetime.now(), wait_time)
-            self.start_charging()
-            self._logger.info('started charging')
-            self.emit_log({'state': self.state, 'data': 'Charging start'})
+    def request_service(self, event: P2PMessage.Event):
+        consumer = event.service_requested_data.consumer
+        if consumer in self._sessions:
+            self._logger.error(f'received "service requested" event while {consumer} already has a session'
+                               f'event: {event}')
+            return
 
-        if event.event_id == P2PMessage.EventType.CHARGING_STATUS:
-            now_time = datetime.datetime.now()
-            charging_status_data = self.calculate_charging_status_data(now_time)
-            self.emit_client_charging_status(charging_status_data)
-            self.emit_log({
-                'state': self.state,
-                'data': f'Charging status: {charging_status_data}'
+        deposit_token = int(event.service_requested_data.token_deposited)
+        session = ChargingSession(
+            consumer,
+            calculate_multi_sig([consumer, self._kp.ss58_address], self._multi_threshold),
+            deposit_token,
+            self.is_allow_charging)
+        self._sessions.add(session)
+        self._filter.watch(consumer, addresses=[consumer, session.charging_info['multisig_pk']])
+
+        wait_time = self._wait_time
+        self._logger.info(f'⚠️  wait for {wait_time} to finish the charging of {consumer}')
+
+        # [TODO] We should change the API type and the naming...
+        self.emit_service_requested(session, {
+            'provider': self._kp.ss58_address,
+            'consumer': consumer,
+            'token_deposited': deposit_token,
+            'wait_time': wait_time,
+        })
+        self.emit_log({'state': session.state, 'data': 'ServiceRequested received'}, session.key)
+
+        session.check()
+        if session.is_idle():
+            self.close_session(session)
+            self.emit_log({'state': session.state, 'data': 'Check refuse'}, session.key)
+            # [TODO] We should change the API type and the naming...
+            self.emit_deposit_verified(session, {
+                'consumer': consumer,
+                'token_deposited': deposit_token,
+                'success': False,
             })
-            P2PUtils.send_client_charging_status(
-                self._redis,
-                charging_status_data['progress'],
-                charging_status_data['charging_period'],
-                charging_status_data['energy_consumption'],
-                charging_status_data['spent_token'])
-
-        self._logger.info(f'Event: {event}')
-
-    def start(self):
-        r = None
-        try:
-            self._logger.info('reading did...')
-            r = read_did(self._substrate, self._logger, self._kp)
-            if r.is_success:
-                event = [_.value for _ in r.triggered_events
-                         if _.value['event_id'] == 'AttributeRead'][0]["attributes"]
-                did_doc = DIDUtils.decode_did_event(event)
-                if not DIDUtils.is_did_valid(did_doc, self._kp.ss58_address, self._did_path):
-                    raise IOError(f'The did document, {did_doc}, is not the same as default setting')
-                self._logger.info(f'successfully read did: {did_doc}')
-        except Exception as err:
-            self._logger.error(f'failed to read did: {err}', exc_info=True)
+            P2PUtils.send_request_ack(self._redis, wait_time, 'Deposit check fail', False, consumer)
+            return
 
-        if r is not None and not r.is_success:
+        P2PUtils.send_request_ack(self._redis, wait_time, 'ServiceRequested received', True, consumer)
+        # [TODO] We should change the API type and the naming...
+        self.emit_deposit_verified(session, {
+            'consumer': consumer,
+            'token_deposited': deposit_token,
+            'success': True,
+        })
+        self.emit_log({'state': session.state, 'data': 'Check verified'}, session.key)
+
+        session.update_charging_start(datetime.datetime.now(), wait_time)
+        session.start_charging()
+        self._status_timers[consumer] = self._scheduler.call_every(
+            CHARGING_STATUS_POLLING_TIME, lambda: self.tick_charging_status(session))
+        self._logger.info(f'started charging for {consumer}')
+        self.emit_log({'state': session.state, 'data': 'Charging start'}, session.key)
+
+    def check_did(self):
+        with self._pool.connection() as substrate:
+            r = None
             try:
-                self._logger.info('publishing did...')
-                r = publish_did(self._substrate, self._logger, self._kp, self._did_path)
+                self._logger.info('reading did...')
+                r = read_did(substrate, self._logger, self._kp)
+                if r.is_success:
+                    event = [_.value for _ in r.triggered_events
+                             if _.value['event_id'] == 'AttributeRead'][0]["attributes"]
+                    did_doc = DIDUtils.decode_did_event(event)
+                    if not DIDUtils.is_did_valid(did_doc, self._kp.ss58_address, self._did_path):
+                        raise IOError(f'The did document, {did_doc}, is not the same as default setting')
+                    self._logger.info(f'successfully read did: {did_doc}')
             except Exception as err:
-                self._logger.error(f'failed to publish did: {err}')
+                self._logger.error(f'failed to read did: {err}', exc_info=True)
+
+            if r is not None and not r.is_success:
+                try:
+                    self._logger.info('publishing did...')
+                    r = publish_did(substrate, self._logger, self._kp, self._did_path)
+                except Exception as err:
+                    self._logger.error(f'failed to publish did: {err}')
+
+    def process_messages(self, subcriber, messages: list):
+        for message in messages:
+            event = WireUtils.decode_event(message.data)
+            try:
+                with self._lock:
+                    self.process_event(event, message.session_key)
+            except BrokenPipeError:
+                self.emit_log({
+                    'desc': 'Broken pipe happens, please check',
+                }, message.session_key)
+            subcriber.ack(message)
+        self.log_dispatch_stats()
 
-        subcriber = self._redis.pubsub()
-        subcriber.subscribe(REDIS_IN)
+    def start(self):
+        self.check_did()
+        subcriber = self._redis.subscribe(REDIS_IN, RedisTransport.SCOPE_ALL, 'business-logic')
 
         while True:
-            event_data = subcriber.get_message(True, timeout=30000.0)
+            self.process_messages(subcriber, subcriber.read())
 
-            if event_data is None:
-                continue
+    async def start_async(self):
+        # The chain calls block, so they run on the executor and never on the loop
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.check_did)
+        subcriber = self._redis.subscribe(REDIS_IN, RedisTransport.SCOPE_ALL, 'business-logic')
 
-            event = ChainUtils.decode_chain_event(event_data['data'].decode('utf-8'))
-            try:
-                self.process_event(event)
-            except BrokenPipeError:
-                self.emit_log({
-                    'desc': 'Broken pipe happens, please check',
-                })
+        while True:
+            messages = await loop.run_in_executor(None, subcriber.read)
+            await loop.run_in_executor(None, self.process_messages, subcriber, messages)
 
     def reconnect(self):
         try:
-            self._substrate.close()
-            self._substrate = ChainUtils.get_substrate_connection(self._ws_url)
+            # Every pooled connection gets a new websocket, this one right away to check the node
+            self._pool.invalidate()
+            with self._pool.connection() as substrate:
+                substrate.get_chain_head()
             data = UserUtils.create_reconnect_ack(
                 'Successfully reconnected',
                 True,
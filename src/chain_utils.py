@@ -3,17 +3,33 @@ import logging
 import redis
 import json
 import time
+import threading
 
-from functools import wraps
+from functools import wraps, lru_cache
 from substrateinterface import SubstrateInterface, Keypair, ExtrinsicReceipt
 from substrateinterface.utils.ss58 import ss58_encode
 from scalecodec.base import RuntimeConfiguration
 from scalecodec.type_registry import load_type_registry_preset
 from peaq_network_ev_charging_message_format.python import p2p_message_format_pb2 as P2PMessage
 from src import did_utils as DIDUtils
+from src import wire_utils as WireUtils
+from src.nonce_manager import NonceManager
+from src import substrate_pool as SubstratePool
+from src import local_node as LocalNode
+from src import metrics as Metrics
 
 RETRY_TIMES = 200
 RETRY_PERIOD = 3
+MORTAL_PERIOD = 64
+MULTI_SIG_CACHE_SIZE = 4096
+SUBSTRATE_POOL_SIZE = 4
+SUBSTRATE_KEEPALIVE_PERIOD = 30
+
+NONCES = NonceManager()
+
+_multi_account_id = None
+_pools = {}
+_pools_lock = threading.Lock()
 
 
 def parse_config(path: str) -> Keypair:
@@ -53,7 +69,9 @@ def parse_logger_config(path: str):
         logPath = data['logPath']
     if 'storeFor' in data:
         storeFor = data['storeFor']
-    return [when, maxKB, backups, logPath, storeFor]
+    asynchronous = data.get('async', False)
+    compress = data.get('compress', False)
+    return [when, maxKB, backups, logPath, storeFor, asynchronous, compress]
 
 
 def parse_redis_config(path: str):
@@ -65,22 +83,53 @@ def parse_redis_config(path: str):
         port = data['port']
     if 'db' in data:
         db = data['db']
-    return [host, port, db]
+    wire = data.get('wire', WireUtils.WIRE_HEX)
+    transport = data.get('transport', 'pubsub')
+    stream_batch = data.get('stream_batch', 64)
+    stream_maxlen = data.get('stream_maxlen', 100000)
+    return [host, port, db, wire, transport, stream_batch, stream_maxlen]
 
 
 def init_redis(host: str, port: int, db: int):
     return redis.Redis(host=host, port=port, db=db)
 
 
+class MeteredSubstrateInterface(SubstrateInterface):
+    '''
+    Times every RPC request by its method. A subscription waits for its updates, so it is not timed
+    '''
+    def rpc_request(self, method, params, result_handler=None):
+        if result_handler is not None:
+            return super().rpc_request(method, params, result_handler)
+        start = time.perf_counter()
+        try:
+            return super().rpc_request(method, params)
+        finally:
+            Metrics.RPC_LATENCY.observe(time.perf_counter() - start, method)
+
+
 def get_substrate_connection(url: str) -> SubstrateInterface:
+    if LocalNode.is_local_url(url):
+        return LocalNode.connect(url)
     # Check the type_registry_preset_dict = load_type_registry_preset(type_registry_name)
     # ~/venv.substrate/lib/python3.6/site-packages/substrateinterface/base.py
-    substrate = SubstrateInterface(
+    substrate = MeteredSubstrateInterface(
         url=url,
     )
     return substrate
 
 
+def get_substrate_pool(url: str) -> SubstratePool.SubstratePool:
+    '''
+    One pool per node for the whole process
+    '''
+    with _pools_lock:
+        if url not in _pools:
+            _pools[url] = SubstratePool.SubstratePool(
+                lambda: get_substrate_connection(url), SUBSTRATE_POOL_SIZE, SUBSTRATE_KEEPALIVE_PERIOD)
+        return _pools[url]
+
+
 def show_extrinsic(receipt: dict, info_type: str, logger: logging.Logger):
     if receipt.is_success:
         logger.info(f'✅ {info_type}, Success: {receipt.get_extrinsic_identifier()}')
@@ -88,16 +137,27 @@ def show_extrinsic(receipt: dict, info_type: str, logger: logging.Logger):
         logger.error(f'⚠️  {info_type}, Extrinsic Failed: {receipt.error_message} {receipt.get_extrinsic_identifier()}')
 
 
+def _get_multi_account_id():
+    global _multi_account_id
+    # Parsing the whole type registry is slow, so it is only done once
+    if _multi_account_id is None:
+        RuntimeConfiguration().update_type_registry(load_type_registry_preset('default'))
+        _multi_account_id = RuntimeConfiguration().get_decoder_class('MultiAccountId')
+    return _multi_account_id
+
+
+@lru_cache(maxsize=MULTI_SIG_CACHE_SIZE)
+def _calculate_multi_sig(ss58_addrs: tuple, threshold: int) -> str:
+    multi_sig_account = _get_multi_account_id().create_from_account_list(list(ss58_addrs), threshold)
+    return ss58_encode(multi_sig_account.value)
+
+
 def calculate_multi_sig(ss58_addrs: str, threshold: int) -> str:
     '''
     https://github.com/polkascan/py-scale-codec/blob/f063cfd47c836895886697e7d7112cbc4e7514b3/test/test_scale_types.py#L383
     '''
-
-    RuntimeConfiguration().update_type_registry(load_type_registry_preset('default'))
-    multi_account_id = RuntimeConfiguration().get_decoder_class('MultiAccountId')
-
-    multi_sig_account = multi_account_id.create_from_account_list(ss58_addrs, threshold)
-    return ss58_encode(multi_sig_account.value)
+    # The signatories are sorted on derivation, so their order does not change the address
+    return _calculate_multi_sig(tuple(sorted(ss58_addrs)), threshold)
 
 
 def broken_pipe_retry(func):
@@ -108,29 +168,68 @@ def broken_pipe_retry(func):
                 return func(substrate, logger, *args, **kwargs)
             except BrokenPipeError as err:
                 logger.error(f'failed to and retry : {err}', exc_info=True)
+                Metrics.BROKEN_PIPE_RETRIES.inc(func.__name__)
                 time.sleep(RETRY_PERIOD)
-                url = substrate.url
-                substrate.close()
-                substrate = get_substrate_connection(url)
+                try:
+                    SubstratePool.reconnect(substrate)
+                except Exception as err:
+                    logger.error(f'failed to reconnect: {err}')
         raise IOError(f'After {RETRY_TIMES} times, still cannot')
     return broken_pipe_retry_wrapper
 
 
+def sign_and_submit(substrate: SubstrateInterface, kp: Keypair, call,
+                    wait_for_inclusion: bool = True) -> ExtrinsicReceipt:
+    nonce = NONCES.allocate(substrate, kp.ss58_address)
+    extrinsic = substrate.create_signed_extrinsic(
+        call=call,
+        keypair=kp,
+        era={'period': MORTAL_PERIOD},
+        nonce=nonce
+    )
+
+    start = time.monotonic()
+    try:
+        receipt = substrate.submit_extrinsic(extrinsic, wait_for_inclusion=wait_for_inclusion)
+    except Exception:
+        NONCES.resync(substrate, kp.ss58_address)
+        raise
+    if wait_for_inclusion:
+        NONCES.confirm(substrate, kp.ss58_address, nonce)
+        Metrics.EXTRINSIC_INCLUSION.observe(time.monotonic() - start)
+    return receipt
+
+
+def create_receipt(substrate: SubstrateInterface, extrinsic_hash: str, block_hash: str) -> ExtrinsicReceipt:
+    if isinstance(substrate, LocalNode.LocalSubstrate):
+        return substrate.create_receipt(extrinsic_hash, block_hash)
+    return ExtrinsicReceipt(substrate=substrate, extrinsic_hash=extrinsic_hash, block_hash=block_hash)
+
+
+def compose_multisig_info(receipt: ExtrinsicReceipt, payload) -> dict:
+    info = receipt.get_extrinsic_identifier().split('-')
+    return {
+        'tx_hash': receipt.extrinsic_hash,
+        'time_point': {'height': int(info[0]), 'index': int(info[1])},
+        'call_hash': f'0x{payload.call_hash.hex()}',
+    }
+
+
 @broken_pipe_retry
-def get_station_balance(substrate: SubstrateInterface, logger: logging.Logger, ss58_addr: str):
+def get_station_balance(substrate: SubstrateInterface, logger: logging.Logger, ss58_addr: str,
+                        block_hash: str = None):
     account_info = substrate.query(
         module='System',
         storage_function='Account',
         params=[ss58_addr],
+        block_hash=block_hash,
     )
 
     return account_info['data']['free'].value
 
 
-@broken_pipe_retry
-def send_token_multisig_wallet(substrate: SubstrateInterface, logger: logging.Logger,
-                               kp: Keypair, token_num: int, dst_addr: str,
-                               other_signatories: [str], threshold: int) -> dict:
+def compose_as_multi_call(substrate: SubstrateInterface, token_num: int, dst_addr: str,
+                          other_signatories: [str], threshold: int):
     payload = substrate.compose_call(
         call_module='Balances',
         call_function='transfer',
@@ -139,8 +238,6 @@ def send_token_multisig_wallet(substrate: SubstrateInterface, logger: logging.Lo
             'value': token_num
         })
 
-    nonce = substrate.get_account_nonce(kp.ss58_address)
-
     as_multi_call = substrate.compose_call(
         call_module='MultiSig',
         call_function='as_multi',
@@ -152,22 +249,31 @@ def send_token_multisig_wallet(substrate: SubstrateInterface, logger: logging.Lo
             'store_call': True,
             'max_weight': 1000000000,
         })
+    return payload, as_multi_call
 
-    extrinsic = substrate.create_signed_extrinsic(
-        call=as_multi_call,
-        keypair=kp,
-        era={'period': 64},
-        nonce=nonce
-    )
 
-    receipt = substrate.submit_extrinsic(extrinsic, wait_for_inclusion=True)
+@broken_pipe_retry
+def send_token_multisig_wallet(substrate: SubstrateInterface, logger: logging.Logger,
+                               kp: Keypair, token_num: int, dst_addr: str,
+                               other_signatories: [str], threshold: int) -> dict:
+    payload, as_multi_call = compose_as_multi_call(substrate, token_num, dst_addr, other_signatories, threshold)
+
+    receipt = sign_and_submit(substrate, kp, as_multi_call)
     show_extrinsic(receipt, 'as_multi', logger)
-    info = receipt.get_extrinsic_identifier().split('-')
-    return {
-        'tx_hash': receipt.extrinsic_hash,
-        'time_point': {'height': int(info[0]), 'index': int(info[1])},
-        'call_hash': f'0x{payload.call_hash.hex()}',
-    }
+    return compose_multisig_info(receipt, payload)
+
+
+def compose_batch_all_call(substrate: SubstrateInterface, calls: list):
+    '''
+    One Utility.batch_all costs one signature and one fee, and all of its
+    as_multi share the time point of the batch
+    '''
+    return substrate.compose_call(
+        call_module='Utility',
+        call_function='batch_all',
+        call_params={
+            'calls': [call.value for call in calls],
+        })
 
 
 def compose_delivery_info(token_num: int, info: dict) -> dict:
@@ -179,11 +285,9 @@ def compose_delivery_info(token_num: int, info: dict) -> dict:
     }
 
 
-@broken_pipe_retry
-def send_service_deliver(substrate: SubstrateInterface, logger: logging.Logger, kp: Keypair,
-                         user_addr: str, refund_info: dict, spent_info: dict):
-    nonce = substrate.get_account_nonce(kp.ss58_address)
-    call = substrate.compose_call(
+def compose_service_deliver_call(substrate: SubstrateInterface, user_addr: str,
+                                 refund_info: dict, spent_info: dict):
+    return substrate.compose_call(
         call_module='Transaction',
         call_function='service_delivered',
         call_params={
@@ -192,21 +296,18 @@ def send_service_deliver(substrate: SubstrateInterface, logger: logging.Logger,
             'spent_info': spent_info,
         })
 
-    extrinsic = substrate.create_signed_extrinsic(
-        call=call,
-        keypair=kp,
-        era={'period': 64},
-        nonce=nonce
-    )
 
-    receipt = substrate.submit_extrinsic(extrinsic, wait_for_inclusion=True)
+@broken_pipe_retry
+def send_service_deliver(substrate: SubstrateInterface, logger: logging.Logger, kp: Keypair,
+                         user_addr: str, refund_info: dict, spent_info: dict):
+    call = compose_service_deliver_call(substrate, user_addr, refund_info, spent_info)
+
+    receipt = sign_and_submit(substrate, kp, call)
     show_extrinsic(receipt, 'service_delivered', logger)
 
 
 @broken_pipe_retry
 def publish_did(substrate: SubstrateInterface, logger: logging.Logger, kp: Keypair, did_path: str) -> ExtrinsicReceipt:
-    nonce = substrate.get_account_nonce(kp.ss58_address)
-
     did_doc = DIDUtils.load_did(did_path)
     if not DIDUtils.is_my_did(did_doc, kp.ss58_address):
         raise IOError(f'the default did {did_doc} does not belong to {kp.ss58_address}')
@@ -222,21 +323,12 @@ def publish_did(substrate: SubstrateInterface, logger: logging.Logger, kp: Keypa
         }
     )
 
-    extrinsic = substrate.create_signed_extrinsic(
-        call=call,
-        keypair=kp,
-        era={'period': 64},
-        nonce=nonce
-    )
-
-    receipt = substrate.submit_extrinsic(extrinsic, wait_for_inclusion=True)
+    receipt = sign_and_submit(substrate, kp, call)
     return receipt
 
 
 @broken_pipe_retry
 def republish_did(substrate: SubstrateInterface, logger: logging.Logger, kp: Keypair, did_path: str) -> ExtrinsicReceipt:
-    nonce = substrate.get_account_nonce(kp.ss58_address)
-
     did_doc = DIDUtils.load_did(did_path)
     if not DIDUtils.is_my_did(did_doc, kp.ss58_address):
         raise IOError(f'the default did {did_doc} does not belong to {kp.ss58_address}')
@@ -252,21 +344,12 @@ def republish_did(substrate: SubstrateInterface, logger: logging.Logger, kp: Key
         }
     )
 
-    extrinsic = substrate.create_signed_extrinsic(
-        call=call,
-        keypair=kp,
-        era={'period': 64},
-        nonce=nonce
-    )
-
-    receipt = substrate.submit_extrinsic(extrinsic, wait_for_inclusion=True)
+    receipt = sign_and_submit(substrate, kp, call)
     return receipt
 
 
 @broken_pipe_retry
 def read_did(substrate: SubstrateInterface, logger: logging.Logger, kp: Keypair) -> ExtrinsicReceipt:
-    nonce = substrate.get_account_nonce(kp.ss58_address)
-
     call = substrate.compose_call(
         call_module='PeaqDid',
         call_function='read_attribute',
@@ -276,14 +359,7 @@ def read_did(substrate: SubstrateInterface, logger: logging.Logger, kp: Keypair)
         }
     )
 
-    extrinsic = substrate.create_signed_extrinsic(
-        call=call,
-        keypair=kp,
-        era={'period': 64},
-        nonce=nonce
-    )
-
-    receipt = substrate.submit_extrinsic(extrinsic, wait_for_inclusion=True)
+    receipt = sign_and_submit(substrate, kp, call)
     return receipt
 
 
@@ -301,4 +377,4 @@ def create_chain_event_data(data):
     chain_event_data.attributes = json.dumps(data['attributes'])
     event.chain_event_data.CopyFrom(chain_event_data)
 
-    return event.SerializeToString().hex()
+    return WireUtils.encode_event(event)
@@ -0,0 +1,128 @@
+import datetime
+import transitions
+
+from src import charging_utils as CharginUtils
+
+# The two multisig legs a session waits for the consumer to approve, named after their charging_info flag
+APPROVAL_SPENT = 'provider_got'
+APPROVAL_REFUND = 'consumer_got'
+
+
+class ChargingSession():
+    states = ['idle', 'verified', 'charging', 'charged', 'approving']
+
+    def __init__(self, consumer: str, multisig_pk: str, deposit_token: int, verifier):
+        self._verifier = verifier
+        self._machine = transitions.Machine(
+            model=self,
+            states=ChargingSession.states,
+            initial='idle'
+        )
+
+        self._machine.add_transition(trigger='check', source='idle', dest='verified',
+                                     conditions=['is_allow_charging'])
+        self._machine.add_transition(trigger='start_charging', source='verified', dest='charging')
+        self._machine.add_transition(trigger='end_charging', source='charging', dest='charged')
+        self._machine.add_transition(trigger='wait_approval', source='charged', dest='approving')
+        self._machine.add_transition(trigger='receive_approvals', source='approving', dest='idle')
+
+        self.charging_info = {
+            'consumer': consumer,
+            'multisig_pk': multisig_pk,
+            'deposit_token': deposit_token,
+            'provider_got': False,
+            'provider_got_call_hash': '',
+            'consumer_got': False,
+            'consumer_got_call_hash': '',
+            'spent_token': 0,
+            'refund_token': 0,
+            'charging_start_time': None,
+            'charing_wait_time': 0,
+            'charging_end_time': None,
+        }
+
+    @property
+    def key(self) -> str:
+        return self.charging_info['consumer']
+
+    def is_allow_charging(self) -> bool:
+        return self._verifier(self.charging_info)
+
+    def update_charging_start(self, start_time: datetime.datetime, wait_time: int):
+        self.charging_info['charging_start_time'] = start_time
+        self.charging_info['charing_wait_time'] = wait_time
+
+    def calculate_charging_status_data(self, now_time: datetime.datetime) -> dict:
+        charging_result = CharginUtils.calculate_charging_result(
+            self.charging_info['charging_start_time'],
+            now_time,
+            self.charging_info['charing_wait_time'],
+            self.charging_info['deposit_token']
+        )
+        progress = CharginUtils.calculate_charging_status(
+            self.charging_info['charging_start_time'],
+            now_time,
+            self.charging_info['charing_wait_time']
+        )
+        return {
+            'charging_period': str(charging_result['charging_period']),
+            'energy_consumption': charging_result['energy_consumption'],
+            'spent_token': charging_result['spent_token'],
+            'progress': progress,
+        }
+
+    def is_all_approvals(self) -> bool:
+        return self.charging_info['consumer_got'] and self.charging_info['provider_got']
+
+
+class SessionRegistry():
+    def __init__(self):
+        self._sessions = {}
+        # (session key, call hash) -> approval leg. Sessions spending the same amount share
+        # the call hash of their spent leg, only the signing consumer tells them apart
+        self._approvals = {}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._sessions
+
+    def get(self, key: str) -> ChargingSession:
+        return self._sessions.get(key)
+
+    def add(self, session: ChargingSession):
+        if session.key in self._sessions:
+            raise KeyError(f'session {session.key} already exists')
+        self._sessions[session.key] = session
+
+    def remove(self, key: str):
+        session = self._sessions.pop(key, None)
+        if session is None:
+            return
+        for leg in [APPROVAL_SPENT, APPROVAL_REFUND]:
+            self._approvals.pop((key, session.charging_info[f'{leg}_call_hash']), None)
+
+    def add_approval(self, key: str, leg: str, call_hash: str):
+        self._sessions[key].charging_info[f'{leg}_call_hash'] = call_hash
+        self._approvals[(key, call_hash)] = leg
+
+    def find_approval(self, key: str, call_hash: str) -> (ChargingSession, str):
+        leg = self._approvals.get((key, call_hash))
+        if leg is None:
+            return None, None
+        return self._sessions.get(key), leg
+
+    def sessions(self) -> [ChargingSession]:
+        return list(self._sessions.values())
+
+    def resolve(self, key: str) -> ChargingSession:
+        '''
+        Legacy messages on the shared channel carry no session key, so they can only
+        be routed when exactly one session is open
+        '''
+        if key:
+            return self._sessions.get(key)
+        if len(self._sessions) == 1:
+            return next(iter(self._sessions.values()))
+        return None
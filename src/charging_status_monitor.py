@@ -1,134 +1,113 @@
-import redis
-import transitions
+import asyncio
 import threading
 import logging
-import datetime
 from peaq_network_ev_charging_message_format.python import p2p_message_format_pb2 as P2PMessage
 
-from src.constants import REDIS_OUT, REDIS_IN, CHARGING_STATUS_POLLING_TIME
-from src import chain_utils as ChainUtils
+from src.constants import REDIS_OUT
+from src import wire_utils as WireUtils
+from src import redis_transport as RedisTransport
 from src import p2p_utils as P2PUtils
+from src.scheduler import Scheduler
 
 
-def run(r: redis.Redis, logger: logging.Logger):
+def run(r: RedisTransport.RedisTransport, logger: logging.Logger):
     c = ChargingStatusMonitor(r, logger)
     c.start()
 
 
-class ChargingStatusPoller():
-    def __init__(self, stop_event: threading.Event, logger: logging.Logger, r: redis.Redis):
-        self._stop_event = stop_event
-        self._logger = logger
-        self._r = r
-
-    def start(self):
-        while not self._stop_event.isSet():
-            event_hex = P2PUtils.create_server_charging_status()
-            self._r.publish(REDIS_IN, event_hex.encode('ascii'))
-            self._stop_event.wait(CHARGING_STATUS_POLLING_TIME)
-
-
-def charging_status_poller_start(stop_event: threading.Event, logger: logging.Logger,
-                                 r: redis.Redis):
-
-    ChargingStatusPoller(stop_event, logger, r).start()
-
-
-class ChargingStopper():
-    def __init__(self, stop_event: threading.Event, logger: logging.Logger,
-                 r: redis.Redis, wait_time: int):
-        self._stop_event = stop_event
-        self._logger = logger
-        self._r = r
-        self._finish_time = datetime.datetime.now() + datetime.timedelta(seconds=wait_time)
-
-    def start(self):
-        while not self._stop_event.isSet():
-            if self._is_over_finish_time(self._finish_time):
-                self._logger.info('Send the stop charging automatically')
-                P2PUtils.send_stop_charging(self._r, True)
-                return
-            self._stop_event.wait(CHARGING_STATUS_POLLING_TIME)
-
-        if self._stop_event.isSet():
-            self._logger.info('Somebody send the stop charging msg')
-
-    def _is_over_finish_time(self, finish_time: datetime.datetime):
-        return datetime.datetime.now() > finish_time
-
-
-def charging_stopper_start(stop_event: threading.Event, logger: logging.Logger,
-                           r: redis.Redis, wait_time: int):
-
-    ChargingStopper(stop_event, logger, r, wait_time).start()
+async def run_async(r: RedisTransport.RedisTransport, logger: logging.Logger):
+    c = AsyncChargingStatusMonitor(r, logger)
+    await c.start()
 
 
 class ChargingStatusMonitor():
-    states = ['idle', 'monitoring']
-
-    def __init__(self, r: redis.Redis, logger: logging.Logger):
+    '''
+    Stops a charging session automatically once its wait time is over. The deadlines
+    of all sessions are timers of one scheduler, a user stop cancels its timer.
+    '''
+    def __init__(self, r: RedisTransport.RedisTransport, logger: logging.Logger):
         self._r = r
-        self._machine = transitions.Machine(
-            model=self,
-            states=ChargingStatusMonitor.states,
-            initial='idle'
-        )
         self._logger = logger
-        self._stop_event = threading.Event()
+        # session key -> timer of its automatic stop, None once it sent the stop
+        self._stop_timers = {}
+        self._lock = threading.Lock()
+        self._scheduler = None
 
-        self._machine.add_transition(trigger='start_monitor', source='idle', dest='monitoring')
-        self._machine.add_transition(trigger='end_monitor', source='monitoring', dest='idle')
-
-    def is_charging_start(self, event):
+    def is_charging_start(self, event, session_key: str):
         # We use service request as charging start
         if event.event_id != P2PMessage.SERVICE_REQUEST_ACK:
             return False
         if event.service_requested_ack_data.resp.error:
             self._logger.info(f'In {event}, the error occurs, so we wont start the charging related thread')
             return False
-        if not self.is_idle():
-            self._logger.info(f'In {self.state}, but receive the charging start')
+        if session_key in self._stop_timers:
+            self._logger.info(f'{session_key} is monitoring, but receive the charging start')
             return False
         return True
 
-    def is_charging_end(self, event):
+    def is_charging_end(self, event, session_key: str):
         if event.event_id != P2PMessage.STOP_CHARGE_RESPONSE:
             return False
         if event.stop_charge_resp_data.resp.error:
             self._logger.info(f'In {event}, the error occurs, so we wont stop the charging related thread')
             return False
-        if not self.is_monitoring():
-            self._logger.info(f'In {self.state}, but receive the stop')
+        if session_key not in self._stop_timers:
+            self._logger.info(f'{session_key} is not monitoring, but receive the stop')
             return False
         return True
 
     def start(self):
-        subcriber = self._r.pubsub()
-        subcriber.subscribe(REDIS_OUT)
+        self._scheduler = Scheduler(self._logger)
+        self._scheduler.start()
+        subcriber = self._r.subscribe(REDIS_OUT, RedisTransport.SCOPE_SESSION, 'charging-monitor')
+
+        while True:
+            for message in subcriber.read():
+                self.process_event(WireUtils.decode_event(message.data), message.session_key)
+                subcriber.ack(message)
+
+    def schedule_stop(self, wait_time: int, session_key: str):
+        return self._scheduler.call_later(wait_time, lambda: self.stop_charging(session_key))
+
+    def stop_charging(self, session_key: str):
+        with self._lock:
+            if self._stop_timers.get(session_key) is None:
+                return
+            self._stop_timers[session_key] = None
+        self._logger.info(f'Send the stop charging automatically for {session_key}')
+        P2PUtils.send_stop_charging(self._r, True, session_key)
+
+    def process_event(self, event, session_key: str):
+        if self.is_charging_start(event, session_key):
+            self._logger.info(f'Start to monitor {session_key}')
+            with self._lock:
+                self._stop_timers[session_key] = self.schedule_stop(
+                    event.service_requested_ack_data.wait_time, session_key)
+
+        if self.is_charging_end(event, session_key):
+            with self._lock:
+                timer = self._stop_timers.pop(session_key, None)
+            if timer:
+                timer.cancel()
+                self._logger.info('Somebody send the stop charging msg')
+            self._logger.info(f'Stop to monitor {session_key}')
+
+
+class AsyncChargingStatusMonitor(ChargingStatusMonitor):
+    '''
+    Keeps the automatic stops on the timers of the event loop
+    '''
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        subcriber = self._r.subscribe(REDIS_OUT, RedisTransport.SCOPE_SESSION, 'charging-monitor')
 
         while True:
-            event_data = subcriber.get_message(True, timeout=30000.0)
-
-            if event_data is None:
-                continue
-
-            event = ChainUtils.decode_chain_event(event_data['data'].decode('utf-8'))
-
-            if self.is_charging_start(event):
-                self._logger.info('Start to monitor')
-                self.start_monitor()
-                monitor_thread = threading.Thread(target=charging_status_poller_start,
-                                                  args=(self._stop_event, self._logger, self._r))
-                monitor_thread.start()
-
-                stop_thread = threading.Thread(
-                    target=charging_stopper_start,
-                    args=(self._stop_event, self._logger, self._r,
-                          event.service_requested_ack_data.wait_time))
-                stop_thread.start()
-
-            if self.is_charging_end(event):
-                self._stop_event.set()
-                self._stop_event = threading.Event()
-                self.end_monitor()
-                self._logger.info('Stop to monitor')
+            messages = await loop.run_in_executor(None, subcriber.read)
+            for message in messages:
+                self.process_event(WireUtils.decode_event(message.data), message.session_key)
+                subcriber.ack(message)
+
+    def schedule_stop(self, wait_time: int, session_key: str):
+        # The stop takes the lock and publishes to Redis, both block, so it runs on the executor
+        loop = asyncio.get_running_loop()
+        return loop.call_later(wait_time, loop.run_in_executor, None, self.stop_charging, session_key)
@@ -1,4 +1,18 @@
 REDIS_IN = 'IN'
 REDIS_OUT = 'OUT'
 
+# Session scoped channels, e.g. IN:<consumer ss58 address>
+REDIS_SESSION_SEP = ':'
+
 CHARGING_STATUS_POLLING_TIME = 1
+
+# How the spent and refund as_multi are submitted at the end of a charging session
+SETTLEMENT_PIPELINE = 'pipeline'
+SETTLEMENT_BATCH = 'batch'
+
+# What the business logic emits to the UI, every tier adds to the one before it
+VERBOSITY_OFF = 'off'
+VERBOSITY_EVENTS = 'events'
+VERBOSITY_SUMMARY = 'summary'
+VERBOSITY_DEBUG = 'debug'
+VERBOSITY_TIERS = [VERBOSITY_OFF, VERBOSITY_EVENTS, VERBOSITY_SUMMARY, VERBOSITY_DEBUG]
@@ -0,0 +1,71 @@
+import time
+import threading
+
+
+class EventDispatcher():
+    '''
+    Maps an event id, or an event id and a sub type of it, to its handler with one
+    dictionary lookup, and keeps the count and the latency of every handler
+    '''
+    def __init__(self):
+        self._handlers = {}
+        # event id -> function returning the sub type of such an event
+        self._sub_types = {}
+        self._lock = threading.Lock()
+        # handler name -> [calls, total seconds, max seconds]
+        self._stats = {}
+
+    def register(self, event_id, handler, sub_type: str = None, name: str = None):
+        '''
+        The stats go by name, the handler's own name if none, so lambdas need one
+        '''
+        name = name or handler.__name__
+        self._handlers[(event_id, sub_type)] = (handler, name)
+        self._stats.setdefault(name, [0, 0.0, 0.0])
+
+    def register_sub_type(self, event_id, get_sub_type):
+        self._sub_types[event_id] = get_sub_type
+
+    def find(self, event) -> tuple:
+        '''
+        (handler, stats name) of the event, None if it has no handler
+        '''
+        found = None
+        if event.event_id in self._sub_types:
+            found = self._handlers.get((event.event_id, self._sub_types[event.event_id](event)))
+        if found is None:
+            found = self._handlers.get((event.event_id, None))
+        return found
+
+    def dispatch(self, event, *args) -> bool:
+        found = self.find(event)
+        if found is None:
+            return False
+
+        handler, name = found
+        start = time.perf_counter()
+        try:
+            handler(event, *args)
+        finally:
+            self._record(name, time.perf_counter() - start)
+        return True
+
+    def _record(self, name: str, elapsed: float):
+        with self._lock:
+            stats = self._stats[name]
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+
+    def stats(self) -> dict:
+        '''
+        The handlers, the slowest in total first
+        '''
+        with self._lock:
+            stats = sorted(self._stats.items(), key=lambda item: item[1][1], reverse=True)
+            return {name: {
+                'count': count,
+                'total': total,
+                'mean': total / count if count else 0.0,
+                'max': max_elapsed,
+            } for name, (count, total, max_elapsed) in stats}
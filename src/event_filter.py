@@ -0,0 +1,55 @@
+import threading
+
+from substrateinterface.utils.ss58 import ss58_decode
+
+# The chain events a charging session can be waiting for
+WATCHED_EVENTS = {
+    ('MultiSig', 'NewMultisig'),
+    ('MultiSig', 'MultisigApproval'),
+    ('MultiSig', 'MultisigExecuted'),
+    ('MultiSig', 'MultisigCancelled'),
+    ('Transaction', 'ServiceRequested'),
+    ('Transaction', 'ServiceDelivered'),
+    ('Balances', 'Transfer'),
+}
+
+
+def _normalize(value: str) -> str:
+    value = value.lower()
+    return value[2:] if value.startswith('0x') else value
+
+
+class EventFilter():
+    '''
+    The accounts and call hashes of the live sessions. The substrate monitor only
+    forwards the chain events that mention one of them, so the rest of the network
+    never reaches Redis.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        # watcher key -> public keys and call hashes it watches
+        self._watched = {}
+        # public key or call hash -> number of watchers
+        self._refs = {}
+
+    def watch(self, key: str, addresses: [str] = (), call_hashes: [str] = ()):
+        values = set([ss58_decode(_) for _ in addresses] + [_normalize(_) for _ in call_hashes])
+        with self._lock:
+            watched = self._watched.setdefault(key, set())
+            for value in values - watched:
+                self._refs[value] = self._refs.get(value, 0) + 1
+            watched |= values
+
+    def unwatch(self, key: str):
+        with self._lock:
+            for value in self._watched.pop(key, set()):
+                self._refs[value] -= 1
+                if not self._refs[value]:
+                    del self._refs[value]
+
+    def is_relevant(self, event: dict) -> bool:
+        if (event['module_id'], event['event_id']) not in WATCHED_EVENTS:
+            return False
+        with self._lock:
+            return any([isinstance(_, str) and _normalize(_) in self._refs
+                        for _ in event['attributes']])
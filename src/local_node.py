@@ -0,0 +1,493 @@
+import copy
+import json
+import time
+import hashlib
+import itertools
+import threading
+from urllib.parse import urlparse, parse_qs
+
+from substrateinterface.exceptions import SubstrateRequestException
+from substrateinterface.utils.ss58 import ss58_decode
+from src import chain_utils as ChainUtils
+
+# --node_ws local://<name>?block_time=<seconds>&endowment=<free balance of a new signer>
+SCHEME = 'local'
+LOCAL_BLOCK_TIME = 6
+LOCAL_ENDOWMENT = 10 ** 21
+
+_nodes = {}
+_nodes_lock = threading.Lock()
+
+
+def is_local_url(url: str) -> bool:
+    return urlparse(url).scheme == SCHEME
+
+
+def connect(url: str):
+    '''
+    A connection to the node of this url, the first connection starts the node.
+    The node lives in this process, other processes cannot reach it.
+    '''
+    with _nodes_lock:
+        if url not in _nodes:
+            query = parse_qs(urlparse(url).query)
+            _nodes[url] = LocalNode(
+                float(query.get('block_time', [LOCAL_BLOCK_TIME])[0]),
+                int(query.get('endowment', [LOCAL_ENDOWMENT])[0]))
+            _nodes[url].start()
+        return LocalSubstrate(url, _nodes[url])
+
+
+def _hash(value) -> bytes:
+    return hashlib.blake2b(json.dumps(value, sort_keys=True, default=str).encode(), digest_size=32).digest()
+
+
+def _public_key(ss58_addr: str) -> str:
+    return f'0x{ss58_decode(ss58_addr)}'
+
+
+class LocalDispatchError(Exception):
+    def __init__(self, module: str, name: str):
+        super().__init__(f'{module}.{name}')
+        self.error = {'type': 'Module', 'name': name, 'docs': [f'{module}.{name}']}
+
+
+class LocalScale():
+    '''
+    The .value and item access of the decoded scale objects
+    '''
+    def __init__(self, value):
+        self.value = value
+
+    def __getitem__(self, key):
+        return LocalScale(self.value[key])
+
+
+class LocalCall():
+    def __init__(self, module: str, function: str, params: dict):
+        self.value = {'call_module': module, 'call_function': function, 'call_args': params}
+        self.call_hash = _hash(self.value)
+
+
+class LocalExtrinsic():
+    def __init__(self, signer: str, nonce: int, call: LocalCall):
+        self.signer = signer
+        self.nonce = nonce
+        self.call = call
+        self.extrinsic_hash = _hash([signer, nonce, call.value])
+
+
+class LocalReceipt():
+    def __init__(self, node, extrinsic_hash: str, block_hash: str = None):
+        self._node = node
+        self.extrinsic_hash = extrinsic_hash
+        self.block_hash = block_hash
+
+    def _inclusion(self) -> dict:
+        inclusion = self._node.inclusion(self.extrinsic_hash)
+        if inclusion is None or (self.block_hash and inclusion['block_hash'] != self.block_hash):
+            raise ValueError(f'{self.extrinsic_hash} is not in a block yet')
+        return inclusion
+
+    @property
+    def is_success(self) -> bool:
+        return self._inclusion()['error'] is None
+
+    @property
+    def error_message(self) -> dict:
+        return self._inclusion()['error']
+
+    @property
+    def triggered_events(self) -> [LocalScale]:
+        return [LocalScale(_) for _ in self._inclusion()['events']]
+
+    def get_extrinsic_identifier(self) -> str:
+        inclusion = self._inclusion()
+        return f'{inclusion["block_number"]}-{inclusion["index"]}'
+
+
+class LocalNode():
+    '''
+    A stand-in for a peaq node with the pallets and calls this project uses. One thread
+    seals a block every block_time seconds from the extrinsics whose nonce is next.
+    The state is kept for the best block only.
+    '''
+    def __init__(self, block_time: float, endowment: int):
+        self._block_time = block_time
+        self._endowment = endowment
+        self._cond = threading.Condition()
+        # ss58 address -> {'nonce', 'free'}
+        self._accounts = {}
+        # (multisig ss58 address, call hash) -> {'when', 'approvals', 'call'}
+        self._multisigs = {}
+        # (did account, name) -> attribute
+        self._attributes = {}
+        # extrinsics in arrival order, and (signer, nonce) of them
+        self._pool = []
+        self._pooled = set()
+        # extrinsic hash -> block hash, block number, index, error, events
+        self._inclusions = {}
+        self._blocks = []
+        self._calls = {
+            ('Balances', 'transfer'): self.transfer,
+            ('Balances', 'set_balance'): self.set_balance,
+            ('Sudo', 'sudo'): self.sudo,
+            ('Utility', 'batch_all'): self.batch_all,
+            ('MultiSig', 'as_multi'): self.as_multi,
+            ('MultiSig', 'approve_as_multi'): self.approve_as_multi,
+            ('Transaction', 'service_requested'): self.service_requested,
+            ('Transaction', 'service_delivered'): self.service_delivered,
+            ('PeaqDid', 'add_attribute'): self.add_attribute,
+            ('PeaqDid', 'update_attribute'): self.update_attribute,
+            ('PeaqDid', 'read_attribute'): self.read_attribute,
+        }
+        self._seal([])
+        self._thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(self._block_time)
+            with self._cond:
+                self._seal(self._take_ready())
+                self._cond.notify_all()
+
+    def is_call(self, module: str, function: str) -> bool:
+        return (module, function) in self._calls
+
+    # The state
+
+    def _account(self, ss58_addr: str) -> dict:
+        return self._accounts.setdefault(ss58_addr, {'nonce': 0, 'free': 0})
+
+    def account(self, ss58_addr: str) -> dict:
+        with self._cond:
+            account = self._accounts.get(ss58_addr, {'nonce': 0, 'free': 0})
+            return {
+                'nonce': account['nonce'],
+                'consumers': 0,
+                'providers': 1,
+                'sufficients': 0,
+                'data': {'free': account['free'], 'reserved': 0, 'misc_frozen': 0, 'fee_frozen': 0},
+            }
+
+    def next_nonce(self, ss58_addr: str) -> int:
+        '''
+        Counts the extrinsics waiting in the pool, as accountNextIndex does
+        '''
+        with self._cond:
+            nonce = self._accounts.get(ss58_addr, {'nonce': 0})['nonce']
+            while (ss58_addr, nonce) in self._pooled:
+                nonce += 1
+            return nonce
+
+    # The blocks
+
+    def head(self) -> dict:
+        with self._cond:
+            return self._blocks[-1]
+
+    def block(self, block_hash: str = None, block_number: int = None) -> dict:
+        with self._cond:
+            if block_hash is None and block_number is None:
+                return self._blocks[-1]
+            if block_number is not None:
+                return self._blocks[block_number] if block_number < len(self._blocks) else None
+            return next((_ for _ in reversed(self._blocks) if _['header']['hash'] == block_hash), None)
+
+    def wait_block(self, block_number: int) -> dict:
+        with self._cond:
+            while len(self._blocks) <= block_number:
+                self._cond.wait()
+            return self._blocks[block_number]
+
+    def inclusion(self, extrinsic_hash: str) -> dict:
+        with self._cond:
+            return self._inclusions.get(extrinsic_hash)
+
+    def wait_inclusion(self, extrinsic_hash: str) -> dict:
+        with self._cond:
+            while extrinsic_hash not in self._inclusions:
+                self._cond.wait()
+            return self._inclusions[extrinsic_hash]
+
+    # The extrinsic pool
+
+    def submit(self, extrinsic: LocalExtrinsic) -> str:
+        with self._cond:
+            # A new signer gets the endowment, so it can pay for what it sends
+            if extrinsic.signer not in self._accounts:
+                self._account(extrinsic.signer)['free'] = self._endowment
+            key = (extrinsic.signer, extrinsic.nonce)
+            if extrinsic.nonce < self._accounts[extrinsic.signer]['nonce'] or key in self._pooled:
+                raise SubstrateRequestException({
+                    'code': 1010, 'message': 'Invalid Transaction', 'data': 'Transaction is outdated'})
+            self._pool.append(extrinsic)
+            self._pooled.add(key)
+        return f'0x{extrinsic.extrinsic_hash.hex()}'
+
+    def _take_ready(self) -> [LocalExtrinsic]:
+        '''
+        The pooled extrinsics whose nonce follows the one of their signer, gaps keep waiting
+        '''
+        nonces = {}
+        ready = []
+        progress = True
+        while progress:
+            progress = False
+            for extrinsic in list(self._pool):
+                nonce = nonces.setdefault(extrinsic.signer, self._accounts[extrinsic.signer]['nonce'])
+                if extrinsic.nonce == nonce:
+                    nonces[extrinsic.signer] = nonce + 1
+                    ready.append(extrinsic)
+                    self._pool.remove(extrinsic)
+                    self._pooled.discard((extrinsic.signer, extrinsic.nonce))
+                    progress = True
+        return ready
+
+    def _seal(self, extrinsics: [LocalExtrinsic]):
+        number = len(self._blocks)
+        block_hash = f'0x{_hash([number, [_.extrinsic_hash.hex() for _ in extrinsics]]).hex()}'
+        events = []
+        for index, extrinsic in enumerate(extrinsics):
+            error, triggered = self._apply(extrinsic, {'height': number, 'index': index})
+            events += [(index, _) for _ in triggered]
+            self._inclusions[f'0x{extrinsic.extrinsic_hash.hex()}'] = {
+                'block_hash': block_hash,
+                'block_number': number,
+                'index': index,
+                'error': error,
+                'events': triggered,
+            }
+        self._blocks.append({
+            'header': {'number': number, 'hash': block_hash},
+            'extrinsics': extrinsics,
+            'events': events,
+        })
+
+    def _apply(self, extrinsic: LocalExtrinsic, timepoint: dict) -> (dict, [dict]):
+        self._account(extrinsic.signer)['nonce'] += 1
+        events = []
+        try:
+            self.dispatch(extrinsic.signer, extrinsic.call.value, timepoint, events)
+        except LocalDispatchError as err:
+            return err.error, [self._event('System', 'ExtrinsicFailed', [err.error, {}])]
+        return None, events + [self._event('System', 'ExtrinsicSuccess', [{}])]
+
+    # The calls, a failing one raises before it changes the state
+
+    def _event(self, module: str, event: str, attributes) -> dict:
+        return {'module_id': module, 'event_id': event, 'attributes': attributes}
+
+    def dispatch(self, origin: str, call: dict, timepoint: dict, events: list):
+        handler = self._calls.get((call['call_module'], call['call_function']))
+        if handler is None:
+            raise LocalDispatchError(call['call_module'], 'CallNotServed')
+        handler(origin, call['call_args'], timepoint, events)
+
+    def transfer(self, origin: str, args: dict, timepoint: dict, events: list):
+        source, value = self._account(origin), int(args['value'])
+        if source['free'] < value:
+            raise LocalDispatchError('Balances', 'InsufficientBalance')
+        source['free'] -= value
+        self._account(args['dest'])['free'] += value
+        events.append(self._event('Balances', 'Transfer', [_public_key(origin), _public_key(args['dest']), value]))
+
+    def set_balance(self, origin: str, args: dict, timepoint: dict, events: list):
+        self._account(args['who'])['free'] = int(args['new_free'])
+        events.append(self._event('Balances', 'BalanceSet', [_public_key(args['who']), int(args['new_free']), 0]))
+
+    def sudo(self, origin: str, args: dict, timepoint: dict, events: list):
+        # Everybody is the sudo key of a local node
+        self.dispatch(origin, args['call'], timepoint, events)
+        events.append(self._event('Sudo', 'Sudid', [{'Ok': None}]))
+
+    def batch_all(self, origin: str, args: dict, timepoint: dict, events: list):
+        saved = copy.deepcopy((self._accounts, self._multisigs, self._attributes))
+        try:
+            for call in args['calls']:
+                self.dispatch(origin, call, timepoint, events)
+        except LocalDispatchError:
+            self._accounts, self._multisigs, self._attributes = saved
+            raise
+        events.append(self._event('Utility', 'BatchCompleted', []))
+
+    def as_multi(self, origin: str, args: dict, timepoint: dict, events: list):
+        self._approve(origin, args, f'0x{_hash(args["call"]).hex()}', args['call'], timepoint, events)
+
+    def approve_as_multi(self, origin: str, args: dict, timepoint: dict, events: list):
+        self._approve(origin, args, args['call_hash'], None, timepoint, events)
+
+    def _approve(self, origin: str, args: dict, call_hash: str, call: dict, timepoint: dict, events: list):
+        threshold = args['threshold']
+        multisig = ChainUtils.calculate_multi_sig([origin] + list(args['other_signatories']), threshold)
+        key = (multisig, call_hash)
+        operation = self._multisigs.get(key)
+        if operation is None:
+            if args['maybe_timepoint']:
+                raise LocalDispatchError('MultiSig', 'UnexpectedTimepoint')
+            self._multisigs[key] = {'when': timepoint, 'approvals': [origin], 'call': call}
+            events.append(self._event('MultiSig', 'NewMultisig',
+                                      [_public_key(origin), _public_key(multisig), call_hash]))
+            return
+
+        if args['maybe_timepoint'] != operation['when']:
+            raise LocalDispatchError('MultiSig', 'WrongTimepoint')
+        if origin in operation['approvals']:
+            raise LocalDispatchError('MultiSig', 'AlreadyApproved')
+        operation['call'] = operation['call'] or call
+        operation['approvals'].append(origin)
+        if len(operation['approvals']) < threshold or operation['call'] is None:
+            events.append(self._event('MultiSig', 'MultisigApproval',
+                                      [_public_key(origin), operation['when'], _public_key(multisig), call_hash]))
+            return
+
+        del self._multisigs[key]
+        inner = []
+        try:
+            self.dispatch(multisig, operation['call'], timepoint, inner)
+            result = {'Ok': None}
+        except LocalDispatchError as err:
+            inner, result = [], {'Err': err.error}
+        events += inner
+        events.append(self._event('MultiSig', 'MultisigExecuted',
+                                  [_public_key(origin), operation['when'], _public_key(multisig), call_hash, result]))
+
+    def service_requested(self, origin: str, args: dict, timepoint: dict, events: list):
+        events.append(self._event('Transaction', 'ServiceRequested',
+                                  [_public_key(origin), _public_key(args['provider']), int(args['token_deposited'])]))
+
+    def service_delivered(self, origin: str, args: dict, timepoint: dict, events: list):
+        events.append(self._event('Transaction', 'ServiceDelivered', [
+            _public_key(origin), _public_key(args['consumer']), args['refund_info'], args['spent_info']]))
+
+    def _attribute(self, args: dict, timepoint: dict) -> dict:
+        value = args['value']
+        return {
+            'name': args['name'],
+            'value': value.decode('ascii') if isinstance(value, bytes) else value,
+            'validity': args['valid_for'],
+            'created': timepoint['height'],
+        }
+
+    def add_attribute(self, origin: str, args: dict, timepoint: dict, events: list):
+        key = (args['did_account'], args['name'])
+        if key in self._attributes:
+            raise LocalDispatchError('PeaqDid', 'AttributeAlreadyExist')
+        self._attributes[key] = self._attribute(args, timepoint)
+        events.append(self._event('PeaqDid', 'AttributeAdded', [
+            _public_key(origin), _public_key(args['did_account']), args['name'], self._attributes[key]['value']]))
+
+    def update_attribute(self, origin: str, args: dict, timepoint: dict, events: list):
+        key = (args['did_account'], args['name'])
+        if key not in self._attributes:
+            raise LocalDispatchError('PeaqDid', 'AttributeNotFound')
+        self._attributes[key] = self._attribute(args, timepoint)
+        events.append(self._event('PeaqDid', 'AttributeUpdated', [
+            _public_key(origin), _public_key(args['did_account']), args['name'], self._attributes[key]['value']]))
+
+    def read_attribute(self, origin: str, args: dict, timepoint: dict, events: list):
+        attribute = self._attributes.get((args['did_account'], args['name']))
+        if attribute is None:
+            raise LocalDispatchError('PeaqDid', 'AttributeNotFound')
+        events.append(self._event('PeaqDid', 'AttributeRead', dict(attribute)))
+
+
+class LocalSubstrate():
+    '''
+    The part of SubstrateInterface this project calls, served by a LocalNode
+    '''
+    _subscription_ids = itertools.count()
+
+    def __init__(self, url: str, node: LocalNode):
+        self.url = url
+        self._node = node
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        pass
+
+    def connect_websocket(self):
+        pass
+
+    def rpc_request(self, method: str, params: list) -> dict:
+        if method == 'system_health':
+            return {'result': {'peers': 0, 'isSyncing': False, 'shouldHavePeers': False}}
+        if method == 'system_accountNextIndex':
+            return {'result': self._node.next_nonce(params[0])}
+        raise SubstrateRequestException(f'{method} is not served by the local node')
+
+    def compose_call(self, call_module: str, call_function: str, call_params: dict = None) -> LocalCall:
+        if not self._node.is_call(call_module, call_function):
+            raise ValueError(f'Call function "{call_module}.{call_function}" not found')
+        return LocalCall(call_module, call_function, call_params or {})
+
+    def get_account_nonce(self, account_address: str) -> int:
+        return self._node.next_nonce(account_address)
+
+    def create_signed_extrinsic(self, call: LocalCall, keypair, era: dict = None, nonce: int = None) -> LocalExtrinsic:
+        if nonce is None:
+            nonce = self.get_account_nonce(keypair.ss58_address)
+        return LocalExtrinsic(keypair.ss58_address, nonce, call)
+
+    def submit_extrinsic(self, extrinsic: LocalExtrinsic, wait_for_inclusion: bool = False,
+                         wait_for_finalization: bool = False) -> LocalReceipt:
+        extrinsic_hash = self._node.submit(extrinsic)
+        if not (wait_for_inclusion or wait_for_finalization):
+            return LocalReceipt(self._node, extrinsic_hash)
+        return LocalReceipt(self._node, extrinsic_hash, self._node.wait_inclusion(extrinsic_hash)['block_hash'])
+
+    def create_receipt(self, extrinsic_hash: str, block_hash: str) -> LocalReceipt:
+        return LocalReceipt(self._node, extrinsic_hash, block_hash)
+
+    def get_chain_head(self) -> str:
+        return self._node.head()['header']['hash']
+
+    def get_block_hash(self, block_id: int) -> str:
+        block = self._node.block(block_number=block_id)
+        return block['header']['hash'] if block else None
+
+    def get_block_number(self, block_hash: str) -> int:
+        block = self._node.block(block_hash=block_hash)
+        return block['header']['number'] if block else None
+
+    def get_block(self, block_hash: str = None, block_number: int = None) -> dict:
+        block = self._node.block(block_hash, block_number)
+        return {'header': dict(block['header']), 'extrinsics': list(block['extrinsics'])} if block else None
+
+    def subscribe_block_headers(self, subscription_handler, ignore_decoding_errors: bool = False,
+                                include_author: bool = False, finalized_only: bool = False):
+        subscription_id = next(self._subscription_ids)
+        number = self._node.head()['header']['number']
+        for update_nr in itertools.count():
+            block = self._node.wait_block(number)
+            # Like the node, the new heads come without their hash
+            result = subscription_handler({'header': {'number': block['header']['number']}}, update_nr, subscription_id)
+            if result is not None:
+                return result
+            number += 1
+
+    def query(self, module: str, storage_function: str, params: list = None, block_hash: str = None,
+              subscription_handler=None):
+        if (module, storage_function) == ('System', 'Account'):
+            # The state of the best block, whatever block_hash asks for
+            return LocalScale(self._node.account(params[0]))
+        if (module, storage_function) != ('System', 'Events') or subscription_handler is None:
+            raise ValueError(f'Storage function "{module}.{storage_function}" not served by the local node')
+
+        subscription_id = next(self._subscription_ids)
+        number = self._node.head()['header']['number'] + 1
+        for update_nr in itertools.count():
+            block = self._node.wait_block(number)
+            result = subscription_handler([{'extrinsic_idx': index, 'event': LocalScale(event)}
+                                           for index, event in block['events']], update_nr, subscription_id)
+            if result is not None:
+                return result
+            number += 1
@@ -1,20 +1,29 @@
 import logging
 import time
 import os
+import re
+import gzip
+import queue
+import atexit
+import bisect
+import shutil
 
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
 from threading import Lock
 import threading
 import datetime
 
 kibi = 1024
+LOG_BATCH = 256
+RETENTION_PERIOD = 10
 
 
-def init_logger(when='d', maxKB=200, backups=4, path="/peaq/simulator/etc/logs/log", storeFor=5):
+def init_logger(when='d', maxKB=200, backups=4, path="/peaq/simulator/etc/logs/log", storeFor=5, asynchronous=False,
+                compress=False):
     maxBytes = kibi * maxKB
     file_handler = TimeSizeRotatingFileHandler(
         path,
-        when=when, maxBytes=maxBytes, backupCount=backups, storeFor=storeFor)
+        when=when, maxBytes=maxBytes, backupCount=backups, storeFor=storeFor, compress=compress)
     console_handler = logging.StreamHandler()
 
     formatter = logging.Formatter('%(asctime)s - %(filename)s:%(lineno)d - %(levelname)s : %(message)s')
@@ -26,30 +35,115 @@ def init_logger(when='d', maxKB=200, backups=4, path="/peaq/simulator/etc/logs/l
 
     logger = logging.getLogger('simulator-logger')
     logger.setLevel(logging.INFO)
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    if asynchronous:
+        # The callers only enqueue the records, one thread formats and writes them
+        log_queue = queue.SimpleQueue()
+        listener = BatchQueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        logger.addHandler(DeferredQueueHandler(log_queue))
+    else:
+        logger.addHandler(file_handler)
+        logger.addHandler(console_handler)
 
     return logger
 
 
+class DeferredQueueHandler(QueueHandler):
+    def prepare(self, record):
+        """
+        Unlike QueueHandler, do not format the record here, only resolve what cannot wait
+        for the listener thread: the arguments may change and the traceback goes away.
+        """
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class BatchQueueListener(QueueListener):
+    def _monitor(self):
+        """
+        Wake up once for whatever is queued, at most LOG_BATCH records, instead of once per record
+        """
+        while True:
+            records = [self.dequeue(True)]
+            while len(records) < LOG_BATCH:
+                try:
+                    records.append(self.dequeue(False))
+                except queue.Empty:
+                    break
+
+            for record in records:
+                if record is self._sentinel:
+                    return
+                self.handle(record)
+
+
 class TimeSizeRotatingFileHandler(TimedRotatingFileHandler):
     def __init__(self, filename,
                  when='d', interval=1, backupCount=4, encoding=None,
-                 delay=0, utc=0, maxBytes=1000, storeFor=5):
+                 delay=0, utc=0, maxBytes=1000, storeFor=5, compress=False):
         """ This is just a combination of TimeSizeRotatingFileHandler and RotatingFileHandler (adds maxBytes to TimeSizeRotatingFileHandler)  """
+        self.bytesWritten = 0
         super().__init__(filename, when, interval, backupCount, encoding, delay, utc)
 
         self.maxBytes = maxBytes
         self.storeFor = storeFor
+        self.compress = compress
         self.mutex = Lock()
+        dirName, baseName = os.path.split(self.baseFilename)
+        self.rotatedMatch = re.compile(
+            r'^' + re.escape(baseName) + r'\.(\d{4}-\d{2}-\d{2}[\w-]*)\.(\d{3,})(\.gz)?$')
+        # The rotated files as (time suffix, count, path), the oldest first
+        self.rotated = self.scanRotatedFiles()
         self.deleteOldFiles()
 
+        # Retention and compression run on one worker, the rollover only renames
+        self.jobs = queue.Queue()
+        self.worker = threading.Thread(target=self.work, daemon=True)
+        self.worker.start()
+
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
 
+    def close(self):
+        super().close()
+        if getattr(self, 'worker', None) and self.worker.is_alive():
+            self.jobs.put(None)
+            if self.worker is not threading.current_thread():
+                self.worker.join()
+
+    def _open(self):
+        stream = super()._open()
+        self.bytesWritten = stream.tell()
+        return stream
+
+    def emit(self, record):
+        """
+        Format the record once, for both the size check and the write
+        """
+        try:
+            msg = self.format(record) + self.terminator
+            size = len(msg) if msg.isascii() else len(msg.encode(self.encoding or 'utf-8'))
+            if self.shouldRolloverSize(size):
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(msg)
+            self.flush()
+            self.bytesWritten += size
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
     def shouldRollover(self, record):
         """
         Determine if rollover should occur.
@@ -59,16 +153,17 @@ class TimeSizeRotatingFileHandler(TimedRotatingFileHandler):
 
         we are also comparing times
         """
-        with self.mutex:
-            if self.stream is None:                 # delay was set...
-                self.stream = self._open()
-            if self.maxBytes > 0:                   # are we rolling over?
-                msg = "%s\n" % self.format(record)
-                if self.stream.tell() + len(msg) >= self.maxBytes:
-                    return 1
-            t = int(time.time())
-            if t >= self.rolloverAt:
+        return self.shouldRolloverSize(len("%s\n" % self.format(record)))
+
+    def shouldRolloverSize(self, size: int):
+        if self.stream is None:                 # delay was set...
+            self.stream = self._open()
+        if self.maxBytes > 0:                   # are we rolling over?
+            if self.bytesWritten + size >= self.maxBytes:
                 return 1
+        t = int(time.time())
+        if t >= self.rolloverAt:
+            return 1
         return 0
 
     def doRollover(self):
@@ -76,12 +171,13 @@ class TimeSizeRotatingFileHandler(TimedRotatingFileHandler):
         do a rollover; in this case, a date/time stamp is appended to the filename
         when the rollover happens.  However, you want the file to be named for the
         start of the interval, not the current time.  If there is a backup count,
-        then we have to get a list of matching filenames, sort them and remove
-        the one with the oldest suffix.
+        the next count of that time stamp comes from the index of rotated files,
+        and the oldest ones over the count are removed.
         """
         with self.mutex:
             if self.stream:
                 self.stream.close()
+                self.stream = None
             # get the time that this sequence started at and make it a TimeTuple
             currentTime = int(time.time())
             dstNow = time.localtime(currentTime)[-1]
@@ -100,21 +196,15 @@ class TimeSizeRotatingFileHandler(TimedRotatingFileHandler):
             timeSuffix = time.strftime(self.suffix, timeTuple)
             dfn = self.baseFilename + "." + timeSuffix
             if self.backupCount > 0:
-                cnt = 1
+                cnt = 1 + max([_[1] for _ in self.rotated if _[0] == timeSuffix], default=0)
                 dfn2 = "%s.%03d" % (dfn, cnt)
-                present = self.isDateLogFilesPresent(timeSuffix)
-                if present:
-                    while not os.path.exists(dfn2):
-                        dfn2 = "%s.%03d" % (dfn, cnt)
-                        cnt += 1
-                while os.path.exists(dfn2):
-                    dfn2 = "%s.%03d" % (dfn, cnt)
-                    cnt += 1
-                os.rename(self.baseFilename, dfn2)
+                if os.path.exists(self.baseFilename):
+                    os.rename(self.baseFilename, dfn2)
+                    bisect.insort(self.rotated, (timeSuffix, cnt, dfn2))
+                    if self.compress:
+                        self.jobs.put(dfn2)
                 for s in self.getFilesToDelete():
-                    if (s == self.baseFilename):
-                        continue
-                    os.remove(s)
+                    self.removeRotated(s)
             else:
                 if os.path.exists(dfn):
                     os.remove(dfn)
@@ -135,69 +225,79 @@ class TimeSizeRotatingFileHandler(TimedRotatingFileHandler):
                     newRolloverAt += addend
             self.rolloverAt = newRolloverAt
 
+    def scanRotatedFiles(self) -> list:
+        """
+        List the log directory once, later rollovers only update this index
+        """
+        dirName, baseName = os.path.split(self.baseFilename)
+        rotated = []
+        for fileName in os.listdir(dirName):
+            match = self.rotatedMatch.match(fileName)
+            if match:
+                rotated.append((match.group(1), int(match.group(2)), os.path.join(dirName, fileName)))
+        return sorted(rotated)
+
     def getFilesToDelete(self):
         """
         Determine the files to delete when rolling over.
         """
-        dirName, baseName = os.path.split(self.baseFilename)
-        fileNames = os.listdir(dirName)
-        result = []
-        prefix = baseName + "."
-        plen = len(prefix)
-        for fileName in fileNames:
-            if fileName[:plen] == prefix:
-                suffix = fileName[plen:-4]
-                if self.extMatch.match(suffix):
-                    result.append(os.path.join(dirName, fileName))
-        result.sort()
-        if len(result) < self.backupCount:
-            result = []
-        else:
-            result = result[:len(result) - self.backupCount]
-
-        return result
-
-    def isDateLogFilesPresent(self, timeSuffix: str) -> bool:
-        dirName, baseName = os.path.split(self.baseFilename)
-        fileNames = os.listdir(dirName)
-        prefix = baseName + "." + timeSuffix
-        plen = len(prefix)
-        for fileName in fileNames:
-            if fileName[:plen] == prefix:
-                return True
-        return False
+        if len(self.rotated) < self.backupCount:
+            return []
+        return self.rotated[:len(self.rotated) - self.backupCount]
+
+    def removeRotated(self, entry: tuple) -> None:
+        self.rotated.remove(entry)
+        for path in [entry[2], entry[2] + '.gz']:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def work(self) -> None:
+        nextRetention = time.monotonic() + RETENTION_PERIOD
+        while True:
+            try:
+                path = self.jobs.get(timeout=max(nextRetention - time.monotonic(), 0))
+            except queue.Empty:
+                self.deleteOldFiles()
+                nextRetention = time.monotonic() + RETENTION_PERIOD
+                continue
+            if path is None:
+                return
+            self.compressFile(path)
+
+    def compressFile(self, path: str) -> None:
+        """
+        Gzip a rotated file, and point its entry of the index to the compressed one
+        """
+        try:
+            with open(path, 'rb') as src, gzip.open(path + '.gz', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+        except FileNotFoundError:
+            # Removed by the retention in the meantime
+            return
+
+        with self.mutex:
+            entry = [_ for _ in self.rotated if _[2] == path]
+            if not entry:
+                if os.path.exists(path + '.gz'):
+                    os.remove(path + '.gz')
+                return
+            self.rotated[self.rotated.index(entry[0])] = entry[0][:2] + (path + '.gz',)
+            os.remove(path)
 
     def deleteOldFiles(self) -> None:
         """
-        Determine if the filenames in the logging directory exceed storage period and if so delete the file.
+        Determine if the rotated files exceed storage period and if so delete the file.
         """
         with self.mutex:
-            dirName, baseName = os.path.split(self.baseFilename)
-            fileNames = os.listdir(dirName)
-            prefix = baseName + "."
-            for fileName in fileNames:
-                if fileName.startswith(prefix) and self.isOld(fileName):
-                    os.remove(os.path.join(dirName, fileName))
-            threading.Timer(10, self.deleteOldFiles).start()
+            for entry in [_ for _ in self.rotated if self.isOld(_[0])]:
+                self.removeRotated(entry)
 
-    def isOld(self, fileName: str) -> bool:
+    def isOld(self, timeSuffix: str) -> bool:
         """
-        Determine if the filename exceeds storage period and if so returns True.
+        Determine if the time suffix of a rotated file exceeds storage period and if so returns True.
         Else returns False
         """
-        dirName, baseName = os.path.split(self.baseFilename)
-        if baseName == fileName:
-            return False
-        filePath = os.path.join(dirName, fileName)
-        if not os.path.exists(filePath):
-            return False
-
-        fileCreationYear = int(fileName[4:8])
-        fileCreationMonth = int(fileName[9:11])
-        fileCreationDay = int(fileName[12:14])
-
-        start = datetime.datetime(fileCreationYear, fileCreationMonth, fileCreationDay,
-                                  0, 0, 0, 0)
+        start = datetime.datetime.strptime(timeSuffix[:10], '%Y-%m-%d')
         end = datetime.datetime.now()
         delta = end - start
 
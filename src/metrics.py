@@ -0,0 +1,217 @@
+import math
+import bisect
+import weakref
+import threading
+
+PREFIX = 'peaq_simulator_'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Seconds, from a local RPC to an extrinsic waiting for a few blocks
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class _Owner():
+    '''
+    Lives in the thread local of one thread, it goes away with the thread
+    '''
+    __slots__ = ['values', '__weakref__']
+
+    def __init__(self):
+        self.values = {}
+
+
+class Shards():
+    '''
+    One dict of values per thread. A thread only writes its own dict, so the hot path
+    takes no lock, and a scrape merges them all. The values of an ended thread are
+    merged into the retired ones, so short lived threads do not pile up.
+    '''
+    def __init__(self, merge):
+        # merge(total, values) adds values into total
+        self._merge = merge
+        self._local = threading.local()
+        # Finalizers may run on any thread, even in the middle of a scrape
+        self._lock = threading.RLock()
+        self._live = {}
+        self._retired = {}
+
+    def get(self) -> dict:
+        try:
+            return self._local.owner.values
+        except AttributeError:
+            return self._create()
+
+    def _create(self) -> dict:
+        owner = _Owner()
+        with self._lock:
+            self._live[id(owner.values)] = owner.values
+        weakref.finalize(owner, self._retire, owner.values)
+        self._local.owner = owner
+        return owner.values
+
+    def _retire(self, values: dict):
+        with self._lock:
+            self._live.pop(id(values), None)
+            self._merge(self._retired, values)
+
+    def collect(self) -> dict:
+        total = {}
+        with self._lock:
+            self._merge(total, self._retired)
+            for values in list(self._live.values()):
+                # Copying a dict is one step for the interpreter, its owner may keep writing
+                self._merge(total, values.copy())
+        return total
+
+
+def _merge_counts(total: dict, values: dict):
+    for labels, value in values.items():
+        total[labels] = total.get(labels, 0) + value
+
+
+def _merge_buckets(total: dict, values: dict):
+    for labels, counts in values.items():
+        counts = list(counts)
+        if labels in total:
+            total[labels] = [a + b for a, b in zip(total[labels], counts)]
+        else:
+            total[labels] = counts
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def format_labels(names: [str], values: tuple) -> str:
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Registry():
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def expose(self) -> str:
+        '''
+        The Prometheus text format of every metric
+        '''
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.TYPE}')
+            for name, labelnames, labels, value in metric.samples():
+                lines.append(f'{name}{format_labels(labelnames, labels)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Counter():
+    TYPE = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: [str] = (), registry: Registry = REGISTRY):
+        self.name = f'{PREFIX}{name}'
+        self.documentation = documentation
+        self._labelnames = tuple(labelnames)
+        self._shards = Shards(_merge_counts)
+        if registry:
+            registry.register(self)
+
+    def inc(self, *labels, amount: float = 1):
+        values = self._shards.get()
+        values[labels] = values.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        return self._shards.collect().get(labels, 0)
+
+    def samples(self):
+        for labels, value in sorted(self._shards.collect().items()):
+            yield self.name, self._labelnames, labels, value
+
+
+class Histogram():
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: [str] = (),
+                 buckets: tuple = LATENCY_BUCKETS, registry: Registry = REGISTRY):
+        self.name = f'{PREFIX}{name}'
+        self.documentation = documentation
+        self._labelnames = tuple(labelnames)
+        self._buckets = tuple(buckets) + (math.inf,)
+        # labels -> [count of every bucket, not cumulative, ..., sum]
+        self._shards = Shards(_merge_buckets)
+        if registry:
+            registry.register(self)
+
+    def observe(self, value: float, *labels):
+        values = self._shards.get()
+        counts = values.get(labels)
+        if counts is None:
+            counts = values[labels] = [0] * len(self._buckets) + [0.0]
+        counts[bisect.bisect_left(self._buckets, value)] += 1
+        counts[-1] += value
+
+    def count(self, *labels) -> int:
+        counts = self._shards.collect().get(labels)
+        return sum(counts[:-1]) if counts else 0
+
+    def samples(self):
+        labelnames = self._labelnames + ('le',)
+        for labels, counts in sorted(self._shards.collect().items()):
+            cumulative = 0
+            for bucket, count in zip(self._buckets, counts):
+                cumulative += count
+                yield f'{self.name}_bucket', labelnames, labels + (format_value(bucket),), cumulative
+            yield f'{self.name}_sum', self._labelnames, labels, counts[-1]
+            yield f'{self.name}_count', self._labelnames, labels, cumulative
+
+
+class Gauge():
+    '''
+    Read at scrape time from a function returning either a value, or labels -> value.
+    Nothing runs on the hot path.
+    '''
+    TYPE = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: [str] = (), registry: Registry = REGISTRY):
+        self.name = f'{PREFIX}{name}'
+        self.documentation = documentation
+        self._labelnames = tuple(labelnames)
+        self._function = None
+        if registry:
+            registry.register(self)
+
+    def set_function(self, function):
+        self._function = function
+
+    def samples(self):
+        if self._function is None:
+            return
+        values = self._function()
+        if not self._labelnames:
+            values = {(): values}
+        for labels, value in sorted(values.items()):
+            yield self.name, self._labelnames, labels if isinstance(labels, tuple) else (labels,), value
+
+
+EVENTS_PROCESSED = Counter('events_processed_total', 'Events the business logic processed, by type', ['event'])
+SESSIONS = Gauge('sessions', 'Open charging sessions, by state', ['state'])
+EXTRINSIC_INCLUSION = Histogram('extrinsic_inclusion_seconds', 'Seconds from the submission of an extrinsic to its inclusion')
+RPC_LATENCY = Histogram('substrate_rpc_seconds', 'Seconds of the Substrate RPC requests, by method', ['method'])
+REDIS_PUBLISHED = Counter('redis_published_total', 'Messages published to Redis, by channel', ['channel'])
+REDIS_CONSUMED = Counter('redis_consumed_total', 'Messages read from Redis, by channel', ['channel'])
+BROKEN_PIPE_RETRIES = Counter('broken_pipe_retries_total', 'Retries of the chain calls after a broken pipe, by call', ['call'])
+WEBSOCKET_CLIENTS = Gauge('websocket_clients', 'Connected Socket.IO clients')
@@ -0,0 +1,48 @@
+import threading
+
+
+class NonceManager():
+    '''
+    Hands out account nonces locally, so an extrinsic can be signed without asking
+    the node first and several extrinsics of one account can be in the pool at once
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (node url, ss58 address) -> next nonce to hand out
+        self._next = {}
+        # (node url, ss58 address) -> nonces submitted but not seen in a block yet
+        self._pending = {}
+
+    def allocate(self, substrate, ss58_addr: str) -> int:
+        key = (substrate.url, ss58_addr)
+        with self._lock:
+            if key not in self._next:
+                # accountNextIndex already counts the extrinsics in the pool
+                self._next[key] = substrate.get_account_nonce(ss58_addr)
+            nonce = self._next[key]
+            self._next[key] = nonce + 1
+            self._pending.setdefault(key, set()).add(nonce)
+            return nonce
+
+    def confirm(self, substrate, ss58_addr: str, nonce: int):
+        '''
+        Once a nonce is in a block, all the lower ones of the account are too
+        '''
+        key = (substrate.url, ss58_addr)
+        with self._lock:
+            pending = self._pending.get(key, set())
+            self._pending[key] = set([_ for _ in pending if _ > nonce])
+
+    def resync(self, substrate, ss58_addr: str):
+        '''
+        After a failed submission we cannot tell which nonces were used,
+        so the next allocation reads the nonce from the node again
+        '''
+        key = (substrate.url, ss58_addr)
+        with self._lock:
+            self._next.pop(key, None)
+            self._pending.pop(key, None)
+
+    def pending(self, substrate, ss58_addr: str) -> [int]:
+        with self._lock:
+            return sorted(self._pending.get((substrate.url, ss58_addr), set()))
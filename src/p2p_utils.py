@@ -1,5 +1,6 @@
 from peaq_network_ev_charging_message_format.python import p2p_message_format_pb2 as P2PMessage
 from substrateinterface import Keypair
+from src import wire_utils as WireUtils
 from src.constants import REDIS_OUT, REDIS_IN
 
 
@@ -24,7 +25,7 @@ def _create_service_request(ss58_consumer_addr: str, ss58_provider_addr: str, to
 def send_service_request(redis, kp_consumer: Keypair, ss58_provider_addr: str, token_num: int):
     event = _create_service_request(kp_consumer.ss58_address, ss58_provider_addr, token_num)
 
-    redis.publish(REDIS_IN, event.SerializeToString().hex().encode('ascii'))
+    redis.publish(REDIS_IN, WireUtils.encode_event(event))
 
 
 def _create_p2p_request_ack(wait_time: int, data_to_send: str, success: bool) -> P2PMessage.Event:
@@ -38,9 +39,9 @@ def _create_p2p_request_ack(wait_time: int, data_to_send: str, success: bool) ->
     return event_resp
 
 
-def send_request_ack(redis, wait_time: int, data_to_send: str, success: bool):
+def send_request_ack(redis, wait_time: int, data_to_send: str, success: bool, session_key: str = ''):
     request_ack = _create_p2p_request_ack(wait_time, data_to_send, success)
-    redis.publish(REDIS_OUT, request_ack.SerializeToString().hex().encode('ascii'))
+    redis.publish(REDIS_OUT, WireUtils.encode_event(request_ack), session_key)
 
 
 def _convert_transaction_value(info: dict):
@@ -72,7 +73,7 @@ def send_service_deliver(redis, kp: Keypair, ss58_user_addr: str,
                          refund_info: dict, spent_info: dict):
     delivered_data = _create_service_deliver_req(kp, ss58_user_addr, refund_info, spent_info)
 
-    redis.publish(REDIS_OUT, delivered_data.SerializeToString().hex().encode('ascii'))
+    redis.publish(REDIS_OUT, WireUtils.encode_event(delivered_data), ss58_user_addr)
 
 
 def _create_stop_charing_ack(data_to_send) -> P2PMessage.Event:
@@ -85,9 +86,9 @@ def _create_stop_charing_ack(data_to_send) -> P2PMessage.Event:
     return event_resp
 
 
-def send_stop_charing_ack(redis, data_to_send: str):
+def send_stop_charing_ack(redis, data_to_send: str, session_key: str = ''):
     ack = _create_stop_charing_ack(data_to_send)
-    redis.publish(REDIS_OUT, ack.SerializeToString().hex().encode('ascii'))
+    redis.publish(REDIS_OUT, WireUtils.encode_event(ack), session_key)
 
 
 def _create_stop_charging(success: bool):
@@ -99,16 +100,16 @@ def _create_stop_charging(success: bool):
     return event_resp
 
 
-def send_stop_charging(redis, success: bool):
+def send_stop_charging(redis, success: bool, session_key: str = ''):
     event = _create_stop_charging(success)
-    redis.publish(REDIS_IN, event.SerializeToString().hex().encode('ascii'))
+    redis.publish(REDIS_IN, WireUtils.encode_event(event), session_key)
 
 
 def create_server_charging_status():
     event = P2PMessage.Event()
     event.event_id = P2PMessage.EventType.CHARGING_STATUS
 
-    return event.SerializeToString().hex()
+    return WireUtils.encode_event(event)
 
 
 def _create_client_charging_status(progress: float, charging_period: int, energy_consumption: float, token_spent: int):
@@ -121,9 +122,10 @@ def _create_client_charging_status(progress: float, charging_period: int, energy
     charging_status_data.token_spent = str(token_spent)
     event.charging_status_data.CopyFrom(charging_status_data)
 
-    return event.SerializeToString().hex()
+    return WireUtils.encode_event(event)
 
 
-def send_client_charging_status(redis, progress: float, charging_period: str, energy_consumption: float, token_spent: int):
+def send_client_charging_status(redis, progress: float, charging_period: str, energy_consumption: float, token_spent: int,
+                                session_key: str = ''):
     event = _create_client_charging_status(progress, charging_period, energy_consumption, token_spent)
-    redis.publish(REDIS_OUT, event.encode('ascii'))
+    redis.publish(REDIS_OUT, event, session_key)
@@ -0,0 +1,142 @@
+import time
+import queue
+import logging
+import collections
+import threading
+from concurrent.futures import Future
+
+from substrateinterface import Keypair
+from src import chain_utils as ChainUtils
+from src import substrate_pool as SubstratePool
+from src import metrics as Metrics
+
+TRACKER_POLL_PERIOD = 1
+
+# An extrinsic waiting for its block: the block number and the time it was submitted at
+Pending = collections.namedtuple('Pending', ['future', 'ss58_addr', 'nonce', 'block', 'submitted'])
+
+
+def when_all(futures: [Future], callback):
+    '''
+    Call callback(futures) once, after the last of futures is done
+    '''
+    lock = threading.Lock()
+    remaining = [len(futures)]
+
+    def _on_done(_):
+        with lock:
+            remaining[0] -= 1
+            is_last = remaining[0] == 0
+        if is_last:
+            callback(futures)
+
+    for future in futures:
+        future.add_done_callback(_on_done)
+
+
+class ReceiptTracker():
+    '''
+    Submits extrinsics without waiting for their inclusion and resolves their
+    receipts by scanning the new blocks, all on one thread and one connection.
+    submit() returns a Future right away, its done callbacks run on the tracker thread.
+    '''
+    def __init__(self, ws_url: str, logger: logging.Logger):
+        self._logger = logger
+        self._substrate = ChainUtils.get_substrate_connection(ws_url)
+        self._queue = queue.Queue()
+        # extrinsic hash -> Pending
+        self._pending = {}
+        self._last_block = None
+        self._thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def submit(self, kp: Keypair, call) -> Future:
+        '''
+        call is either a composed call or a function composing it on the tracker connection
+        '''
+        future = Future()
+        self._queue.put((kp, call, future))
+        return future
+
+    def run(self):
+        while True:
+            try:
+                self._submit(*self._queue.get(timeout=TRACKER_POLL_PERIOD))
+                # Whatever is queued goes out back-to-back before we look at the blocks
+                while True:
+                    self._submit(*self._queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            try:
+                self._poll_blocks()
+            except SubstratePool.CONNECTION_ERRORS as err:
+                self._logger.error(f'lost the node while polling the blocks: {err}')
+                self._reconnect()
+            except Exception as err:
+                self._logger.error(f'failed to poll the blocks: {err}', exc_info=True)
+
+    def _reconnect(self):
+        # In place, the receipts handed out keep pointing at this connection
+        try:
+            SubstratePool.reconnect(self._substrate)
+        except Exception as err:
+            self._logger.error(f'failed to reconnect: {err}')
+
+    def _head_number(self) -> int:
+        return self._substrate.get_block_number(self._substrate.get_chain_head())
+
+    def _submit(self, kp: Keypair, call, future: Future):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            if callable(call):
+                call = call(self._substrate)
+            if self._last_block is None:
+                self._last_block = self._head_number()
+            nonce = ChainUtils.NONCES.allocate(self._substrate, kp.ss58_address)
+            extrinsic = self._substrate.create_signed_extrinsic(
+                call=call,
+                keypair=kp,
+                era={'period': ChainUtils.MORTAL_PERIOD},
+                nonce=nonce
+            )
+            submitted = time.monotonic()
+            receipt = self._substrate.submit_extrinsic(extrinsic, wait_for_inclusion=False)
+        except Exception as err:
+            ChainUtils.NONCES.resync(self._substrate, kp.ss58_address)
+            future.set_exception(err)
+            return
+        self._pending[receipt.extrinsic_hash] = Pending(future, kp.ss58_address, nonce, self._last_block, submitted)
+
+    def _poll_blocks(self):
+        if not self._pending:
+            self._last_block = None
+            return
+
+        head_number = self._head_number()
+        for number in range(self._last_block + 1, head_number + 1):
+            self._resolve_block(self._substrate.get_block_hash(number))
+            self._last_block = number
+
+        for extrinsic_hash, pending in list(self._pending.items()):
+            if head_number > pending.block + ChainUtils.MORTAL_PERIOD:
+                del self._pending[extrinsic_hash]
+                ChainUtils.NONCES.resync(self._substrate, pending.ss58_addr)
+                pending.future.set_exception(IOError(f'{extrinsic_hash} is not included before its era ends'))
+
+    def _resolve_block(self, block_hash: str):
+        block = self._substrate.get_block(block_hash=block_hash)
+        for extrinsic in block['extrinsics']:
+            if not extrinsic.extrinsic_hash:
+                continue
+            extrinsic_hash = f'0x{extrinsic.extrinsic_hash.hex()}'
+            if extrinsic_hash not in self._pending:
+                continue
+
+            pending = self._pending.pop(extrinsic_hash)
+            ChainUtils.NONCES.confirm(self._substrate, pending.ss58_addr, pending.nonce)
+            Metrics.EXTRINSIC_INCLUSION.observe(time.monotonic() - pending.submitted)
+            pending.future.set_result(ChainUtils.create_receipt(self._substrate, extrinsic_hash, block_hash))
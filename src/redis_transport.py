@@ -0,0 +1,188 @@
+import socket
+import logging
+import collections
+import redis
+
+from src.constants import REDIS_OUT, REDIS_SESSION_SEP
+from src import metrics as Metrics
+
+TRANSPORT_PUBSUB = 'pubsub'
+TRANSPORT_STREAMS = 'streams'
+TRANSPORTS = [TRANSPORT_PUBSUB, TRANSPORT_STREAMS]
+
+# What a subscriber receives: the shared channel, the session channels or both
+SCOPE_SHARED = 'shared'
+SCOPE_SESSION = 'session'
+SCOPE_ALL = 'all'
+
+READ_TIMEOUT = 30
+STREAM_MAX_DELIVERIES = 3
+
+Message = collections.namedtuple('Message', ['id', 'session_key', 'data'])
+
+
+def init_transport(r: redis.Redis, transport: str, batch: int, maxlen: int):
+    if transport == TRANSPORT_PUBSUB:
+        return PubSubTransport(r, batch)
+    if transport == TRANSPORT_STREAMS:
+        return StreamTransport(r, batch, maxlen)
+    raise IOError(f'transport {transport} is not one of {TRANSPORTS}')
+
+
+class RedisTransport():
+    def __init__(self, r: redis.Redis, batch: int):
+        self.redis = r
+        self._batch = batch
+
+    def publish(self, channel: str, data: bytes, session_key: str = ''):
+        raise NotImplementedError
+
+    def subscribe(self, channel: str, scope: str, group: str):
+        raise NotImplementedError
+
+
+class PubSubTransport(RedisTransport):
+    def publish(self, channel: str, data: bytes, session_key: str = ''):
+        Metrics.REDIS_PUBLISHED.inc(channel)
+        if not session_key:
+            self.redis.publish(channel, data)
+            return
+        self.redis.publish(f'{channel}{REDIS_SESSION_SEP}{session_key}', data)
+        # The P2P node and the socketio gateway only listen on the shared OUT channel
+        if channel == REDIS_OUT:
+            self.redis.publish(channel, data)
+
+    def subscribe(self, channel: str, scope: str, group: str):
+        return PubSubSubscriber(self.redis, channel, scope, self._batch)
+
+
+class PubSubSubscriber():
+    def __init__(self, r: redis.Redis, channel: str, scope: str, batch: int):
+        self._channel = channel
+        self._prefix = f'{channel}{REDIS_SESSION_SEP}'
+        self._batch = batch
+        # A session message on OUT is also published to the shared channel, right after.
+        # Listening to both, we drop that copy: the data of the session messages whose copy is due
+        self._mirrored = channel == REDIS_OUT and scope == SCOPE_ALL
+        self._copies = collections.Counter()
+        self._pubsub = r.pubsub()
+        if scope in [SCOPE_SHARED, SCOPE_ALL]:
+            self._pubsub.subscribe(channel)
+        if scope in [SCOPE_SESSION, SCOPE_ALL]:
+            self._pubsub.psubscribe(f'{self._prefix}*')
+
+    def _to_message(self, event_data: dict) -> Message:
+        channel = event_data['channel'].decode('utf-8')
+        session_key = channel[len(self._prefix):] if channel.startswith(self._prefix) else ''
+        data = event_data['data']
+        if self._mirrored:
+            if session_key:
+                self._copies[data] += 1
+            elif self._copies[data]:
+                # Any message with the same data would do, they are the same to the reader
+                self._copies[data] -= 1
+                if not self._copies[data]:
+                    del self._copies[data]
+                return None
+        return Message(None, session_key, data)
+
+    def read(self, timeout: float = READ_TIMEOUT) -> [Message]:
+        event_data = self._pubsub.get_message(True, timeout=timeout)
+        if event_data is None:
+            return []
+
+        # Drain whatever already arrived, up to the batch size
+        messages = [self._to_message(event_data)]
+        while len(messages) < self._batch:
+            event_data = self._pubsub.get_message(True, timeout=0)
+            if event_data is None:
+                break
+            messages.append(self._to_message(event_data))
+        messages = [_ for _ in messages if _ is not None]
+        Metrics.REDIS_CONSUMED.inc(self._channel, amount=len(messages))
+        return messages
+
+    def ack(self, message: Message):
+        pass
+
+
+class StreamTransport(RedisTransport):
+    def __init__(self, r: redis.Redis, batch: int, maxlen: int):
+        super().__init__(r, batch)
+        self._maxlen = maxlen
+
+    def publish(self, channel: str, data: bytes, session_key: str = ''):
+        Metrics.REDIS_PUBLISHED.inc(channel)
+        self.redis.xadd(channel, {'data': data, 'session': session_key},
+                        maxlen=self._maxlen, approximate=True)
+
+    def subscribe(self, channel: str, scope: str, group: str):
+        return StreamSubscriber(self.redis, channel, scope, group, self._batch)
+
+
+class StreamSubscriber():
+    def __init__(self, r: redis.Redis, channel: str, scope: str, group: str, batch: int):
+        self._r = r
+        self._channel = channel
+        self._scope = scope
+        self._group = group
+        # Pending entries belong to a consumer name, so it has to survive restarts
+        self._consumer = socket.gethostname()
+        self._batch = batch
+        self._logger = logging.getLogger('simulator-logger')
+
+        try:
+            self._r.xgroup_create(channel, group, id='$', mkstream=True)
+        except redis.exceptions.ResponseError as err:
+            if 'BUSYGROUP' not in str(err):
+                raise
+        self._replaying = True
+
+    def _is_in_scope(self, session_key: str) -> bool:
+        if self._scope == SCOPE_SESSION:
+            return bool(session_key)
+        return True
+
+    def _claim_pending(self) -> list:
+        pending = self._r.xpending_range(self._channel, self._group, min='-', max='+', count=self._batch,
+                                         consumername=self._consumer)
+        self._replaying = bool(pending)
+        entry_ids = []
+        for info in pending:
+            if info['times_delivered'] > STREAM_MAX_DELIVERIES:
+                self._logger.error(f'drop {self._channel} {info["message_id"]} after '
+                                   f'{STREAM_MAX_DELIVERIES} deliveries')
+                self._r.xack(self._channel, self._group, info['message_id'])
+                continue
+            entry_ids.append(info['message_id'])
+        if not entry_ids:
+            return []
+        # Claiming counts as a delivery, so a message that keeps crashing us is dropped eventually
+        return self._r.xclaim(self._channel, self._group, self._consumer, 0, entry_ids)
+
+    def read(self, timeout: float = READ_TIMEOUT) -> [Message]:
+        entries = []
+        # After a restart, first replay what was delivered to us but never acknowledged
+        if self._replaying:
+            entries = self._claim_pending()
+        if not self._replaying:
+            resp = self._r.xreadgroup(self._group, self._consumer, {self._channel: '>'},
+                                      count=self._batch, block=max(int(timeout * 1000), 1))
+            entries = resp[0][1] if resp else []
+
+        messages = []
+        for entry_id, fields in entries:
+            # The entry was trimmed away while it was pending
+            if not fields:
+                self._r.xack(self._channel, self._group, entry_id)
+                continue
+            session_key = fields.get(b'session', b'').decode('utf-8')
+            if not self._is_in_scope(session_key):
+                self._r.xack(self._channel, self._group, entry_id)
+                continue
+            messages.append(Message(entry_id, session_key, fields[b'data']))
+        Metrics.REDIS_CONSUMED.inc(self._channel, amount=len(messages))
+        return messages
+
+    def ack(self, message: Message):
+        self._r.xack(self._channel, self._group, message.id)
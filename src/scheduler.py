@@ -0,0 +1,112 @@
+import time
+import heapq
+import logging
+import itertools
+import threading
+
+
+# Rebuild the heap once most of it is cancelled timers
+COMPACT_MIN_SIZE = 1024
+
+
+class Timer():
+    __slots__ = ['due', 'period', 'callback', 'cancelled', '_scheduler']
+
+    def __init__(self, scheduler, due: float, period: float, callback):
+        self.due = due
+        self.period = period
+        self.callback = callback
+        self.cancelled = False
+        self._scheduler = scheduler
+
+    def cancel(self):
+        if not self.cancelled:
+            self.cancelled = True
+            self._scheduler.on_cancel()
+
+
+class Scheduler():
+    '''
+    Runs the timers of all sessions on one thread. A timer is a heap entry, a cancelled
+    one is dropped when it reaches the top of the heap.
+    '''
+    def __init__(self, logger: logging.Logger):
+        self._logger = logger
+        self._cond = threading.Condition()
+        # (due, sequence, timer), the sequence keeps timers with the same due in order
+        self._heap = []
+        self._sequence = itertools.count()
+        # Cancelled timers possibly still in the heap
+        self._cancelled = 0
+        self._thread = threading.Thread(target=self.run, daemon=True)
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len([_ for _ in self._heap if not _[2].cancelled])
+
+    def start(self):
+        self._thread.start()
+
+    def call_later(self, delay: float, callback, period: float = None) -> Timer:
+        timer = Timer(self, time.monotonic() + delay, period, callback)
+        self._push(timer)
+        return timer
+
+    def call_every(self, period: float, callback) -> Timer:
+        return self.call_later(period, callback, period)
+
+    def _push(self, timer: Timer):
+        with self._cond:
+            heapq.heappush(self._heap, (timer.due, next(self._sequence), timer))
+            self._cond.notify()
+
+    def on_cancel(self):
+        with self._cond:
+            self._cancelled += 1
+            # Far deadlines cancelled early would otherwise stay in the heap until they are due
+            if len(self._heap) >= COMPACT_MIN_SIZE and self._cancelled * 2 > len(self._heap):
+                self._heap = [_ for _ in self._heap if not _[2].cancelled]
+                heapq.heapify(self._heap)
+                self._cancelled = 0
+
+    def run(self):
+        while True:
+            for timer in self.pop_due(None):
+                self.fire(timer)
+
+    def pop_due(self, timeout: float) -> [Timer]:
+        '''
+        Wait for the next due timers, at most timeout seconds if it is set
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                while self._heap and self._heap[0][2].cancelled:
+                    heapq.heappop(self._heap)
+
+                now = time.monotonic()
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    timer = heapq.heappop(self._heap)[2]
+                    if not timer.cancelled:
+                        due.append(timer)
+                if due:
+                    return due
+
+                wait = self._heap[0][0] - now if self._heap else None
+                if deadline is not None:
+                    if now >= deadline:
+                        return []
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                self._cond.wait(wait)
+
+    def fire(self, timer: Timer):
+        try:
+            timer.callback()
+        except Exception as err:
+            self._logger.error(f'timer {timer.callback} failed: {err}', exc_info=True)
+
+        if timer.period is not None and not timer.cancelled:
+            # A late tick is not caught up, the next one keeps the period from now
+            timer.due = max(timer.due + timer.period, time.monotonic())
+            self._push(timer)
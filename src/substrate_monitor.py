@@ -1,18 +1,28 @@
-import redis
+import asyncio
 
 from src import chain_utils as ChainUtils
+from src import redis_transport as RedisTransport
+from src.event_filter import EventFilter
 from src.constants import REDIS_IN
 
 
-def run_substrate_monitor(ws_url: str, r: redis.Redis):
-    monitor = SubstrateMonitor(ws_url, r)
+def run_substrate_monitor(ws_url: str, r: RedisTransport.RedisTransport, event_filter: EventFilter = None):
+    monitor = SubstrateMonitor(ws_url, r, event_filter)
     monitor.register_monitor_event()
 
 
+async def run_substrate_monitor_async(ws_url: str, r: RedisTransport.RedisTransport,
+                                      event_filter: EventFilter = None):
+    # The subscription is a blocking websocket loop, so it keeps one executor thread
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, run_substrate_monitor, ws_url, r, event_filter)
+
+
 class SubstrateMonitor():
-    def __init__(self, ws_url: str, r: redis.Redis):
+    def __init__(self, ws_url: str, r: RedisTransport.RedisTransport, event_filter: EventFilter = None):
         self._substrate = ChainUtils.get_substrate_connection(ws_url)
         self._redis = r
+        self._filter = event_filter
 
     def __del__(self):
         if self._substrate:
@@ -24,9 +34,11 @@ class SubstrateMonitor():
             event = obj['event'].value
             if event['event_id'] in filter_list:
                 continue
+            if self._filter and not self._filter.is_relevant(event):
+                continue
 
             data_to_send = ChainUtils.create_chain_event_data(event)
-            self._redis.publish(REDIS_IN, data_to_send.encode('ascii'))
+            self._redis.publish(REDIS_IN, data_to_send)
 
     def register_monitor_event(self):
         self._substrate.query('System', 'Events',
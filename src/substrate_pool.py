@@ -0,0 +1,124 @@
+import time
+import logging
+import threading
+import contextlib
+
+from websocket import WebSocketException
+
+# What tells us the socket under a connection is gone
+CONNECTION_ERRORS = (BrokenPipeError, ConnectionError, WebSocketException)
+
+
+def reconnect(substrate):
+    '''
+    Open a new websocket under the same connection object, so the callers holding it
+    keep a live connection and the loaded metadata does not have to be fetched again
+    '''
+    substrate.close()
+    substrate.connect_websocket()
+
+
+class SubstratePool():
+    '''
+    Shares a few node connections between the callers, one call at a time per connection.
+    Idle connections are pinged to keep them open and a dead one is only reconnected
+    when it is checked out again.
+    '''
+    def __init__(self, connect, size: int, keepalive_period: int):
+        self._connect = connect
+        self._size = size
+        self._keepalive_period = keepalive_period
+        self._logger = logging.getLogger('simulator-logger')
+        self._cond = threading.Condition()
+        # [connection, last used, alive], the most recently used one is handed out first
+        self._idle = []
+        self._count = 0
+        self._keepalive_thread = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def checkout(self):
+        with self._cond:
+            self._start_keepalive()
+            while not self._idle and self._count >= self._size:
+                self._cond.wait()
+            if self._idle:
+                entry = self._idle.pop()
+            else:
+                self._count += 1
+                entry = None
+
+        if entry is None:
+            return self._open()
+        substrate, _, alive = entry
+        if alive:
+            return substrate
+        try:
+            reconnect(substrate)
+        except Exception as err:
+            self._logger.error(f'failed to reconnect {substrate.url}, replace it: {err}')
+            substrate.close()
+            return self._open()
+        return substrate
+
+    def checkin(self, substrate, alive: bool = True):
+        with self._cond:
+            self._idle.append([substrate, time.monotonic(), alive])
+            self._cond.notify()
+
+    @contextlib.contextmanager
+    def connection(self):
+        substrate = self.checkout()
+        try:
+            yield substrate
+        except CONNECTION_ERRORS:
+            self.checkin(substrate, False)
+            raise
+        except BaseException:
+            self.checkin(substrate)
+            raise
+        self.checkin(substrate)
+
+    def invalidate(self):
+        '''
+        Reconnect every idle connection on its next checkout
+        '''
+        with self._cond:
+            for entry in self._idle:
+                entry[2] = False
+
+    def _open(self):
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._count -= 1
+                self._cond.notify()
+            raise
+
+    def _start_keepalive(self):
+        if self._keepalive_thread is None:
+            self._keepalive_thread = threading.Thread(target=self.keepalive, daemon=True)
+            self._keepalive_thread.start()
+
+    def keepalive(self):
+        while True:
+            time.sleep(self._keepalive_period)
+            self.ping_idle()
+
+    def ping_idle(self):
+        deadline = time.monotonic() - self._keepalive_period
+        with self._cond:
+            quiet, recent = [], []
+            for entry in self._idle:
+                (quiet if entry[2] and entry[1] < deadline else recent).append(entry)
+            self._idle = recent
+
+        for substrate, _, _ in quiet:
+            try:
+                substrate.rpc_request('system_health', [])
+                self.checkin(substrate)
+            except Exception as err:
+                self._logger.error(f'keepalive of {substrate.url} failed: {err}')
+                self.checkin(substrate, False)
@@ -1,5 +1,6 @@
 from peaq_network_ev_charging_message_format.python import p2p_message_format_pb2 as P2PMessage
 import json
+from src import wire_utils as WireUtils
 
 
 def decode_hex_event(event: dict) -> P2PMessage.Event:
@@ -12,28 +13,28 @@ def _create_get_balance():
     event = P2PMessage.Event()
     event.event_id = P2PMessage.EventType.GET_BALANCE
 
-    return event.SerializeToString().hex()
+    return WireUtils.encode_event(event)
 
 
 def _create_get_pk():
     event = P2PMessage.Event()
     event.event_id = P2PMessage.EventType.GET_PK
 
-    return event.SerializeToString().hex()
+    return WireUtils.encode_event(event)
 
 
 def _create_republish_did():
     event = P2PMessage.Event()
     event.event_id = P2PMessage.EventType.REPUBLISH_DID
 
-    return event.SerializeToString().hex()
+    return WireUtils.encode_event(event)
 
 
 def _create_reconnect():
     event = P2PMessage.Event()
     event.event_id = P2PMessage.EventType.RECONNECT
 
-    return event.SerializeToString().hex()
+    return WireUtils.encode_event(event)
 
 
 def _create_stop_user_charging(data):
@@ -43,7 +44,7 @@ def _create_stop_user_charging(data):
     stop_charge_data.success = data['data']
     event.stop_charge_data.CopyFrom(stop_charge_data)
 
-    return event.SerializeToString().hex()
+    return WireUtils.encode_event(event)
 
 
 def create_user_request(data: dict):
@@ -68,7 +69,7 @@ def create_log_data(log_data: dict):
     emit_show_info_data.data = json.dumps(log_data)
     event.emit_show_info_data.CopyFrom(emit_show_info_data)
 
-    return event.SerializeToString().hex().encode('ascii')
+    return WireUtils.encode_event(event)
 
 
 def create_event_data(event_data: dict):
@@ -79,7 +80,7 @@ def create_event_data(event_data: dict):
     emit_show_info_data.data = json.dumps(event_data)
     event.emit_show_info_data.CopyFrom(emit_show_info_data)
 
-    return event.SerializeToString().hex().encode('ascii')
+    return WireUtils.encode_event(event)
 
 
 def create_get_pk_ack(addr: str, success: bool, fail_msg: str):
@@ -91,7 +92,7 @@ def create_get_pk_ack(addr: str, success: bool, fail_msg: str):
     get_pk_ack_data.resp.message = fail_msg
     event.get_pk_ack_data.CopyFrom(get_pk_ack_data)
 
-    return event.SerializeToString().hex().encode('ascii')
+    return WireUtils.encode_event(event)
 
 
 def create_get_balance_ack(balance: str, success: bool, fail_msg: str):
@@ -103,7 +104,7 @@ def create_get_balance_ack(balance: str, success: bool, fail_msg: str):
     get_balance_ack_data.resp.message = fail_msg
     event.get_balance_ack_data.CopyFrom(get_balance_ack_data)
 
-    return event.SerializeToString().hex().encode('ascii')
+    return WireUtils.encode_event(event)
 
 
 def create_republish_did_ack(addr: str, success: bool, fail_msg: str):
@@ -115,7 +116,7 @@ def create_republish_did_ack(addr: str, success: bool, fail_msg: str):
     republish_ack_data.pk = addr
     event.republish_ack_data.CopyFrom(republish_ack_data)
 
-    return event.SerializeToString().hex().encode('ascii')
+    return WireUtils.encode_event(event)
 
 
 def create_reconnect_ack(ok_mesg: str, success: bool, fail_msg: str):
@@ -127,7 +128,7 @@ def create_reconnect_ack(ok_mesg: str, success: bool, fail_msg: str):
     reconnect_ack_data.message = ok_mesg
     event.reconnect_ack_data.CopyFrom(reconnect_ack_data)
 
-    return event.SerializeToString().hex().encode('ascii')
+    return WireUtils.encode_event(event)
 
 
 def convert_socket_type(event: P2PMessage.Event):
@@ -0,0 +1,34 @@
+from peaq_network_ev_charging_message_format.python import p2p_message_format_pb2 as P2PMessage
+
+# The P2P node and the sim-iface still expect hex strings on the Redis channels
+WIRE_HEX = 'hex'
+WIRE_BINARY = 'binary'
+WIRE_MODES = [WIRE_HEX, WIRE_BINARY]
+
+_wire_mode = WIRE_HEX
+
+
+def set_wire_mode(mode: str):
+    global _wire_mode
+    if mode not in WIRE_MODES:
+        raise IOError(f'wire mode {mode} is not one of {WIRE_MODES}')
+    _wire_mode = mode
+
+
+def get_wire_mode() -> str:
+    return _wire_mode
+
+
+def encode_event(event: P2PMessage.Event) -> bytes:
+    data = event.SerializeToString()
+    if _wire_mode == WIRE_HEX:
+        return data.hex().encode('ascii')
+    return data
+
+
+def decode_event(data: bytes) -> P2PMessage.Event:
+    if _wire_mode == WIRE_HEX:
+        data = bytes.fromhex(data.decode('ascii'))
+    event = P2PMessage.Event()
+    event.ParseFromString(data)
+    return event
@@ -0,0 +1,66 @@
+import sys
+import os
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import threading
+import unittest
+from unittest import mock
+from src.balance_cache import BalanceCache
+
+
+class TestBalanceCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = BalanceCache('ws://127.0.0.1:9944', mock.Mock(), mock.Mock())
+        self.cache._block_hash = mock.Mock(side_effect=lambda number: f'0x{number}')
+        self.cache._query = mock.Mock(return_value=10)
+
+    def test_no_head_no_cache(self):
+        self.assertEqual(self.cache.get('addr'), 10)
+        self.assertEqual(self.cache.get('addr'), 10)
+        self.assertEqual(self.cache._query.call_count, 2)
+        self.cache._query.assert_called_with('addr', None)
+
+    def test_cache_until_new_head(self):
+        self.cache.on_new_head({'header': {'number': 5}}, 0, 'sub')
+        self.cache.get('addr')
+        self.cache.get('addr')
+        self.cache._query.assert_called_once_with('addr', '0x5')
+
+        self.cache.on_new_head({'header': {'number': 6}}, 1, 'sub')
+        self.cache.get('addr')
+        self.cache._query.assert_called_with('addr', '0x6')
+        self.assertEqual(self.cache._query.call_count, 2)
+
+    def test_failure_not_cached(self):
+        self.cache.on_new_head({'header': {'number': 5}}, 0, 'sub')
+        self.cache._query.side_effect = [BrokenPipeError(), 7]
+        self.assertRaises(BrokenPipeError, self.cache.get, 'addr')
+        self.assertEqual(self.cache.get('addr'), 7)
+
+    def test_coalesce(self):
+        self.cache.on_new_head({'header': {'number': 5}}, 0, 'sub')
+        started, release = threading.Event(), threading.Event()
+
+        def slow_query(ss58_addr, block_hash):
+            started.set()
+            release.wait()
+            return 3
+        self.cache._query.side_effect = slow_query
+
+        results = []
+        first = threading.Thread(target=lambda: results.append(self.cache.get('addr')))
+        first.start()
+        started.wait()
+        second = threading.Thread(target=lambda: results.append(self.cache.get('addr')))
+        second.start()
+        release.set()
+        first.join()
+        second.join()
+
+        self.assertEqual(results, [3, 3])
+        self.cache._query.assert_called_once_with('addr', '0x5')
+
+
+if __name__ == '__main__':
+    unittest.main()
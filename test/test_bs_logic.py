@@ -8,6 +8,7 @@ from src.bs_logic import BusinessLogic
 from src.p2p_utils import _create_p2p_request_ack
 from src.p2p_utils import _convert_transaction_value, _create_service_deliver_req
 from src import user_utils as UserUtils
+from src import wire_utils as WireUtils
 from unittest import mock
 from peaq_network_ev_charging_message_format.python import p2p_message_format_pb2 as P2PMessage
 from substrateinterface import Keypair
@@ -24,6 +25,29 @@ class TestBSLogic(unittest.TestCase):
         p2p_event = UserUtils.decode_hex_event(p2p_info.SerializeToString().hex())
         self.assertEqual(p2p_info, p2p_event)
 
+    def test_wire_binary_round_trip(self):
+        p2p_info = P2PMessage.Event()
+        p2p_info.event_id = P2PMessage.EventType.GET_BALANCE
+
+        WireUtils.set_wire_mode(WireUtils.WIRE_BINARY)
+        try:
+            data = WireUtils.encode_event(p2p_info)
+            self.assertEqual(data, p2p_info.SerializeToString())
+            self.assertEqual(WireUtils.decode_event(data), p2p_info)
+        finally:
+            WireUtils.set_wire_mode(WireUtils.WIRE_HEX)
+
+    def test_wire_hex_compatible(self):
+        p2p_info = P2PMessage.Event()
+        p2p_info.event_id = P2PMessage.EventType.GET_PK
+
+        data = WireUtils.encode_event(p2p_info)
+        self.assertEqual(data, p2p_info.SerializeToString().hex().encode('ascii'))
+        self.assertEqual(UserUtils.decode_hex_event(data.decode('ascii')), p2p_info)
+
+    def test_wire_unknown_mode(self):
+        self.assertRaises(IOError, WireUtils.set_wire_mode, 'base64')
+
     @mock.patch('src.chain_utils.get_substrate_connection')
     def test_is_service_requested_event_true(self, mock_get_conn):
         mock_get_conn.return_value = None
@@ -17,6 +17,7 @@ class TestChainUtils(unittest.TestCase):
 
     def test_publish_did_succ(self):
         mock_substrate_obj = mock.Mock()
+        mock_substrate_obj.get_account_nonce.return_value = 0
         kp = Keypair.create_from_uri('//Bob//stash')
         ChainUtils.publish_did(mock_substrate_obj, None, kp, 'etc/did_doc.json')
 
@@ -27,9 +28,31 @@ class TestChainUtils(unittest.TestCase):
 
     def test_republish_did_succ(self):
         mock_substrate_obj = mock.Mock()
+        mock_substrate_obj.get_account_nonce.return_value = 0
         kp = Keypair.create_from_uri('//Bob//stash')
         ChainUtils.republish_did(mock_substrate_obj, None, kp, 'etc/did_doc.json')
 
+    def test_compose_batch_all_call(self):
+        mock_substrate_obj = mock.Mock()
+        calls = [mock.Mock(), mock.Mock()]
+
+        ChainUtils.compose_batch_all_call(mock_substrate_obj, calls)
+
+        mock_substrate_obj.compose_call.assert_called_once_with(
+            call_module='Utility',
+            call_function='batch_all',
+            call_params={'calls': [calls[0].value, calls[1].value]})
+
+    def test_calculate_multi_sig_cached(self):
+        signatories = [Keypair.create_from_uri('//Alice').ss58_address,
+                       Keypair.create_from_uri('//Bob').ss58_address]
+        addr = ChainUtils.calculate_multi_sig(signatories, 2)
+        hits = ChainUtils._calculate_multi_sig.cache_info().hits
+
+        self.assertEqual(ChainUtils.calculate_multi_sig(list(reversed(signatories)), 2), addr)
+        self.assertEqual(ChainUtils._calculate_multi_sig.cache_info().hits, hits + 1)
+        self.assertNotEqual(ChainUtils.calculate_multi_sig(signatories, 1), addr)
+
 
 if __name__ == '__main__':
     unittest.main()
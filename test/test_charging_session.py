@@ -0,0 +1,74 @@
+import sys
+import os
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import unittest
+from src.charging_session import ChargingSession, SessionRegistry, APPROVAL_SPENT, APPROVAL_REFUND
+
+
+class TestChargingSession(unittest.TestCase):
+    def test_check_refuse(self):
+        session = ChargingSession('consumer', 'multisig', 10, lambda info: False)
+        session.check()
+        self.assertTrue(session.is_idle())
+
+    def test_sessions_independent(self):
+        first = ChargingSession('first', 'multisig1', 10, lambda info: True)
+        second = ChargingSession('second', 'multisig2', 10, lambda info: True)
+        first.check()
+        first.start_charging()
+        self.assertTrue(first.is_charging())
+        self.assertTrue(second.is_idle())
+
+    def test_registry_resolve(self):
+        registry = SessionRegistry()
+        first = ChargingSession('first', 'multisig1', 10, lambda info: True)
+        registry.add(first)
+        self.assertEqual(registry.resolve(''), first)
+        self.assertEqual(registry.resolve('first'), first)
+
+        registry.add(ChargingSession('second', 'multisig2', 10, lambda info: True))
+        self.assertIsNone(registry.resolve(''))
+        self.assertIsNone(registry.resolve('third'))
+
+    def test_registry_duplicate(self):
+        registry = SessionRegistry()
+        registry.add(ChargingSession('first', 'multisig1', 10, lambda info: True))
+        self.assertRaises(KeyError, registry.add, ChargingSession('first', 'multisig1', 10, lambda info: True))
+
+    def test_registry_approval(self):
+        registry = SessionRegistry()
+        session = ChargingSession('first', 'multisig1', 10, lambda info: True)
+        registry.add(session)
+        registry.add_approval('first', APPROVAL_SPENT, '0x01')
+        registry.add_approval('first', APPROVAL_REFUND, '0x02')
+
+        self.assertEqual(registry.find_approval('first', '0x01'), (session, APPROVAL_SPENT))
+        self.assertEqual(registry.find_approval('first', '0x02'), (session, APPROVAL_REFUND))
+        self.assertEqual(registry.find_approval('second', '0x01'), (None, None))
+        self.assertEqual(session.charging_info['consumer_got_call_hash'], '0x02')
+
+        registry.remove('first')
+        self.assertEqual(registry.find_approval('first', '0x01'), (None, None))
+
+    def test_registry_approval_shared_hash(self):
+        # Both sessions spend the same amount, so their spent legs have the same call hash
+        registry = SessionRegistry()
+        first = ChargingSession('first', 'multisig1', 10, lambda info: True)
+        second = ChargingSession('second', 'multisig2', 10, lambda info: True)
+        registry.add(first)
+        registry.add(second)
+        registry.add_approval('first', APPROVAL_SPENT, '0x01')
+        registry.add_approval('second', APPROVAL_SPENT, '0x01')
+
+        self.assertEqual(registry.find_approval('first', '0x01'), (first, APPROVAL_SPENT))
+        self.assertEqual(registry.find_approval('second', '0x01'), (second, APPROVAL_SPENT))
+
+        registry.remove('second')
+        self.assertEqual(registry.find_approval('first', '0x01'), (first, APPROVAL_SPENT))
+        self.assertEqual(registry.find_approval('second', '0x01'), (None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import sys
+import os
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import unittest
+from unittest import mock
+from src.event_dispatcher import EventDispatcher
+
+
+class TestEventDispatcher(unittest.TestCase):
+    def setUp(self):
+        self.dispatcher = EventDispatcher()
+        self.dispatcher.register_sub_type(1, lambda event: event.sub_type)
+        self.on_chain = mock.Mock(__name__='on_chain')
+        self.on_executed = mock.Mock(__name__='on_executed')
+        self.dispatcher.register(1, self.on_chain)
+        self.dispatcher.register(1, self.on_executed, 'MultisigExecuted')
+
+    def test_dispatch_sub_type(self):
+        event = mock.Mock(event_id=1, sub_type='MultisigExecuted')
+        self.assertTrue(self.dispatcher.dispatch(event, 'key'))
+        self.on_executed.assert_called_once_with(event, 'key')
+        self.on_chain.assert_not_called()
+
+    def test_dispatch_fallback(self):
+        event = mock.Mock(event_id=1, sub_type='Transfer')
+        self.assertTrue(self.dispatcher.dispatch(event, 'key'))
+        self.on_chain.assert_called_once_with(event, 'key')
+        self.assertFalse(self.dispatcher.dispatch(mock.Mock(event_id=2), 'key'))
+
+    def test_stats(self):
+        self.on_chain.side_effect = IOError()
+        event = mock.Mock(event_id=1, sub_type='Transfer')
+        self.assertRaises(IOError, self.dispatcher.dispatch, event)
+        self.dispatcher.dispatch(mock.Mock(event_id=1, sub_type='MultisigExecuted'))
+
+        stats = self.dispatcher.stats()
+        self.assertEqual(stats['on_chain']['count'], 1)
+        self.assertEqual(stats['on_executed']['count'], 1)
+        self.assertGreaterEqual(stats['on_chain']['max'], stats['on_chain']['mean'])
+
+    def test_stats_names(self):
+        # Two lambdas share their __name__, their stats must not
+        self.dispatcher.register(2, lambda event, key: None, name='on_republish')
+        self.dispatcher.register(3, lambda event, key: None, name='on_reconnect')
+        self.dispatcher.dispatch(mock.Mock(event_id=2), 'key')
+        self.dispatcher.dispatch(mock.Mock(event_id=3), 'key')
+        self.dispatcher.dispatch(mock.Mock(event_id=3), 'key')
+
+        stats = self.dispatcher.stats()
+        self.assertEqual(stats['on_republish']['count'], 1)
+        self.assertEqual(stats['on_reconnect']['count'], 2)
+        self.assertNotIn('<lambda>', stats)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import sys
+import os
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import unittest
+from src.event_filter import EventFilter
+from substrateinterface import Keypair
+
+CALL_HASH = '0x' + '11' * 32
+
+
+class TestEventFilter(unittest.TestCase):
+    def setUp(self):
+        self.consumer = Keypair.create_from_uri('//Alice')
+        self.filter = EventFilter()
+
+    def executed_event(self, signer: str, call_hash: str) -> dict:
+        return {
+            'module_id': 'MultiSig',
+            'event_id': 'MultisigExecuted',
+            'attributes': [signer, {'height': 1, 'index': 1}, '0x' + '22' * 32, call_hash, {'Ok': ()}],
+        }
+
+    def test_watched_session(self):
+        self.filter.watch(self.consumer.ss58_address, addresses=[self.consumer.ss58_address])
+        event = self.executed_event('0x' + self.consumer.public_key.hex(), '0x' + '33' * 32)
+        self.assertTrue(self.filter.is_relevant(event))
+
+        self.filter.unwatch(self.consumer.ss58_address)
+        self.assertFalse(self.filter.is_relevant(event))
+
+    def test_watched_call_hash(self):
+        self.filter.watch(self.consumer.ss58_address, call_hashes=[CALL_HASH])
+        self.assertTrue(self.filter.is_relevant(self.executed_event('0x' + '44' * 32, CALL_HASH.upper())))
+
+    def test_unwatched_event(self):
+        self.filter.watch(self.consumer.ss58_address, addresses=[self.consumer.ss58_address])
+        self.assertFalse(self.filter.is_relevant({
+            'module_id': 'System',
+            'event_id': 'NewAccount',
+            'attributes': ['0x' + self.consumer.public_key.hex()],
+        }))
+
+
+if __name__ == '__main__':
+    unittest.main()
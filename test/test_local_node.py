@@ -0,0 +1,77 @@
+import sys
+import os
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import unittest
+from substrateinterface import Keypair
+from src import chain_utils as ChainUtils
+from src.local_node import LOCAL_ENDOWMENT
+
+KP_ALICE = Keypair.create_from_uri('//Alice')
+KP_BOB = Keypair.create_from_uri('//Bob')
+
+
+def submit(substrate, kp: Keypair, module: str, function: str, params: dict):
+    call = substrate.compose_call(call_module=module, call_function=function, call_params=params)
+    return ChainUtils.sign_and_submit(substrate, kp, call)
+
+
+class TestLocalNode(unittest.TestCase):
+    def setUp(self):
+        # A node per test
+        self.substrate = ChainUtils.get_substrate_connection(f'local://{self.id()}?block_time=0.01')
+
+    def test_transfer(self):
+        receipt = submit(self.substrate, KP_ALICE, 'Balances', 'transfer', {'dest': KP_BOB.ss58_address, 'value': 10})
+
+        self.assertTrue(receipt.is_success)
+        self.assertIn('Transfer', [_.value['event_id'] for _ in receipt.triggered_events])
+        self.assertEqual(ChainUtils.get_station_balance(self.substrate, None, KP_BOB.ss58_address), 10)
+        self.assertEqual(ChainUtils.get_station_balance(self.substrate, None, KP_ALICE.ss58_address),
+                         LOCAL_ENDOWMENT - 10)
+        self.assertEqual(self.substrate.get_account_nonce(KP_ALICE.ss58_address), 1)
+
+        receipt = submit(self.substrate, KP_BOB, 'Balances', 'transfer',
+                         {'dest': KP_ALICE.ss58_address, 'value': LOCAL_ENDOWMENT + 11})
+        self.assertFalse(receipt.is_success)
+        self.assertEqual(receipt.error_message['name'], 'InsufficientBalance')
+
+    def test_multisig(self):
+        multisig = ChainUtils.calculate_multi_sig([KP_ALICE.ss58_address, KP_BOB.ss58_address], 2)
+        submit(self.substrate, KP_ALICE, 'Balances', 'transfer', {'dest': multisig, 'value': 100})
+        payload, call = ChainUtils.compose_as_multi_call(
+            self.substrate, 30, KP_BOB.ss58_address, [KP_ALICE.ss58_address], 2)
+        receipt = ChainUtils.sign_and_submit(self.substrate, KP_BOB, call)
+        info = ChainUtils.compose_multisig_info(receipt, payload)
+
+        receipt = submit(self.substrate, KP_ALICE, 'MultiSig', 'approve_as_multi', {
+            'threshold': 2,
+            'other_signatories': [KP_BOB.ss58_address],
+            'maybe_timepoint': info['time_point'],
+            'call_hash': info['call_hash'],
+            'max_weight': 1000000000,
+        })
+        executed = [_.value for _ in receipt.triggered_events if _.value['event_id'] == 'MultisigExecuted']
+        self.assertEqual(executed[0]['attributes'][-2], info['call_hash'])
+        self.assertIn('Ok', executed[0]['attributes'][-1])
+        self.assertEqual(ChainUtils.get_station_balance(self.substrate, None, multisig), 70)
+
+    def test_did(self):
+        receipt = ChainUtils.read_did(self.substrate, None, KP_ALICE)
+        self.assertFalse(receipt.is_success)
+
+        submit(self.substrate, KP_ALICE, 'PeaqDid', 'add_attribute', {
+            'did_account': KP_ALICE.ss58_address,
+            'name': 'v2',
+            'value': '1234'.encode('ascii'),
+            'valid_for': 10,
+        })
+        receipt = ChainUtils.read_did(self.substrate, None, KP_ALICE)
+        self.assertTrue(receipt.is_success)
+        attributes = [_.value for _ in receipt.triggered_events if _.value['event_id'] == 'AttributeRead'][0]['attributes']
+        self.assertEqual((attributes['name'], attributes['value']), ('v2', '1234'))
+
+
+if __name__ == '__main__':
+    unittest.main()
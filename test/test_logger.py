@@ -4,10 +4,13 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(BASE_DIR)
 
 import time
+import gzip
 import unittest
 from unittest import mock
 
-from src.logger import TimeSizeRotatingFileHandler
+import queue
+from src.logger import TimeSizeRotatingFileHandler, DeferredQueueHandler, BatchQueueListener
+from logging.handlers import BufferingHandler
 import logging
 
 TEST_LOG_FOLDER = 'test/tmp'
@@ -87,6 +90,38 @@ class TestLog(unittest.TestCase):
                 logger.doRollover()
             self.assertEqual(len([_ for _ in os.listdir(TEST_LOG_FOLDER) if _.startswith(TEST_LOG_NAME)]), backup_count + 1)
 
+    def test_doRolloverCompress(self):
+        with TimeSizeRotatingFileHandler(TEST_LOG_PATH, storeFor=1, maxBytes=20, when='d', compress=True) as logger:
+            logger.setFormatter(logging.Formatter('%(message)s'))
+            logger.emit(logging.makeLogRecord({'msg': '1234567890'}))
+            logger.emit(logging.makeLogRecord({'msg': '1234567890'}))
+        rotated = [_ for _ in os.listdir(TEST_LOG_FOLDER) if _.startswith(f'{TEST_LOG_NAME}.')]
+        self.assertEqual(len(rotated), 1)
+        self.assertTrue(rotated[0].endswith('.001.gz'))
+        with gzip.open(os.path.join(TEST_LOG_FOLDER, rotated[0]), 'rt') as f:
+            self.assertEqual(f.read(), '1234567890\n')
+
+    def test_asynchronous(self):
+        log_queue = queue.SimpleQueue()
+        handler = BufferingHandler(100)
+        listener = BatchQueueListener(log_queue, handler)
+        logger = logging.getLogger('test-asynchronous')
+        logger.addHandler(DeferredQueueHandler(log_queue))
+        listener.start()
+
+        args = ['before']
+        logger.warning('value %s', args)
+        args[0] = 'after'
+        try:
+            raise IOError('failed')
+        except IOError:
+            logger.exception('with traceback')
+        listener.stop()
+
+        self.assertEqual([_.getMessage() for _ in handler.buffer], ["value ['before']", 'with traceback'])
+        self.assertIn('OSError: failed', handler.buffer[1].exc_text)
+        self.assertIsNone(handler.buffer[1].exc_info)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,68 @@
+import sys
+import os
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import gc
+import unittest
+import threading
+from src import metrics as Metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.registry = Metrics.Registry()
+
+    def test_counter_threads(self):
+        counter = Metrics.Counter('test_total', 'Test', ['kind'], registry=self.registry)
+
+        def run():
+            for _ in range(1000):
+                counter.inc('a')
+            counter.inc('b', amount=5)
+        threads = [threading.Thread(target=run) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        del threads
+        gc.collect()
+
+        counter.inc('a')
+        self.assertEqual(counter.value('a'), 8001)
+        self.assertEqual(counter.value('b'), 40)
+        # The ended threads are merged away
+        self.assertEqual(len(counter._shards._live), 1)
+        self.assertIn('peaq_simulator_test_total{kind="a"} 8001', self.registry.expose())
+
+    def test_histogram(self):
+        histogram = Metrics.Histogram('test_seconds', 'Test', ['method'], buckets=(0.1, 1), registry=self.registry)
+        for value in [0.05, 0.1, 0.5, 2]:
+            histogram.observe(value, 'rpc')
+
+        self.assertEqual(histogram.count('rpc'), 4)
+        self.assertEqual(self.registry.expose().splitlines(), [
+            '# HELP peaq_simulator_test_seconds Test',
+            '# TYPE peaq_simulator_test_seconds histogram',
+            'peaq_simulator_test_seconds_bucket{method="rpc",le="0.1"} 2',
+            'peaq_simulator_test_seconds_bucket{method="rpc",le="1"} 3',
+            'peaq_simulator_test_seconds_bucket{method="rpc",le="+Inf"} 4',
+            'peaq_simulator_test_seconds_sum{method="rpc"} 2.65',
+            'peaq_simulator_test_seconds_count{method="rpc"} 4',
+        ])
+
+    def test_gauge(self):
+        gauge = Metrics.Gauge('test_sessions', 'Test', ['state'], registry=self.registry)
+        self.assertNotIn('test_sessions{', self.registry.expose())
+
+        gauge.set_function(lambda: {'idle': 1, 'say "hi"': 2})
+        lines = self.registry.expose().splitlines()
+        self.assertIn('peaq_simulator_test_sessions{state="idle"} 1', lines)
+        self.assertIn('peaq_simulator_test_sessions{state="say \\"hi\\""} 2', lines)
+
+        Metrics.Gauge('test_clients', 'Test', registry=self.registry).set_function(lambda: 3)
+        self.assertIn('peaq_simulator_test_clients 3', self.registry.expose().splitlines())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import sys
+import os
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import unittest
+from unittest import mock
+from src.nonce_manager import NonceManager
+
+
+class TestNonceManager(unittest.TestCase):
+    def setUp(self):
+        self._substrate = mock.Mock()
+        self._substrate.url = 'ws://127.0.0.1:9944'
+        self._substrate.get_account_nonce.return_value = 7
+
+    def test_allocate_consecutive(self):
+        nonces = NonceManager()
+        self.assertEqual([nonces.allocate(self._substrate, 'alice') for _ in range(3)], [7, 8, 9])
+        self._substrate.get_account_nonce.assert_called_once_with('alice')
+        self.assertEqual(nonces.pending(self._substrate, 'alice'), [7, 8, 9])
+
+    def test_confirm_lower_nonces(self):
+        nonces = NonceManager()
+        for _ in range(3):
+            nonces.allocate(self._substrate, 'alice')
+        nonces.confirm(self._substrate, 'alice', 8)
+        self.assertEqual(nonces.pending(self._substrate, 'alice'), [9])
+
+    def test_resync(self):
+        nonces = NonceManager()
+        nonces.allocate(self._substrate, 'alice')
+        nonces.resync(self._substrate, 'alice')
+        self._substrate.get_account_nonce.return_value = 3
+        self.assertEqual(nonces.allocate(self._substrate, 'alice'), 3)
+        self.assertEqual(nonces.pending(self._substrate, 'alice'), [3])
+
+
+if __name__ == '__main__':
+    unittest.main()
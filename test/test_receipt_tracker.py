@@ -0,0 +1,56 @@
+import sys
+import os
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import unittest
+from unittest import mock
+from concurrent.futures import Future
+from src.receipt_tracker import ReceiptTracker, when_all
+from substrateinterface import Keypair
+
+
+class TestReceiptTracker(unittest.TestCase):
+    def test_when_all(self):
+        futures = [Future(), Future()]
+        done = []
+        when_all(futures, done.append)
+
+        futures[0].set_result(1)
+        self.assertEqual(done, [])
+        futures[1].set_result(2)
+        self.assertEqual(done, [futures])
+
+    @mock.patch('src.chain_utils.get_substrate_connection')
+    def test_resolve_included(self, mock_get_conn):
+        substrate = mock_get_conn.return_value
+        substrate.get_account_nonce.return_value = 0
+        substrate.get_block_number.return_value = 10
+        substrate.submit_extrinsic.return_value.extrinsic_hash = '0x1234'
+        extrinsic = mock.Mock()
+        extrinsic.extrinsic_hash = bytes.fromhex('1234')
+        substrate.get_block.return_value = {'extrinsics': [extrinsic]}
+
+        tracker = ReceiptTracker('ws://127.0.0.1:9944', mock.Mock())
+        future = tracker.submit(Keypair.create_from_uri('//Alice'), mock.Mock())
+        tracker._submit(*tracker._queue.get_nowait())
+        self.assertFalse(future.done())
+
+        substrate.get_block_number.return_value = 11
+        tracker._poll_blocks()
+        self.assertEqual(future.result().extrinsic_hash, '0x1234')
+
+    @mock.patch('src.chain_utils.get_substrate_connection')
+    def test_submit_fail(self, mock_get_conn):
+        substrate = mock_get_conn.return_value
+        substrate.get_account_nonce.return_value = 0
+        substrate.submit_extrinsic.side_effect = BrokenPipeError()
+
+        tracker = ReceiptTracker('ws://127.0.0.1:9944', mock.Mock())
+        future = tracker.submit(Keypair.create_from_uri('//Alice'), mock.Mock())
+        tracker._submit(*tracker._queue.get_nowait())
+        self.assertIsInstance(future.exception(), BrokenPipeError)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import sys
+import os
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import socket
+import unittest
+from unittest import mock
+from src import redis_transport as RedisTransport
+from src.constants import REDIS_IN, REDIS_OUT
+
+
+class TestRedisTransport(unittest.TestCase):
+    def test_unknown_transport(self):
+        self.assertRaises(IOError, RedisTransport.init_transport, mock.Mock(), 'kafka', 1, 1)
+
+    def test_pubsub_publish_session_in(self):
+        r = mock.Mock()
+        RedisTransport.init_transport(r, 'pubsub', 1, 1).publish(REDIS_IN, b'data', 'alice')
+        r.publish.assert_called_once_with('IN:alice', b'data')
+
+    def test_pubsub_publish_session_out(self):
+        r = mock.Mock()
+        RedisTransport.init_transport(r, 'pubsub', 1, 1).publish(REDIS_OUT, b'data', 'alice')
+        r.publish.assert_has_calls([mock.call('OUT:alice', b'data'), mock.call('OUT', b'data')])
+
+    def test_pubsub_read_batch(self):
+        r = mock.Mock()
+        r.pubsub.return_value.get_message.side_effect = [
+            {'channel': b'IN', 'data': b'1'},
+            {'channel': b'IN:alice', 'data': b'2'},
+            None,
+        ]
+        subscriber = RedisTransport.init_transport(r, 'pubsub', 8, 1).subscribe(
+            REDIS_IN, RedisTransport.SCOPE_ALL, 'group')
+        messages = subscriber.read()
+        self.assertEqual([(_.session_key, _.data) for _ in messages], [('', b'1'), ('alice', b'2')])
+
+    def test_pubsub_read_out_drops_copies(self):
+        r = mock.Mock()
+        r.pubsub.return_value.get_message.side_effect = [
+            {'channel': b'OUT:alice', 'data': b'1'},
+            {'channel': b'OUT', 'data': b'2'},
+            {'channel': b'OUT', 'data': b'1'},
+            None,
+        ]
+        subscriber = RedisTransport.init_transport(r, 'pubsub', 8, 1).subscribe(
+            REDIS_OUT, RedisTransport.SCOPE_ALL, 'group')
+        messages = subscriber.read()
+        self.assertEqual([(_.session_key, _.data) for _ in messages], [('alice', b'1'), ('', b'2')])
+
+    def test_streams_publish(self):
+        r = mock.Mock()
+        RedisTransport.init_transport(r, 'streams', 1, 100).publish(REDIS_OUT, b'data', 'alice')
+        r.xadd.assert_called_once_with(REDIS_OUT, {'data': b'data', 'session': 'alice'},
+                                       maxlen=100, approximate=True)
+
+    def test_streams_replay_pending(self):
+        r = mock.Mock()
+        r.xpending_range.side_effect = [
+            [{'message_id': b'1-0', 'times_delivered': 1},
+             {'message_id': b'2-0', 'times_delivered': RedisTransport.STREAM_MAX_DELIVERIES + 1}],
+            [],
+        ]
+        r.xclaim.return_value = [(b'1-0', {b'data': b'1', b'session': b'alice'})]
+        r.xreadgroup.return_value = [[b'OUT', [(b'3-0', {b'data': b'3', b'session': b''})]]]
+        subscriber = RedisTransport.init_transport(r, 'streams', 8, 1).subscribe(
+            REDIS_OUT, RedisTransport.SCOPE_SESSION, 'group')
+
+        messages = subscriber.read()
+        self.assertEqual([_.id for _ in messages], [b'1-0'])
+        r.xack.assert_called_once_with(REDIS_OUT, 'group', b'2-0')
+        # Given by position, redis-py would take them for idle, min and max
+        r.xpending_range.assert_called_with(REDIS_OUT, 'group', min='-', max='+', count=8,
+                                            consumername=socket.gethostname())
+
+        # Out of scope entries are acknowledged right away
+        self.assertEqual(subscriber.read(), [])
+        r.xack.assert_called_with(REDIS_OUT, 'group', b'3-0')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import sys
+import os
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import unittest
+from unittest import mock
+from src import scheduler as SchedulerUtils
+from src.scheduler import Scheduler
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = Scheduler(mock.Mock())
+
+    def test_due_in_order(self):
+        fired = []
+        self.scheduler.call_later(0.02, lambda: fired.append('late'))
+        self.scheduler.call_later(0, lambda: fired.append('early'))
+
+        for timer in self.scheduler.pop_due(1):
+            self.scheduler.fire(timer)
+        self.assertEqual(fired, ['early'])
+        for timer in self.scheduler.pop_due(1):
+            self.scheduler.fire(timer)
+        self.assertEqual(fired, ['early', 'late'])
+
+    def test_cancel(self):
+        timer = self.scheduler.call_later(0, mock.Mock())
+        timer.cancel()
+        self.assertEqual(self.scheduler.pop_due(0.01), [])
+        self.assertEqual(len(self.scheduler), 0)
+
+    def test_periodic(self):
+        callback = mock.Mock()
+        timer = self.scheduler.call_every(0.01, callback)
+        for _ in range(3):
+            for due in self.scheduler.pop_due(1):
+                self.scheduler.fire(due)
+        self.assertEqual(callback.call_count, 3)
+        self.assertEqual(len(self.scheduler), 1)
+
+        timer.cancel()
+        self.assertEqual(len(self.scheduler), 0)
+
+    def test_failing_callback(self):
+        callback = mock.Mock(side_effect=IOError())
+        self.scheduler.call_every(0.01, callback)
+        for due in self.scheduler.pop_due(1):
+            self.scheduler.fire(due)
+        self.assertEqual(len(self.scheduler), 1)
+
+    def test_compact_cancelled(self):
+        timers = [self.scheduler.call_later(300, mock.Mock()) for _ in range(SchedulerUtils.COMPACT_MIN_SIZE)]
+        for timer in timers[:len(timers) // 2 + 1]:
+            timer.cancel()
+        self.assertEqual(len(self.scheduler._heap), len(timers) // 2 - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import sys
+import os
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import unittest
+from unittest import mock
+from src.substrate_pool import SubstratePool
+
+
+class TestSubstratePool(unittest.TestCase):
+    def setUp(self):
+        self.connect = mock.Mock(side_effect=lambda: mock.Mock())
+        self.pool = SubstratePool(self.connect, 2, 30)
+        self.pool._start_keepalive = mock.Mock()
+
+    def test_reuse_connection(self):
+        with self.pool.connection() as first:
+            pass
+        with self.pool.connection() as second:
+            self.assertIs(first, second)
+        self.assertEqual(self.connect.call_count, 1)
+        self.assertEqual(len(self.pool), 1)
+
+    def test_reconnect_in_place(self):
+        with self.assertRaises(BrokenPipeError):
+            with self.pool.connection() as first:
+                raise BrokenPipeError()
+
+        with self.pool.connection() as second:
+            self.assertIs(first, second)
+        first.connect_websocket.assert_called_once_with()
+        self.assertEqual(self.connect.call_count, 1)
+
+    def test_replace_dead_connection(self):
+        with self.assertRaises(BrokenPipeError):
+            with self.pool.connection() as first:
+                first.connect_websocket.side_effect = ConnectionRefusedError()
+                raise BrokenPipeError()
+
+        with self.pool.connection() as second:
+            self.assertIsNot(first, second)
+        self.assertEqual(len(self.pool), 1)
+
+    def test_keepalive_ping(self):
+        with self.pool.connection() as first:
+            first.rpc_request.side_effect = BrokenPipeError()
+        self.pool._idle[0][1] -= 60
+
+        self.pool.ping_idle()
+        first.rpc_request.assert_called_once_with('system_health', [])
+        self.assertFalse(self.pool._idle[0][2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,272 @@
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import platform
+import resource
+import datetime
+import threading
+import subprocess
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+from substrateinterface import Keypair
+import src.wire_utils as WireUtils
+import src.redis_transport as RedisTransport
+
+from src import app
+from src import chain_utils as ChainUtils
+from src import charging_status_monitor
+from src.bs_logic import run_business_logic
+from src.substrate_monitor import run_substrate_monitor
+from src.event_filter import EventFilter
+from src.constants import REDIS_IN, SETTLEMENT_PIPELINE, SETTLEMENT_BATCH, VERBOSITY_DEBUG
+
+from load_generator import LoadGenerator, derive_consumers
+
+# name -> concurrent sessions, chain events sent at once, whether it only waits
+SCENARIOS = {
+    'idle': {'sessions': 0, 'storm': 0, 'idle': True},
+    'sessions-1': {'sessions': 1, 'storm': 0, 'idle': False},
+    'sessions-10': {'sessions': 10, 'storm': 0, 'idle': False},
+    'sessions-100': {'sessions': 100, 'storm': 0, 'idle': False},
+    'storm': {'sessions': 0, 'storm': 10000, 'idle': False},
+}
+SAMPLE_PERIOD = 0.5
+
+
+def parse_arguement():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenarios', help='scenarios to run, in this order',
+                        type=str, nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--block_time', help='seconds between the blocks of the local node',
+                        type=float, default=0.5)
+    parser.add_argument('--charging_time', help='seconds a session charges before its stop',
+                        type=float, default=2)
+    parser.add_argument('--idle_time', help='seconds the idle scenario lasts',
+                        type=float, default=10)
+    parser.add_argument('--storm_events', help='chain events the storm scenario sends',
+                        type=int, default=SCENARIOS['storm']['storm'])
+    parser.add_argument('--timeout', help='seconds to wait for one reply of the BE',
+                        type=float, default=120)
+    parser.add_argument('--settlement', help='submit the spent and refund as back-to-back extrinsics or as one batch_all',
+                        type=str, choices=[SETTLEMENT_PIPELINE, SETTLEMENT_BATCH], default=SETTLEMENT_PIPELINE)
+    parser.add_argument('--rconfig', help='redis config yaml file',
+                        type=str, default='etc/redis.yaml')
+    parser.add_argument('--output', help='json file of the results',
+                        type=str, default='benchmark.json')
+    return parser.parse_args()
+
+
+def read_rss() -> int:
+    '''
+    Resident bytes of this process, the peak if /proc is not there
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ResourceSampler():
+    '''
+    CPU time and RSS of the process over one scenario
+    '''
+    def __init__(self):
+        self._rss = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+
+    def __enter__(self):
+        self._wall = time.monotonic()
+        self._cpu = time.process_time()
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        self._thread.join()
+        self._wall = time.monotonic() - self._wall
+        self._cpu = time.process_time() - self._cpu
+
+    def run(self):
+        self._rss.append(read_rss())
+        while not self._stop.wait(SAMPLE_PERIOD):
+            self._rss.append(read_rss())
+
+    def report(self) -> dict:
+        return {
+            'cpu_seconds': self._cpu,
+            'cpu_percent': 100 * self._cpu / self._wall if self._wall else 0.0,
+            'rss_mean_mb': sum(self._rss) / len(self._rss) / 2 ** 20,
+            'rss_peak_mb': max(self._rss) / 2 ** 20,
+        }
+
+
+class SocketCounter():
+    '''
+    A Socket.IO client of the gateway in the provider room, counting what it receives
+    '''
+    def __init__(self, be, socketio):
+        self._client = socketio.test_client(be)
+        self._lock = threading.Lock()
+        self._count = 0
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def run(self):
+        while True:
+            received = len(self._client.get_received())
+            with self._lock:
+                self._count += received
+            time.sleep(0.01)
+
+    def count(self) -> int:
+        with self._lock:
+            return self._count
+
+    def wait_for(self, count: int, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while self.count() < count:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+
+class Benchmark():
+    '''
+    The whole BE in this process, on a local node: Redis IN, the business logic and the
+    chain calls, Redis OUT, the gateway and a Socket.IO client
+    '''
+    def __init__(self, r: RedisTransport.RedisTransport, args):
+        self._r = r
+        self._args = args
+        self._node_ws = f'local://benchmark?block_time={args.block_time}'
+        self._kp_provider = Keypair.create_from_uri('//Bob//stash')
+        self._logger = logging.getLogger('benchmark')
+        config = {
+            'node_ws': self._node_ws,
+            'charging_time': 3600,
+            'kp_provider': self._kp_provider,
+            'did_path': os.path.join(BASE_DIR, 'etc/did_doc.json'),
+            'settlement': args.settlement,
+            # The storm is counted from the logs of the chain events
+            'verbosity': VERBOSITY_DEBUG,
+            'event_filter': EventFilter(),
+        }
+
+        be, socketio = app.create_app('secret', False, self._node_ws, self._kp_provider, r, self._logger, 'threading')
+        self._counter = SocketCounter(be, socketio)
+        for target, target_args in [
+                (run_substrate_monitor, (self._node_ws, r, config['event_filter'])),
+                (run_business_logic, (r, self._logger, config)),
+                (app.redis_reader, (socketio, r)),
+                (charging_status_monitor.run, (r, self._logger))]:
+            threading.Thread(target=target, args=target_args, daemon=True).start()
+
+    def run_sessions(self, name: str, sessions: int) -> dict:
+        '''
+        The consumers get a connection each, apart from the pool of the BE, so the
+        BE's chain calls do not queue behind the load they are measured under
+        '''
+        args = argparse.Namespace(
+            users=sessions, profile='constant', rate=sessions * 1000, ramp=0, seed=0, deposit_token=10,
+            charging_time=self._args.charging_time, timeout=self._args.timeout)
+        generator = LoadGenerator(self._r, self._node_ws, self._kp_provider, args, f'benchmark-{name}')
+        return generator.run(derive_consumers(f'//benchmark//{name}', sessions))
+
+    def run_storm(self, events: int) -> dict:
+        '''
+        Chain events of no session, each one comes out as one log at the client
+        '''
+        expected = self._counter.count() + events
+        start = time.monotonic()
+        for i in range(events):
+            self._r.publish(REDIS_IN, ChainUtils.create_chain_event_data({
+                'event_id': 'Transfer',
+                'attributes': [f'0x{i:064x}', f'0x{i + 1:064x}', i],
+            }))
+        published = time.monotonic() - start
+        delivered = self._counter.wait_for(expected, self._args.timeout)
+        return {'events': events, 'publish_seconds': published, 'delivered': delivered}
+
+    def run(self, name: str) -> dict:
+        scenario = SCENARIOS[name]
+        received = self._counter.count()
+        result = {'scenario': name}
+        with ResourceSampler() as sampler:
+            start = time.monotonic()
+            if scenario['idle']:
+                time.sleep(self._args.idle_time)
+            if scenario['sessions']:
+                result['sessions'] = self.run_sessions(name, scenario['sessions'])
+            if scenario['storm']:
+                result['storm'] = self.run_storm(self._args.storm_events)
+            elapsed = time.monotonic() - start
+        messages = self._counter.count() - received
+        result.update({
+            'elapsed': elapsed,
+            'socket_messages': messages,
+            'events_per_second': messages / elapsed if elapsed else 0.0,
+        })
+        result.update(sampler.report())
+        return result
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=BASE_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def show_result(result: dict):
+    logging.info(f'{result["scenario"]:>14}: {result["elapsed"]:8.2f}s {result["events_per_second"]:10.1f} events/s '
+                 f'cpu {result["cpu_percent"]:6.1f}% rss {result["rss_peak_mb"]:8.1f}MB')
+    if 'sessions' in result:
+        session = result['sessions']['stages']['session']
+        logging.info(f'{"":>14}  {result["sessions"]["completed"]} sessions, {result["sessions"]["failed"]} failed, '
+                     f'p50 {session["p50"]:.3f}s p95 {session["p95"]:.3f}s p99 {session["p99"]:.3f}s')
+
+
+if __name__ == '__main__':
+    args = parse_arguement()
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(filename)s:%(lineno)d - %(levelname)s : %(message)s')
+    # The BE logs every message, that would be measured too
+    logging.getLogger('benchmark').setLevel(logging.WARNING)
+    for name in ['logger', 'socketio', 'engineio']:
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    params = ChainUtils.parse_redis_config(args.rconfig)
+    r = RedisTransport.init_transport(ChainUtils.init_redis(params[0], params[1], params[2]),
+                                      params[4], params[5], params[6])
+    WireUtils.set_wire_mode(params[3])
+
+    benchmark = Benchmark(r, args)
+    results = []
+    for name in args.scenarios:
+        results.append(benchmark.run(name))
+        show_result(results[-1])
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'meta': {
+                'time': datetime.datetime.now().isoformat(),
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'cpus': os.cpu_count(),
+                'transport': params[4],
+                'wire': params[3],
+                'block_time': args.block_time,
+                'charging_time': args.charging_time,
+                'settlement': args.settlement,
+            },
+            'scenarios': results,
+        }, f, indent=2)
@@ -0,0 +1,195 @@
+import sys
+import os
+import gc
+import json
+import time
+import argparse
+import logging
+import tracemalloc
+import statistics
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+from substrateinterface import Keypair
+from google.protobuf.json_format import MessageToJson, MessageToDict
+import src.user_utils as UserUtils
+import src.p2p_utils as P2PUtils
+import src.wire_utils as WireUtils
+import src.chain_utils as ChainUtils
+
+KP_CONSUMER = Keypair.create_from_uri('//Alice')
+KP_PROVIDER = Keypair.create_from_uri('//Bob//stash')
+DELIVERY_INFO = {
+    'token_num': 1234500000,
+    'tx_hash': f'0x{"ab" * 32}',
+    'time_point': {'height': 123456, 'index': 2},
+    'call_hash': f'0x{"cd" * 32}',
+}
+CHARGING_STATUS = {
+    'progress': 0.42,
+    'charging_period': '0:00:42',
+    'energy_consumption': 1.234,
+    'spent_token': 4200000,
+}
+
+
+def parse_arguement():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cases', help='run only the cases containing one of these names',
+                        type=str, nargs='*', default=[])
+    parser.add_argument('--wire', help='wire mode of the encoded events',
+                        type=str, choices=WireUtils.WIRE_MODES, default=WireUtils.WIRE_HEX)
+    parser.add_argument('--min_time', help='seconds one measurement runs at least',
+                        type=float, default=0.2)
+    parser.add_argument('--repeat', help='measurements per case, the median is reported',
+                        type=int, default=5)
+    parser.add_argument('--baseline', help='json results to compare with',
+                        type=str, default='')
+    parser.add_argument('--threshold', help='slowdown against the baseline that counts as a regression',
+                        type=float, default=0.1)
+    parser.add_argument('--output', help='write the results as json to this file, e.g. as the next baseline',
+                        type=str, default='')
+    return parser.parse_args()
+
+
+def create_cases() -> dict:
+    '''
+    name -> function of no arguments, with the inputs the BE sees for every message
+    '''
+    charging_status = P2PUtils._create_client_charging_status(
+        CHARGING_STATUS['progress'], CHARGING_STATUS['charging_period'],
+        CHARGING_STATUS['energy_consumption'], CHARGING_STATUS['spent_token'])
+    log_event = WireUtils.decode_event(UserUtils.create_log_data({
+        'state': 'charging', 'data': f'Charging status: {CHARGING_STATUS}'}))
+    delivered = P2PUtils._create_service_deliver_req(KP_PROVIDER, KP_CONSUMER.ss58_address, DELIVERY_INFO, DELIVERY_INFO)
+    chain_event = {
+        'event_id': 'MultisigExecuted',
+        'attributes': [f'0x{KP_CONSUMER.public_key.hex()}', {'height': 123456, 'index': 2},
+                       f'0x{"ef" * 32}', DELIVERY_INFO['call_hash'], {'Ok': None}],
+    }
+    signatories = [KP_CONSUMER.ss58_address, KP_PROVIDER.ss58_address]
+    hex_event = delivered.SerializeToString().hex()
+
+    return {
+        'user_utils.create_log_data': lambda: UserUtils.create_log_data({
+            'state': 'charging', 'data': f'Charging status: {CHARGING_STATUS}'}),
+        'user_utils.create_event_data': lambda: UserUtils.create_event_data(dict(
+            {'event': 'ChargingStatus', 'state': 'charging'}, **CHARGING_STATUS)),
+        'user_utils.create_user_request': lambda: UserUtils.create_user_request({'type': 'UserChargingStop', 'data': True}),
+        'user_utils.decode_hex_event': lambda: UserUtils.decode_hex_event(hex_event),
+        'user_utils.convert_socket_type': lambda: UserUtils.convert_socket_type(log_event),
+        'p2p_utils.create_client_charging_status': lambda: P2PUtils._create_client_charging_status(
+            CHARGING_STATUS['progress'], CHARGING_STATUS['charging_period'],
+            CHARGING_STATUS['energy_consumption'], CHARGING_STATUS['spent_token']),
+        'p2p_utils.create_service_deliver': lambda: WireUtils.encode_event(P2PUtils._create_service_deliver_req(
+            KP_PROVIDER, KP_CONSUMER.ss58_address, DELIVERY_INFO, DELIVERY_INFO)),
+        'wire_utils.encode_event': lambda: WireUtils.encode_event(delivered),
+        'wire_utils.decode_event': lambda: WireUtils.decode_event(charging_status),
+        'app.message_to_json': lambda: MessageToJson(log_event),
+        'app.message_to_dict': lambda: MessageToDict(log_event),
+        'chain_utils.create_chain_event_data': lambda: ChainUtils.create_chain_event_data(chain_event),
+        'chain_utils.calculate_multi_sig': lambda: ChainUtils.calculate_multi_sig(signatories, 2),
+        'chain_utils.calculate_multi_sig_uncached': lambda: ChainUtils._calculate_multi_sig.__wrapped__(
+            tuple(sorted(signatories)), 2),
+    }
+
+
+def measure_time(func, min_time: float, repeat: int) -> float:
+    '''
+    Median nanoseconds per call, over repeat runs of at least min_time seconds each
+    '''
+    number = 1
+    while True:
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            func()
+        if time.perf_counter_ns() - start >= min_time * 1e9:
+            break
+        number *= 2
+
+    results = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter_ns()
+            for _ in range(number):
+                func()
+            results.append((time.perf_counter_ns() - start) / number)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return statistics.median(results)
+
+
+def measure_memory(func, number: int = 100) -> dict:
+    '''
+    CPython does not count its allocations, so this takes what it can see: the peak
+    bytes tracemalloc traces during one call, and the blocks one call leaves allocated
+    '''
+    func()
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+
+    blocks = sys.getallocatedblocks()
+    results = [func() for _ in range(number)]
+    retained = (sys.getallocatedblocks() - blocks) / number
+    del results
+    return {'peak_bytes': peak, 'retained_blocks': retained}
+
+
+def run(cases: dict, min_time: float, repeat: int) -> dict:
+    results = {}
+    for name, func in cases.items():
+        results[name] = {'ns_per_op': measure_time(func, min_time, repeat)}
+        results[name].update(measure_memory(func))
+        logging.info(f'{name:<45} {results[name]["ns_per_op"]:12.0f} ns/op {results[name]["peak_bytes"]:8d} B '
+                     f'{results[name]["retained_blocks"]:6.1f} blocks')
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> [str]:
+    '''
+    The cases slower than the baseline by more than the threshold
+    '''
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['ns_per_op'] / baseline[name]['ns_per_op']
+        logging.info(f'{name:<45} {baseline[name]["ns_per_op"]:12.0f} -> {result["ns_per_op"]:12.0f} ns/op '
+                     f'{(ratio - 1) * 100:+7.1f}%')
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == '__main__':
+    args = parse_arguement()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    WireUtils.set_wire_mode(args.wire)
+
+    cases = create_cases()
+    if args.cases:
+        cases = {name: func for name, func in cases.items() if any([_ in name for _ in args.cases])}
+    results = run(cases, args.min_time, args.repeat)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'wire': args.wire, 'python': sys.version.split()[0], 'results': results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['wire'] != args.wire:
+            raise IOError(f'the baseline is measured in wire mode {baseline["wire"]}, not {args.wire}')
+        regressions = compare(results, baseline['results'], args.threshold)
+        if regressions:
+            logging.error(f'slower than the baseline by more than {args.threshold * 100:.0f}%: {regressions}')
+            sys.exit(1)
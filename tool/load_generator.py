@@ -0,0 +1,280 @@
+import time
+import json
+import queue
+import random
+import argparse
+import logging
+import threading
+
+import sys
+import os
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+from substrateinterface import Keypair
+import src.p2p_utils as P2PUtils
+import src.wire_utils as WireUtils
+import src.redis_transport as RedisTransport
+import src.substrate_pool as SubstratePool
+
+from src.chain_utils import get_substrate_connection, parse_redis_config, init_redis, SUBSTRATE_KEEPALIVE_PERIOD
+from src.constants import REDIS_OUT
+from src import config_utils as ConfigUtils
+
+import utils as ToolUtils
+
+from peaq_network_ev_charging_message_format.python import p2p_message_format_pb2 as P2PMessage
+
+PROFILE_CONSTANT = 'constant'
+PROFILE_LINEAR = 'linear'
+PROFILE_POISSON = 'poisson'
+
+STAGES = ['deposit', 'service_request', 'stop', 'settlement', 'approve', 'session']
+PERCENTILES = [50, 95, 99]
+
+
+def parse_arguement():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', help='number of consumers, each runs one charging session',
+                        type=int, default=10)
+    parser.add_argument('--rate', help='sessions started per second once the ramp is over',
+                        type=float, default=1)
+    parser.add_argument('--profile', help='arrivals at a constant rate, ramping up linearly to the rate, or as a poisson process',
+                        type=str, choices=[PROFILE_CONSTANT, PROFILE_LINEAR, PROFILE_POISSON], default=PROFILE_CONSTANT)
+    parser.add_argument('--ramp', help='seconds the linear profile takes to reach the rate',
+                        type=float, default=30)
+    parser.add_argument('--charging_time', help='seconds a consumer charges before it sends the stop',
+                        type=float, default=10)
+    parser.add_argument('--timeout', help='seconds to wait for one reply of the BE',
+                        type=float, default=120)
+    parser.add_argument('--deposit_token', help='deposit token amount',
+                        type=int, default=10)
+    parser.add_argument('--fund', help='fund every consumer from the SUDO account before the run',
+                        type=int, default=0)
+    parser.add_argument('--seed', help='seed of the poisson arrivals',
+                        type=int, default=0)
+    parser.add_argument('--node_ws', help="peaq node's url",
+                        type=str, default='ws://127.0.0.1:9944')
+    parser.add_argument('--rconfig', help='redis config yaml file',
+                        type=str, default='etc/redis.yaml')
+    parser.add_argument('--output', help='also write the report as json to this file',
+                        type=str, default='')
+    return parser.parse_args()
+
+
+def derive_consumers(base_uri: str, users: int) -> [Keypair]:
+    '''
+    One consumer per user, hard derived from the CONSUMER account
+    '''
+    return [Keypair.create_from_uri(f'{base_uri}//load//{i}') for i in range(users)]
+
+
+def arrival_times(profile: str, users: int, rate: float, ramp: float, seed: int) -> [float]:
+    '''
+    Seconds from the start of the run at which every user starts its session
+    '''
+    times = []
+    now = 0.0
+    rng = random.Random(seed)
+    for i in range(users):
+        times.append(now)
+        if profile == PROFILE_POISSON:
+            now += rng.expovariate(rate)
+        elif profile == PROFILE_LINEAR and now < ramp:
+            # The rate grows from a tenth of it to all of it over the ramp
+            now += 1 / (rate * max(now / ramp, 0.1))
+        else:
+            now += 1 / rate
+    return times
+
+
+def percentile(values: [float], p: float) -> float:
+    '''
+    Nearest rank percentile
+    '''
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = max(int(-(-p * len(values) // 100)), 1)
+    return values[rank - 1]
+
+
+def summarize(latencies: dict, completed: int, failed: int, elapsed: float) -> dict:
+    return {
+        'completed': completed,
+        'failed': failed,
+        'elapsed': elapsed,
+        'sessions_per_hour': completed * 3600 / elapsed if elapsed else 0.0,
+        'stages': {stage: dict([('count', len(latencies[stage]))] + [
+            (f'p{p}', percentile(latencies[stage], p)) for p in PERCENTILES]) for stage in STAGES},
+    }
+
+
+class OutReader():
+    '''
+    Reads the session messages of the BE, and hands every one to the user of its session
+    '''
+    def __init__(self, r: RedisTransport.RedisTransport, group: str):
+        self._r = r
+        self._group = group
+        self._lock = threading.Lock()
+        self._inboxes = {}
+
+    def inbox(self, session_key: str) -> queue.Queue:
+        with self._lock:
+            return self._inboxes.setdefault(session_key, queue.Queue())
+
+    def run(self):
+        subcriber = self._r.subscribe(REDIS_OUT, RedisTransport.SCOPE_SESSION, self._group)
+
+        while True:
+            for message in subcriber.read():
+                self.inbox(message.session_key).put(WireUtils.decode_event(message.data))
+                subcriber.ack(message)
+
+    def wait_for(self, session_key: str, event_id, timeout: float) -> P2PMessage.Event:
+        inbox = self.inbox(session_key)
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise IOError(f'{session_key} did not receive {P2PMessage.EventType.Name(event_id)} in {timeout}s')
+            try:
+                event = inbox.get(timeout=remaining)
+            except queue.Empty:
+                continue
+            if event.event_id == event_id:
+                return event
+
+
+def delivered_info(info) -> dict:
+    return {
+        'token_num': int(info.token_num),
+        'timepoint': {
+            'height': info.time_point.height,
+            'index': info.time_point.index,
+        },
+        'call_hash': info.call_hash
+    }
+
+
+class LoadGenerator():
+    def __init__(self, r: RedisTransport.RedisTransport, ws_url: str, kp_provider: Keypair, args,
+                 group: str = 'load-generator'):
+        self._r = r
+        # A connection per user, held through its inclusion waits. The process wide pool
+        # would cap the users on chain at its size, and in the benchmark starve the BE
+        self._pool = SubstratePool.SubstratePool(
+            lambda: get_substrate_connection(ws_url), max(args.users, 1), SUBSTRATE_KEEPALIVE_PERIOD)
+        self._kp_provider = kp_provider
+        self._args = args
+        self._reader = OutReader(r, group)
+        self._lock = threading.Lock()
+        self._latencies = {stage: [] for stage in STAGES}
+        self._completed = 0
+        self._failed = 0
+        self._logger = logging.getLogger('logger')
+
+    def record(self, stage: str, start: float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            self._latencies[stage].append(now - start)
+        return now
+
+    def fund(self, consumers: [Keypair]):
+        kp_sudo = ConfigUtils.get_account_from_env('SUDO')
+        with self._pool.connection() as substrate:
+            for kp_consumer in consumers:
+                ToolUtils.fund(substrate, self._logger, kp_consumer, kp_sudo, self._args.fund)
+
+    def run_session(self, kp_consumer: Keypair):
+        args = self._args
+        consumer = kp_consumer.ss58_address
+        token_num = args.deposit_token * ToolUtils.TOKEN_NUM_BASE
+        session_start = start = time.monotonic()
+
+        with self._pool.connection() as substrate:
+            ToolUtils.deposit_money_to_multsig_wallet(substrate, self._logger, kp_consumer, self._kp_provider, token_num)
+        start = self.record('deposit', start)
+
+        with self._pool.connection() as substrate:
+            ToolUtils.send_service_request(substrate, self._logger, kp_consumer, self._kp_provider, token_num)
+        P2PUtils.send_service_request(self._r, kp_consumer, self._kp_provider.ss58_address, token_num)
+        ack = self._reader.wait_for(consumer, P2PMessage.EventType.SERVICE_REQUEST_ACK, args.timeout)
+        if ack.service_requested_ack_data.resp.error:
+            raise IOError(f'{consumer} was refused: {ack.service_requested_ack_data.resp.message}')
+        self.record('service_request', start)
+
+        time.sleep(args.charging_time)
+        start = time.monotonic()
+        P2PUtils.send_stop_charging(self._r, True, consumer)
+        self._reader.wait_for(consumer, P2PMessage.EventType.STOP_CHARGE_RESPONSE, args.timeout)
+        start = self.record('stop', start)
+
+        delivered = self._reader.wait_for(consumer, P2PMessage.EventType.SERVICE_DELIVERED, args.timeout)
+        start = self.record('settlement', start)
+
+        data = delivered.service_delivered_data
+        with self._pool.connection() as substrate:
+            for info in [data.spent_info, data.refund_info]:
+                ToolUtils.approve_token(substrate, self._logger, kp_consumer, [data.provider], 2, delivered_info(info))
+        self.record('approve', start)
+        self.record('session', session_start)
+
+    def run_user(self, kp_consumer: Keypair):
+        try:
+            self.run_session(kp_consumer)
+            with self._lock:
+                self._completed += 1
+        except Exception as err:
+            self._logger.error(f'session of {kp_consumer.ss58_address} failed: {err}')
+            with self._lock:
+                self._failed += 1
+
+    def run(self, consumers: [Keypair]) -> dict:
+        threading.Thread(target=self._reader.run, daemon=True).start()
+        args = self._args
+        threads = []
+        start = time.monotonic()
+        for kp_consumer, at in zip(consumers, arrival_times(args.profile, len(consumers), args.rate, args.ramp, args.seed)):
+            time.sleep(max(start + at - time.monotonic(), 0))
+            thread = threading.Thread(target=self.run_user, args=(kp_consumer,))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return summarize(self._latencies, self._completed, self._failed, time.monotonic() - start)
+
+
+def show_report(report: dict):
+    logging.info(f'{report["completed"]} sessions completed, {report["failed"]} failed in {report["elapsed"]:.1f}s, '
+                 f'{report["sessions_per_hour"]:.1f} sessions/hour')
+    for stage, stats in report['stages'].items():
+        logging.info(f'{stage:>16}: {stats["count"]:>5} ' + ' '.join(
+            [f'p{p} {stats[f"p{p}"]:8.3f}s' for p in PERCENTILES]))
+
+
+if __name__ == '__main__':
+    args = parse_arguement()
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(filename)s:%(lineno)d - %(levelname)s : %(message)s')
+
+    kp_provider = ConfigUtils.get_account_from_env('PROVIDER')
+    base_uri = os.environ.get('CONSUMER_URI') or os.environ.get('CONSUMER_MNEMONIC')
+    if not base_uri:
+        raise IOError('please setup the consumer secret key')
+    consumers = derive_consumers(base_uri.replace('"', ''), args.users)
+
+    params = parse_redis_config(args.rconfig)
+    r = RedisTransport.init_transport(init_redis(params[0], params[1], params[2]),
+                                      params[4], params[5], params[6])
+    WireUtils.set_wire_mode(params[3])
+
+    generator = LoadGenerator(r, args.node_ws, kp_provider, args)
+    if args.fund:
+        generator.fund(consumers)
+    report = generator.run(consumers)
+    show_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -10,7 +10,8 @@ sys.path.append(BASE_DIR)
 
 from substrateinterface import Keypair
 import src.p2p_utils as P2PUtils
-import src.user_utils as UserUtils
+import src.wire_utils as WireUtils
+import src.redis_transport as RedisTransport
 
 from src.chain_utils import get_substrate_connection, generate_key_pair_from_mnemonic
 from src.chain_utils import parse_redis_config, init_redis
@@ -20,7 +21,6 @@ from src import config_utils as ConfigUtils
 import utils as ToolUtils
 
 from peaq_network_ev_charging_message_format.python import p2p_message_format_pb2 as P2PMessage
-import redis
 import socketio
 import json
 
@@ -46,6 +46,8 @@ def parse_arguement():
                         type=str, default='etc/redis.yaml')
     parser.add_argument('--p2p', help='wait for p2p client request',
                         action='store_true')
+    parser.add_argument('--charging_time', help='seconds to charge before sending the stop',
+                        type=float, default=10)
     return parser.parse_args()
 
 
@@ -107,13 +109,15 @@ def user_simulation_test(ws_url: str,
 
 class RedisMonitor():
     def __init__(self,
-                 r: redis.Redis,
+                 r: RedisTransport.RedisTransport,
                  ws_url: str,
                  be_url: str,
                  p2p_flag: bool,
                  kp_consumer: Keypair,
-                 threshold: int):
+                 threshold: int,
+                 charging_time: float):
         self._threshold = threshold
+        self._charging_time = charging_time
         self._kp_consumer = kp_consumer
         self._substrate = get_substrate_connection(ws_url)
         self._sio = socketio.Client()
@@ -127,54 +131,51 @@ class RedisMonitor():
         self._sio.disconnect()
 
     def redis_reader(self):
-        subcriber = r.pubsub()
-        subcriber.subscribe(REDIS_OUT)
-        # subcriber.subscribe(REDIS_IN)
+        subcriber = self._r.subscribe(REDIS_OUT, RedisTransport.SCOPE_SHARED, 'user-simulation')
 
         while True:
-            event_data = subcriber.get_message(True, timeout=30000.0)
-
-            if not event_data:
-                continue
-
-            event = UserUtils.decode_hex_event(event_data['data'].decode('ascii'))
-
-            if event.event_id == P2PMessage.EventType.SERVICE_REQUEST_ACK:
-                if not self._p2p_flag:
-                    time.sleep(10)
-                    logging.info('✅ ---- send request !!')
-                    self._sio.emit('json', json.dumps({
-                        'type': 'UserChargingStop',
-                        'data': True,
-                    }))
-                else:
-                    logging.info('⚠️ ⚠️ ⚠️  Please send the charging stop!!')
-
-            if event.event_id == P2PMessage.EventType.SERVICE_DELIVERED:
-                provider_addr = event.service_delivered_data.provider
-                refund_info = {
-                    'token_num': int(event.service_delivered_data.refund_info.token_num),
-                    'timepoint': {
-                        'height': event.service_delivered_data.refund_info.time_point.height,
-                        'index': event.service_delivered_data.refund_info.time_point.index,
-                    },
-                    'call_hash': event.service_delivered_data.refund_info.call_hash
-                }
-                spent_info = {
-                    'token_num': int(event.service_delivered_data.spent_info.token_num),
-                    'timepoint': {
-                        'height': event.service_delivered_data.spent_info.time_point.height,
-                        'index': event.service_delivered_data.spent_info.time_point.index,
-                    },
-                    'call_hash': event.service_delivered_data.spent_info.call_hash
-                }
-                ToolUtils.approve_token(
-                    self._substrate, logging.getLogger('logger'), self._kp_consumer,
-                    [provider_addr], self._threshold, spent_info)
-                ToolUtils.approve_token(
-                    self._substrate, logging.getLogger('logger'), self._kp_consumer,
-                    [provider_addr], self._threshold, refund_info)
-            logging.info(f"{event.event_id}: {event}")
+            for message in subcriber.read():
+                self.process_event(WireUtils.decode_event(message.data))
+                subcriber.ack(message)
+
+    def process_event(self, event):
+        if event.event_id == P2PMessage.EventType.SERVICE_REQUEST_ACK:
+            if not self._p2p_flag:
+                time.sleep(self._charging_time)
+                logging.info('✅ ---- send request !!')
+                self._sio.emit('json', json.dumps({
+                    'type': 'UserChargingStop',
+                    'data': True,
+                    'consumer': self._kp_consumer.ss58_address,
+                }))
+            else:
+                logging.info('⚠️ ⚠️ ⚠️  Please send the charging stop!!')
+
+        if event.event_id == P2PMessage.EventType.SERVICE_DELIVERED:
+            provider_addr = event.service_delivered_data.provider
+            refund_info = {
+                'token_num': int(event.service_delivered_data.refund_info.token_num),
+                'timepoint': {
+                    'height': event.service_delivered_data.refund_info.time_point.height,
+                    'index': event.service_delivered_data.refund_info.time_point.index,
+                },
+                'call_hash': event.service_delivered_data.refund_info.call_hash
+            }
+            spent_info = {
+                'token_num': int(event.service_delivered_data.spent_info.token_num),
+                'timepoint': {
+                    'height': event.service_delivered_data.spent_info.time_point.height,
+                    'index': event.service_delivered_data.spent_info.time_point.index,
+                },
+                'call_hash': event.service_delivered_data.spent_info.call_hash
+            }
+            ToolUtils.approve_token(
+                self._substrate, logging.getLogger('logger'), self._kp_consumer,
+                [provider_addr], self._threshold, spent_info)
+            ToolUtils.approve_token(
+                self._substrate, logging.getLogger('logger'), self._kp_consumer,
+                [provider_addr], self._threshold, refund_info)
+        logging.info(f"{event.event_id}: {event}")
 
 
 # Only print
@@ -224,8 +225,10 @@ if __name__ == '__main__':
     monitor_thread.start()
 
     params = parse_redis_config(args.rconfig)
-    r = init_redis(params[0], params[1], params[2])
-    redis_monitor = RedisMonitor(r, args.node_ws, args.be_url, args.p2p, kp_consumer, 2)
+    r = RedisTransport.init_transport(init_redis(params[0], params[1], params[2]),
+                                      params[4], params[5], params[6])
+    WireUtils.set_wire_mode(params[3])
+    redis_monitor = RedisMonitor(r, args.node_ws, args.be_url, args.p2p, kp_consumer, 2, args.charging_time)
     read_redis_thread = Thread(target=redis_monitor.redis_reader)
     read_redis_thread.start()
 